@@ -1,19 +1,12 @@
 # add_data.py - Add your actual manufacturing data
-import requests
+import io
 import json
 
-# Your Flask app URL
-BASE_URL = "http://localhost:5000"
+from app import app, db, IMPORT_MODELS, User, inventory_changed, ledger, low_stock
+from importer import import_stream
 
-# Login first (using your demo credentials)
-login_data = {
-    "email": "admin@example.com",
-    "password": "admin123"
-}
-
-# First, we need to simulate login by creating a session
-# Since we're running locally, we'll use the database directly
-# Let me give you a simpler method:
+# Account that will own the data (the demo admin by default)
+OWNER_EMAIL = "admin@example.com"
 
 print("Adding your seal manufacturing data...")
 
@@ -37,11 +30,24 @@ parts = [
     {"name": "Oring", "material_type": "Rubber", "specific_type": "NBR/Viton", "weight_per_unit": 0.1, "current_stock": 1000},
 ]
 
-print("✅ Data ready to add to your inventory system")
-print("\nTo add manually, use the web interface at:")
-print("http://localhost:5000")
-print("\nOr use the API endpoints:")
-print("POST /api/materials - Add raw materials")
-print("POST /api/parts - Add parts")
-print("\nExample material data:")
-print(json.dumps(raw_materials[0], indent=2))
\ No newline at end of file
+def load(kind, records, company_id):
+    # Same bulk upsert path as POST /api/import/<kind> and `flask import`
+    stream = io.StringIO("\n".join(json.dumps(r) for r in records))
+    summary = import_stream(db.session, IMPORT_MODELS[kind], kind, company_id, stream, "ndjson")
+    ledger.reconcile(db.session, company_id, kind.rstrip("s"))
+    low_stock.refresh(db.session, company_id, kind.rstrip("s"))
+    db.session.commit()
+    print(f"   {kind}: {summary['inserted']} added, {summary['updated']} updated, {summary['failed']} failed")
+
+with app.app_context():
+    user = User.query.filter_by(email=OWNER_EMAIL).first()
+    if user is None:
+        raise SystemExit(f"No user {OWNER_EMAIL} - run app.py once to create the database")
+    load("materials", raw_materials, user.company_id)
+    load("parts", parts, user.company_id)
+    inventory_changed(user.company_id)
+
+print("✅ Data added to your inventory system")
+print("\nFor larger files use the bulk importer:")
+print("flask --app app import materials materials.csv --user admin@example.com")
+print("POST /api/import/materials - CSV or NDJSON body")
@@ -0,0 +1,148 @@
+# alerts.py - Reorder-point alerts kept as a small per-tenant index
+#
+# The stock_alerts table holds one row per item currently below its
+# min_stock. It is maintained incrementally: whenever the ledger moves stock,
+# only the touched items are re-evaluated, inside the same transaction. Views
+# read the table instead of scanning the catalog. A separate worker
+# (`flask alerts`) sends rows that have not been notified yet to the
+# configured sinks.
+#
+#   ALERT_SINKS        comma-separated sink names (default "log")
+#   ALERT_WEBHOOK_URL  target for the "webhook" sink
+#   ALERT_INTERVAL     seconds between worker passes (default 60)
+import json
+import logging
+import os
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+log = logging.getLogger('inventory.alerts')
+
+
+class LowStockIndex:
+    """Keeps alert rows in step with current_stock < min_stock.
+
+    `items` maps a reference_type to a model with id, company_id,
+    current_stock and min_stock columns.
+    """
+
+    def __init__(self, alert_model, items):
+        self.alert = alert_model
+        self.items = items
+
+    def refresh(self, session, company_id, reference_type, ids=None):
+        """Re-evaluate the given items (all of the tenant's when ids is None)"""
+        model = self.items.get(reference_type)
+        if model is None:
+            return
+        alert = self.alert
+        stmt = select(model.id, model.current_stock, model.min_stock).where(model.company_id == company_id)
+        existing_stmt = select(alert.reference_id).where(alert.company_id == company_id,
+                                                         alert.reference_type == reference_type)
+        if ids is not None:
+            ids = list(ids)
+            stmt = stmt.where(model.id.in_(ids))
+            existing_stmt = existing_stmt.where(alert.reference_id.in_(ids))
+
+        rows = session.execute(stmt).all()
+        below = {r.id: r for r in rows if (r.current_stock or 0) < (r.min_stock or 0)}
+        existing = set(session.execute(existing_stmt).scalars())
+        # Items that recovered (or no longer exist) drop out
+        recovered = existing - set(below)
+        if recovered:
+            session.execute(delete(alert).where(alert.company_id == company_id,
+                                                alert.reference_type == reference_type,
+                                                alert.reference_id.in_(recovered)))
+        raised = [{
+            'company_id': company_id,
+            'reference_type': reference_type,
+            'reference_id': item_id,
+            'current_stock': row.current_stock,
+            'min_stock': row.min_stock,
+            'raised_at': datetime.utcnow(),
+        } for item_id, row in below.items() if item_id not in existing]
+        if raised:
+            session.execute(insert(alert), raised)
+        # Keep the stock figure on still-open alerts current
+        still_low = [{'b_id': item_id, 'b_stock': row.current_stock}
+                     for item_id, row in below.items() if item_id in existing]
+        if still_low:
+            table = alert.__table__
+            session.execute(
+                update(table)
+                .where(table.c.company_id == company_id, table.c.reference_type == reference_type,
+                       table.c.reference_id == bindparam('b_id'))
+                .values(current_stock=bindparam('b_stock', type_=table.c.current_stock.type)),
+                still_low
+            )
+
+    def on_stock_change(self, session, company_id, changed, rows=None):
+        """Ledger hook: `changed` maps reference_type to the ids that moved"""
+        for reference_type, ids in changed.items():
+            if reference_type in self.items:
+                self.refresh(session, company_id, reference_type, ids)
+
+
+# ============== SINKS ==============
+
+class LogSink:
+    def emit(self, alerts):
+        for a in alerts:
+            log.warning('Low stock: %s %s (%s) at %s, minimum %s', a['reference_type'],
+                        a['reference_id'], a.get('name'), a['current_stock'], a['min_stock'])
+
+
+class WebhookSink:
+    """POSTs a JSON batch to ALERT_WEBHOOK_URL; stand-in for Slack/email integrations"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def emit(self, alerts):
+        body = json.dumps({'alerts': alerts}, default=str).encode()
+        request = urllib.request.Request(self.url, data=body,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+SINKS = {
+    'log': lambda env: LogSink(),
+    'webhook': lambda env: WebhookSink(env['ALERT_WEBHOOK_URL']),
+}
+
+
+def build_sinks(env=os.environ):
+    names = [n.strip() for n in env.get('ALERT_SINKS', 'log').split(',') if n.strip()]
+    unknown = [n for n in names if n not in SINKS]
+    if unknown:
+        raise ValueError(f'Unknown alert sinks: {unknown}')
+    return [SINKS[n](env) for n in names]
+
+
+def notify_pending(session, alert_model, sinks, describe=None):
+    """Send alerts not yet notified to every sink, then mark them; caller commits.
+
+    `describe(alerts)` may add display fields (e.g. names) before sending.
+    Sink errors propagate so the rows stay pending for the next pass.
+    """
+    alert = alert_model
+    rows = session.execute(
+        select(alert.id, alert.company_id, alert.reference_type, alert.reference_id,
+               alert.current_stock, alert.min_stock, alert.raised_at)
+        .where(alert.notified_at.is_(None))
+        .order_by(alert.id)
+    ).all()
+    if not rows:
+        return 0
+    alerts = [dict(r._mapping) for r in rows]
+    if describe is not None:
+        describe(alerts)
+    for sink in sinks:
+        sink.emit(alerts)
+    session.execute(update(alert).where(alert.id.in_([r.id for r in rows]))
+                    .values(notified_at=datetime.utcnow()))
+    return len(rows)
@@ -1,86 +1,302 @@
-﻿from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+﻿from flask import (Blueprint, Flask, Response, current_app, render_template, request, jsonify,
+                   redirect, url_for, session, stream_with_context)
+from sqlalchemy import event
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.exc import IntegrityError
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, ROUND_HALF_UP
+import hashlib
+import io
+import json
 import os
+import time
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'seal-inventory-secret-2024')
+import click
 
-# Database configuration for Render
-DATABASE_URL = os.environ.get('DATABASE_URL')
-if DATABASE_URL:
-    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
-    
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+from alerts import LowStockIndex, build_sinks, notify_pending
+from assembly import check_availability, flatten, requirements
+from cache import TTLCache
+from compression import install as install_compression
+from costing import CENT, allocate_runs
+from database import (db, AssemblyComponent, AssemblyRun, BomLine, CollectionVersion, Company, Job,
+                      Part, Product, ProductionOutput, ProductionRun, RawMaterial, StockAlert,
+                      StockSnapshot, Transaction, User, ItemCost, CostLayer, ValuationPeriod)
+from db_config import engine_options, install_sqlite_pragmas, install_statement_timeout
+from importer import DEFAULT_CHUNK_SIZE, import_stream, text_stream
+from jobs import JobQueue, QueueFull
+from ledger import Ledger
+from metrics import install as install_metrics
+from mrp import bom_matrix, plan
+from ratelimit import TokenBucketLimiter
+from search import CatalogSearch
+from valuation import Valuation
+
+# Routes and CLI commands live on this blueprint; create_app() (bottom of the
+# file) builds the Flask app around it. cli_group=None keeps `flask snapshot`
+# etc. as top-level commands.
+bp = Blueprint('inventory', __name__, cli_group=None)
 
-db = SQLAlchemy(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-# ============== DATABASE MODELS ==============
-class User(UserMixin, db.Model):
-    __tablename__ = 'users'
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-    company_name = db.Column(db.String(200))
-    role = db.Column(db.String(50), default='user')  # ADDED: role field
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-class RawMaterial(db.Model):
-    __tablename__ = 'raw_materials'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    name = db.Column(db.String(100), nullable=False)
-    grade = db.Column(db.String(50))
-    unit = db.Column(db.String(20))
-    current_stock = db.Column(db.Numeric(12,4), default=0)
-    min_stock = db.Column(db.Numeric(12,4), default=0)
-    avg_cost = db.Column(db.Numeric(12,4), default=0)
-
-class Part(db.Model):
-    __tablename__ = 'parts'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    name = db.Column(db.String(100), nullable=False)
-    material_type = db.Column(db.String(50))
-    specific_type = db.Column(db.String(100))
-    weight_per_unit = db.Column(db.Numeric(10,4))
-    current_stock = db.Column(db.Integer, default=0)
-    avg_cost = db.Column(db.Numeric(12,4), default=0)
-
-class Product(db.Model):
-    __tablename__ = 'products'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    name = db.Column(db.String(100), nullable=False)
-    size = db.Column(db.String(50))
-    current_stock = db.Column(db.Integer, default=0)
-    selling_price = db.Column(db.Numeric(12,4), default=0)
+login_manager.login_view = 'inventory.login'
+
+# ============== LOGIN THROTTLING ==============
+# Token buckets per client IP and per account, checked before any User
+# query or hash. A successful login returns its tokens.
+#   LOGIN_IP_BURST / LOGIN_IP_PER_MINUTE            (default 20 / 10)
+#   LOGIN_ACCOUNT_BURST / LOGIN_ACCOUNT_PER_MINUTE  (default 5 / 2)
+#   TRUSTED_PROXIES  reverse proxies in front of the app, for X-Forwarded-For
+login_ip_limiter = TokenBucketLimiter(int(os.getenv('LOGIN_IP_BURST', 20)),
+                                      int(os.getenv('LOGIN_IP_PER_MINUTE', 10)) / 60)
+login_account_limiter = TokenBucketLimiter(int(os.getenv('LOGIN_ACCOUNT_BURST', 5)),
+                                           int(os.getenv('LOGIN_ACCOUNT_PER_MINUTE', 2)) / 60)
+
+def _throttled(retry_after):
+    response = Response("Too many login attempts, try again later", status=429)
+    if retry_after:
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response
+
+ITEM_MODELS = {'material': RawMaterial, 'part': Part, 'product': Product}
+low_stock = LowStockIndex(StockAlert, {'material': RawMaterial})
+valuation = Valuation(ItemCost, CostLayer, ValuationPeriod, ITEM_MODELS)
+ledger = Ledger(Transaction, StockSnapshot, ITEM_MODELS,
+                listeners=[low_stock.on_stock_change, valuation.on_post],
+                costs=valuation.average_costs)
+catalog_search = CatalogSearch(ITEM_MODELS, CollectionVersion)
+
+# ============== SESSION IDENTITY ==============
+# current_user is served from a per-worker cache of lightweight snapshots, so
+# authenticated requests do not re-read the users table. With
+# IDENTITY_IN_SESSION=1 the snapshot also rides in the signed session cookie
+# and a cold worker can skip the lookup until the snapshot is USER_CACHE_TTL old.
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 4096)),
+                      ttl=int(os.getenv('USER_CACHE_TTL', 300)))
+
+class SessionUser:
+    """Read-only view of a User for Flask-Login; carries no ORM state"""
+    __slots__ = ('id', 'email', 'company_id', 'company_name', 'role')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, email, company_id, company_name, role):
+        self.id = id
+        self.email = email
+        self.company_id = company_id
+        self.company_name = company_name
+        self.role = role
+
+    def get_id(self):
+        return str(self.id)
+
+    def to_session(self):
+        return [self.id, self.email, self.company_id, self.company_name, self.role, time.time()]
+
+def _identity_from_session(user_id):
+    snapshot = session.get('identity')
+    if not current_app.config['IDENTITY_IN_SESSION'] or not snapshot or snapshot[0] != user_id:
+        return None
+    # Cookies written before company tenancy have no company_id
+    if len(snapshot) != 6:
+        return None
+    age = time.time() - snapshot[5]
+    if age > user_cache.ttl:
+        return None
+    identity = SessionUser(*snapshot[:5])
+    # Cached only for the rest of the snapshot's lifetime, so USER_CACHE_TTL
+    # still bounds how stale the identity can be
+    user_cache.set(user_id, identity, ttl=user_cache.ttl - age)
+    return identity
+
+def remember_identity(user):
+    """Cache the identity of a freshly authenticated user"""
+    identity = SessionUser(user.id, user.email, user.company_id, user.company_name, user.role)
+    user_cache.set(user.id, identity)
+    if current_app.config['IDENTITY_IN_SESSION']:
+        session['identity'] = identity.to_session()
+    return identity
+
+def forget_identity(user_id):
+    user_cache.invalidate(user_id)
+    session.pop('identity', None)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    # Password, role or company changes must not be served from the cache
+    user_cache.invalidate(target.id)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    # A hit is not re-set: the entry expires USER_CACHE_TTL after it was loaded,
+    # however active the user is, so changes made in other workers show up
+    user = user_cache.get(user_id) or _identity_from_session(user_id)
+    if user is None:
+        row = db.session.execute(
+            db.select(User.id, User.email, User.company_id, Company.name.label('company_name'),
+                      User.role)
+            .outerjoin(Company, Company.id == User.company_id)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        return remember_identity(row)
+    return user
+
+# ============== TENANCY ==============
+# Inventory belongs to a company and every user of that company shares it.
+# Tenant data is read through tenant_select()/tenant_get(), which always add
+# the company filter; outside a request (CLI, jobs) pass company_id explicitly.
+def current_company_id():
+    company_id = getattr(current_user, 'company_id', None)
+    if company_id is None:
+        raise PermissionError('No company for the current user')
+    return company_id
+
+def tenant_select(model, *columns, company_id=None):
+    """SELECT columns (default: the model) from one company's rows of model"""
+    if company_id is None:
+        company_id = current_company_id()
+    return db.select(*(columns or (model,))).where(model.company_id == company_id)
+
+def tenant_get(model, id, company_id=None):
+    """The company's row with this id, or None (also for other companies' rows)"""
+    return db.session.execute(
+        tenant_select(model, company_id=company_id).where(model.id == id)
+    ).scalar_one_or_none()
+
+# ============== DASHBOARD STATS ==============
+# Counters change only when a write handler commits, so they are cached per
+# company under the collection versions inventory_changed() bumps; a write in
+# any worker makes every worker's entry stale.
+dashboard_cache = TTLCache(maxsize=int(os.getenv('DASHBOARD_CACHE_SIZE', 1024)),
+                           ttl=int(os.getenv('DASHBOARD_CACHE_TTL', 300)))
+
+def _query_dashboard_stats(company_id):
+    """All dashboard counters in a single SELECT of scalar subqueries"""
+    def tenant(model, column, *criteria):
+        return tenant_select(model, column, company_id=company_id).where(*criteria).scalar_subquery()
+
+    def value(model):
+        return db.func.coalesce(db.func.sum(model.current_stock * model.avg_cost), 0)
+
+    count = db.func.count()
+    row = db.session.execute(db.select(
+        tenant(RawMaterial, count).label('materials'),
+        tenant(Part, count).label('parts'),
+        tenant(Product, count).label('products'),
+        tenant(RawMaterial, value(RawMaterial)).label('material_value'),
+        tenant(Part, value(Part)).label('part_value'),
+        tenant(StockAlert, count).label('low_stock')
+    )).one()
+    return {
+        'materials': row.materials,
+        'parts': row.parts,
+        'products': row.products,
+        'stock_value': round(float(row.material_value) + float(row.part_value), 2),
+        'low_stock': row.low_stock
+    }
+
+def dashboard_stats(company_id):
+    versions = collection_versions(company_id)
+    cached = dashboard_cache.get(company_id)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+    stats = _query_dashboard_stats(company_id)
+    dashboard_cache.set(company_id, (versions, stats))
+    return stats
+
+def inventory_changed(company_id, *collections):
+    """Called after every committed write to a tenant's inventory.
+
+    Bumps the version of the given collections (all of them by default) so
+    list ETags change. The bump commits after the data it describes, so a
+    client can never cache new rows under an old ETag.
+    """
+    dashboard_cache.invalidate(company_id)
+    bump_collection_versions(company_id, collections or COLLECTIONS)
+
+# ============== COLLECTION VERSIONS ==============
+COLLECTIONS = ('materials', 'parts', 'products')
+
+def collection_version(company_id, collection):
+    return db.session.execute(
+        tenant_select(CollectionVersion, CollectionVersion.version, company_id=company_id)
+        .where(CollectionVersion.collection == collection)
+    ).scalar() or 0
+
+def collection_versions(company_id, collections=COLLECTIONS):
+    """Versions of several collections in one query, in the order given"""
+    versions = dict(db.session.execute(
+        tenant_select(CollectionVersion, CollectionVersion.collection, CollectionVersion.version,
+                      company_id=company_id)
+        .where(CollectionVersion.collection.in_(collections))
+    ).all())
+    return tuple(versions.get(c, 0) for c in collections)
+
+def bump_collection_versions(company_id, collections):
+    table = CollectionVersion.__table__
+    known = set(db.session.execute(
+        db.select(table.c.collection).where(table.c.company_id == company_id)
+    ).scalars())
+    missing = [c for c in collections if c not in known]
+    if missing:
+        try:
+            db.session.execute(db.insert(table), [{'company_id': company_id, 'collection': c, 'version': 0}
+                                                  for c in missing])
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created them first
+            db.session.rollback()
+    db.session.execute(
+        db.update(table)
+        .where(table.c.company_id == company_id, table.c.collection.in_(collections))
+        .values(version=table.c.version + 1)
+    )
+    db.session.commit()
+
+# ============== BILLS OF MATERIALS ==============
+# Each tenant's BOMs are flattened to leaf parts once and cached, so
+# availability checks never walk the tree. Assemblies consume parts from this
+# cache, so entries are keyed on the company's 'boms' collection version,
+# which every BOM write bumps: a write in one worker is seen by all of them
+# on their next lookup, at the cost of one primary-key read.
+bom_cache = TTLCache(maxsize=int(os.getenv('BOM_CACHE_SIZE', 1024)),
+                     ttl=int(os.getenv('BOM_CACHE_TTL', 3600)))
+
+def _load_bom_lines(company_id):
+    return db.session.execute(
+        tenant_select(BomLine, BomLine.product_id, BomLine.component_type, BomLine.component_id,
+                      BomLine.quantity, company_id=company_id)
+    ).all()
+
+def flat_boms(company_id):
+    """{product_id: {part_id: quantity per unit}} for every product with a BOM"""
+    version = collection_version(company_id, 'boms')
+    cached = bom_cache.get(company_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    flat = flatten(_load_bom_lines(company_id))
+    bom_cache.set(company_id, (version, flat))
+    return flat
+
+def bom_changed(company_id):
+    """Called after a committed BOM write"""
+    bom_cache.invalidate(company_id)
+    bump_collection_versions(company_id, ('boms',))
 
 # ============== ROUTES ==============
-@app.route('/')
+@bp.route('/')
 def home():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
     return render_template('login.html')
 
-@app.route('/api/health')
+@bp.route('/api/health')
 def health_check():
     from datetime import datetime
     return jsonify({
@@ -89,259 +305,1514 @@ def health_check():
         'timestamp': datetime.utcnow().isoformat()
     })
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+        account = (email or '').strip().lower()
+        ip_allowed, ip_retry = login_ip_limiter.acquire(request.remote_addr)
+        if not ip_allowed:
+            return _throttled(ip_retry)
+        account_allowed, account_retry = login_account_limiter.acquire(account)
+        if not account_allowed:
+            return _throttled(account_retry)
+        
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            login_ip_limiter.refund(request.remote_addr)
+            login_account_limiter.refund(account)
+            if user.needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
-            return redirect(url_for('dashboard'))
+            remember_identity(user)
+            return redirect(url_for('.dashboard'))
         return "Invalid credentials", 401
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
         company = request.form.get('company_name')
+        allowed, retry = login_ip_limiter.acquire(request.remote_addr)
+        if not allowed:
+            return _throttled(retry)
         
         if User.query.filter_by(email=email).first():
             return "Email already exists", 400
         
-        user = User(email=email, company_name=company)
+        # A new sign-up starts a company and administers it; colleagues are
+        # added from /api/company/users
+        user = User(email=email, company=Company(name=company or email), role='admin')
         user.set_password(password)
         db.session.add(user)
         db.session.commit()
         
         login_user(user)
-        return redirect(url_for('dashboard'))
+        remember_identity(user)
+        return redirect(url_for('.dashboard'))
     return render_template('register.html')
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
-    materials = RawMaterial.query.filter_by(user_id=current_user.id).count()
-    parts = Part.query.filter_by(user_id=current_user.id).count()
-    products = Product.query.filter_by(user_id=current_user.id).count()
+    stats = dashboard_stats(current_user.company_id)
     
     return render_template('dashboard.html',
-                         materials_count=materials,
-                         parts_count=parts,
-                         products_count=products)
+                         materials_count=stats['materials'],
+                         parts_count=stats['parts'],
+                         products_count=stats['products'],
+                         stock_value=stats['stock_value'],
+                         low_stock_count=stats['low_stock'])
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
+    forget_identity(current_user.id)
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
+
+# ============== COMPANY USERS ==============
+@bp.route('/api/company/users', methods=['GET', 'POST'])
+@login_required
+def company_users_api():
+    """Colleagues sharing this company's inventory; admins may add accounts"""
+    if request.method == 'POST':
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Only company admins can add users'}), 403
+        data = request.json or {}
+        email = (data.get('email') or '').strip().lower()
+        role = data.get('role', 'user')
+        if not email or not data.get('password'):
+            return jsonify({'error': 'email and password are required'}), 400
+        if role not in ('admin', 'user'):
+            return jsonify({'error': f'Unknown role: {role}'}), 400
+        if User.query.filter_by(email=email).first():
+            return jsonify({'error': 'Email already exists'}), 400
+        user = User(email=email, company_id=current_user.company_id, role=role)
+        user.set_password(data['password'])
+        db.session.add(user)
+        db.session.commit()
+        return jsonify({'success': True, 'id': user.id})
+
+    users = db.session.execute(
+        tenant_select(User, User.id, User.email, User.role, User.created_at).order_by(User.id)
+    ).all()
+    return jsonify({'company': current_user.company_name, 'users': [{
+        'id': u.id,
+        'email': u.email,
+        'role': u.role,
+        'created_at': u.created_at.isoformat() if u.created_at else None
+    } for u in users]})
+
+# ============== LIST STREAMING ==============
+# List endpoints select only the serialized columns and walk the table in
+# keyset order (id > cursor), so no ORM objects are built and memory stays
+# flat regardless of catalog size.
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+MATERIAL_COLUMNS = (RawMaterial.id, RawMaterial.name, RawMaterial.current_stock,
+                    RawMaterial.unit, RawMaterial.avg_cost)
+PART_COLUMNS = (Part.id, Part.name, Part.material_type, Part.current_stock,
+                Part.weight_per_unit)
+
+def _serialize_material(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'current_stock': float(row.current_stock or 0),
+        'unit': row.unit,
+        'avg_cost': float(row.avg_cost or 0)
+    }
+
+def _serialize_part(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'material_type': row.material_type,
+        'current_stock': row.current_stock,
+        'weight_per_unit': float(row.weight_per_unit) if row.weight_per_unit else 0
+    }
+
+def _fetch_page(model, columns, company_id, after, limit):
+    stmt = (tenant_select(model, *columns, company_id=company_id)
+            .where(model.id > after)
+            .order_by(model.id)
+            .limit(limit))
+    return db.session.execute(stmt).all()
+
+# Streamed lists yield one chunk per batch: compression flushes after every
+# chunk, and per-row flushes would undo most of the compression
+def _iter_batches(model, columns, company_id, after=0, batch_size=STREAM_BATCH_SIZE):
+    while True:
+        rows = _fetch_page(model, columns, company_id, after, batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1].id
+
+def _wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def _list_etag(collection, company_id, ndjson):
+    # The body depends on the collection version, the query string and the format
+    query = hashlib.sha1(request.query_string).hexdigest()[:12]
+    version = collection_version(company_id, collection)
+    return f"{collection}-{company_id}-{version}-{query}{'-nd' if ndjson else ''}"
+
+def _list_response(model, columns, serialize, collection):
+    """Tenant-scoped list as a keyset page, NDJSON stream or streamed JSON array"""
+    # ?limit=N&after=ID  -> one page plus next_cursor
+    # ?format=ndjson     -> one object per line
+    # (no params)        -> the full array, streamed in batches
+    # If-None-Match with the current ETag -> 304 without reading any rows
+    company_id = current_user.company_id
+    ndjson = _wants_ndjson()
+    try:
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    etag = _list_etag(collection, company_id, ndjson)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif limit is not None and not ndjson:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = _fetch_page(model, columns, company_id, after, limit)
+        response = jsonify({
+            'items': [serialize(r) for r in rows],
+            'next_cursor': rows[-1].id if len(rows) == limit else None
+        })
+    elif ndjson:
+        def generate():
+            for rows in _iter_batches(model, columns, company_id, after):
+                yield ''.join(json.dumps(serialize(row)) + '\n' for row in rows)
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    else:
+        def generate():
+            yield '['
+            separator = ''
+            for rows in _iter_batches(model, columns, company_id, after):
+                yield separator + ','.join(json.dumps(serialize(row)) for row in rows)
+                separator = ','
+            yield ']'
+        response = Response(stream_with_context(generate()), mimetype='application/json')
+
+    # Weak: the same rows may be sent gzip-, brotli- or un-encoded
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept')
+    return response
+
+# ============== PRODUCTION POSTING ==============
+def _decimal(value, field):
+    """Request value as a Decimal; anything else is a ValueError (400), not a 500"""
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValueError(f'{field} must be a number')
+    return number
+
+def _output_quantity(output):
+    quantity = _decimal(output.get('quantity'), 'Output quantity')
+    if quantity <= 0 or quantity != quantity.to_integral_value():
+        raise ValueError(f"Output quantity for {output.get('part_name') or output.get('part_id')} "
+                         "must be a positive whole number")
+    return int(quantity)
+
+def allocate_production_cost(input_cost, outputs):
+    """Split input_cost over outputs in proportion to weight * quantity"""
+    allocation = allocate_runs([(input_cost, [(o.get('weight', 0), o.get('quantity', 0))
+                                              for o in outputs])])[0]
+    if 'error' in allocation:
+        raise ValueError(allocation['error'])
+
+    results = [{
+        'part_name': output.get('part_name'),
+        'quantity': output.get('quantity', 0),
+        'output_weight': output_weight,
+        'allocated_cost': allocated_cost,
+        'cost_per_unit': cost_per_unit
+    } for output, output_weight, allocated_cost, cost_per_unit in zip(
+        outputs, allocation['output_weight'], allocation['allocated_cost'],
+        allocation['cost_per_unit'])]
+    return allocation['total_weight'], allocation['cost_per_kg'], results
+
+def _resolve_output_parts(company_id, outputs):
+    """Attach part ids (and default weights) to outputs with one query"""
+    ids = {o['part_id'] for o in outputs if o.get('part_id')}
+    names = {o['part_name'] for o in outputs if not o.get('part_id') and o.get('part_name')}
+    rows = db.session.execute(
+        tenant_select(Part, Part.id, Part.name, Part.weight_per_unit, company_id=company_id)
+        .where(db.or_(Part.id.in_(ids), Part.name.in_(names)))
+    ).all()
+    by_id = {r.id: r for r in rows}
+    by_name = {r.name: r for r in rows}
+
+    resolved = []
+    for output in outputs:
+        part = by_id.get(output.get('part_id')) or by_name.get(output.get('part_name'))
+        if part is None:
+            raise ValueError(f"Unknown part: {output.get('part_id') or output.get('part_name')}")
+        weight = output.get('weight')
+        if weight is None:
+            weight = float(part.weight_per_unit or 0)
+        resolved.append(dict(output, part_id=part.id, part_name=part.name, weight=weight,
+                             quantity=_output_quantity(output)))
+    return resolved
+
+def post_production_run(company_id, data, created_by=None):
+    """Write a production run, its outputs, stock/cost updates and ledger rows.
+
+    Everything is sent as a handful of set-based statements (bulk inserts and
+    executemany updates with in-database arithmetic, see Ledger.post) inside
+    one transaction, so the number of round-trips does not grow with the
+    number of outputs.
+    """
+    outputs = _resolve_output_parts(company_id, data.get('outputs', []))
+
+    material = None
+    material_id = data.get('input_material_id')
+    if material_id:
+        material = db.session.execute(
+            tenant_select(RawMaterial, RawMaterial.id, RawMaterial.current_stock, RawMaterial.avg_cost,
+                          company_id=company_id)
+            .where(RawMaterial.id == material_id)
+        ).first()
+        if material is None:
+            raise ValueError(f'Unknown material: {material_id}')
+
+    total_weight, _, _ = allocate_production_cost(0, outputs)
+    if data.get('input_quantity') is None:
+        input_quantity = total_weight
+    else:
+        input_quantity = _decimal(data['input_quantity'], 'input_quantity')
+        if input_quantity <= 0:
+            raise ValueError('input_quantity must be positive')
+    if 'input_cost' in data:
+        input_cost = _decimal(data['input_cost'], 'input_cost')
+        if input_cost < 0:
+            raise ValueError('input_cost must not be negative')
+    elif material is not None:
+        input_cost = input_quantity * (material.avg_cost or 0)
+    else:
+        input_cost = Decimal(0)
+    input_cost = input_cost.quantize(CENT, ROUND_HALF_UP)
+    if material is not None and (material.current_stock or 0) < input_quantity:
+        raise ValueError('Insufficient material stock')
+
+    total_weight, cost_per_kg, results = allocate_production_cost(input_cost, outputs)
+    now = datetime.utcnow()
+
+    run = ProductionRun(
+        company_id=company_id,
+        input_material_id=material_id if material is not None else None,
+        input_quantity=round(input_quantity, 4),
+        input_cost=round(input_cost, 4),
+        total_output_weight=round(total_weight, 4),
+        cost_per_kg=round(cost_per_kg, 4),
+        production_date=now,
+        created_by=created_by
+    )
+    db.session.add(run)
+    db.session.flush()
+
+    db.session.execute(db.insert(ProductionOutput), [{
+        'run_id': run.id,
+        'part_id': output['part_id'],
+        'quantity_produced': result['quantity'],
+        'output_weight': round(result['output_weight'], 4),
+        'allocated_cost': round(result['allocated_cost'], 4),
+        'cost_per_unit': round(result['cost_per_unit'], 4)
+    } for output, result in zip(outputs, results)])
+
+    movements = [{
+        'transaction_type': 'PRODUCTION',
+        'reference_type': 'part',
+        'reference_id': output['part_id'],
+        'quantity': result['quantity'],
+        'unit_price': result['cost_per_unit'],
+        'total_value': result['allocated_cost'],
+        'notes': f'Production run #{run.id}'
+    } for output, result in zip(outputs, results)]
+    if material is not None:
+        movements.append({
+            'transaction_type': 'PRODUCTION',
+            'reference_type': 'material',
+            'reference_id': material.id,
+            'quantity': -input_quantity,
+            'unit_price': input_cost / input_quantity if input_quantity else 0,
+            'total_value': -input_cost,
+            'notes': f'Consumed by production run #{run.id}'
+        })
+
+    # Stock, part avg_cost and ledger rows in one set of statements
+    ledger.post(db.session, company_id, movements, now=now, created_by=created_by)
+    db.session.commit()
+    inventory_changed(company_id)
+    return run.id, input_cost, cost_per_kg, results
+
+def _post_opening_stock(reference_type, item_id, quantity, unit_price=None):
+    """Stock given when an item is created enters through the ledger"""
+    if quantity:
+        ledger.post(db.session, current_user.company_id, [{
+            'transaction_type': 'ADJUSTMENT',
+            'reference_type': reference_type,
+            'reference_id': item_id,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'notes': 'Opening balance'
+        }], created_by=current_user.id)
 
 # ============== API ENDPOINTS ==============
-@app.route('/api/materials', methods=['GET', 'POST'])
+@bp.route('/api/materials', methods=['GET', 'POST'])
 @login_required
 def materials_api():
     if request.method == 'POST':
         data = request.json
         material = RawMaterial(
-            user_id=current_user.id,
+            company_id=current_user.company_id,
             name=data['name'],
             grade=data.get('grade'),
             unit=data.get('unit', 'kg'),
-            current_stock=data.get('current_stock', 0),
+            current_stock=0,
+            min_stock=data.get('min_stock', 0),
             avg_cost=data.get('avg_cost', 0)
         )
         db.session.add(material)
+        db.session.flush()
+        _post_opening_stock('material', material.id, data.get('current_stock'), data.get('avg_cost'))
+        low_stock.refresh(db.session, current_user.company_id, 'material', [material.id])
         db.session.commit()
+        inventory_changed(current_user.company_id, 'materials')
         return jsonify({'success': True, 'id': material.id})
     
-    materials = RawMaterial.query.filter_by(user_id=current_user.id).all()
-    return jsonify([{
-        'id': m.id,
-        'name': m.name,
-        'current_stock': float(m.current_stock),
-        'unit': m.unit,
-        'avg_cost': float(m.avg_cost)
-    } for m in materials])
-
-@app.route('/api/parts', methods=['GET', 'POST'])
+    return _list_response(RawMaterial, MATERIAL_COLUMNS, _serialize_material, 'materials')
+
+@bp.route('/api/parts', methods=['GET', 'POST'])
 @login_required
 def parts_api():
     if request.method == 'POST':
         data = request.json
+        material_id = data.get('material_id')
+        if material_id is not None and tenant_get(RawMaterial, material_id) is None:
+            return jsonify({'error': f'Unknown material: {material_id}'}), 400
         part = Part(
-            user_id=current_user.id,
+            company_id=current_user.company_id,
             name=data['name'],
             material_type=data.get('material_type'),
             specific_type=data.get('specific_type'),
             weight_per_unit=data.get('weight_per_unit', 0),
-            current_stock=data.get('current_stock', 0)
+            material_id=material_id,
+            current_stock=0
         )
         db.session.add(part)
+        db.session.flush()
+        _post_opening_stock('part', part.id, data.get('current_stock'))
         db.session.commit()
+        inventory_changed(current_user.company_id, 'parts')
         return jsonify({'success': True, 'id': part.id})
     
-    parts = Part.query.filter_by(user_id=current_user.id).all()
-    return jsonify([{
-        'id': p.id,
-        'name': p.name,
-        'material_type': p.material_type,
-        'current_stock': p.current_stock,
-        'weight_per_unit': float(p.weight_per_unit) if p.weight_per_unit else 0
-    } for p in parts])
-
-@app.route('/api/production/run', methods=['POST'])
+    return _list_response(Part, PART_COLUMNS, _serialize_part, 'parts')
+
+@bp.route('/api/production/run', methods=['POST'])
 @login_required
 def create_production():
     """Multi-output production with cost allocation"""
     data = request.json
     
-    # Calculate cost allocation based on weight
-    input_cost = float(data.get('input_cost', 0))
-    outputs = data.get('outputs', [])
-    
-    # Calculate total weight
-    total_weight = sum(float(o.get('weight', 0)) * o.get('quantity', 0) for o in outputs)
-    
-    if total_weight == 0:
-        return jsonify({'error': 'No valid outputs'}), 400
+    # "post": true persists the run; otherwise this is a cost preview
+    try:
+        if data.get('post'):
+            run_id, input_cost, cost_per_kg, results = post_production_run(
+                current_user.company_id, data, created_by=current_user.id)
+        else:
+            run_id = None
+            input_cost = _decimal(data.get('input_cost', 0), 'input_cost')
+            outputs = [dict(o, quantity=_output_quantity(o)) for o in data.get('outputs', [])]
+            _, cost_per_kg, results = allocate_production_cost(input_cost, outputs)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     
-    cost_per_kg = input_cost / total_weight
+    response = {
+        'success': True,
+        'input_cost': float(input_cost),
+        'cost_per_kg': _money(cost_per_kg),
+        'outputs': [{
+            'part_name': r['part_name'],
+            'quantity': r['quantity'],
+            'allocated_cost': _money(r['allocated_cost']),
+            'cost_per_unit': _money(r['cost_per_unit'])
+        } for r in results]
+    }
+    if run_id is not None:
+        response['run_id'] = run_id
+    return jsonify(response)
+
+def _money(value):
+    return float(Decimal(value).quantize(CENT, ROUND_HALF_UP))
+
+@bp.route('/api/production/allocate', methods=['POST'])
+@login_required
+def allocate_production_batch():
+    """Re-cost many production runs in one call (nothing is written)"""
+    runs = (request.json or {}).get('runs', [])
+    if (not isinstance(runs, list)
+            or not all(isinstance(run, dict) and isinstance(run.get('outputs', []), list)
+                       and all(isinstance(o, dict) for o in run.get('outputs', []))
+                       for run in runs)):
+        return jsonify({'error': 'runs must be a list of objects, each with a list of outputs'}), 400
+    allocations = allocate_runs([
+        (run.get('input_cost', 0), [(o.get('weight', 0), o.get('quantity', 0))
+                                    for o in run.get('outputs', [])])
+        for run in runs
+    ])
     
-    results = []
-    for output in outputs:
-        weight = float(output.get('weight', 0))
-        quantity = output.get('quantity', 0)
-        output_weight = weight * quantity
-        allocated_cost = output_weight * cost_per_kg
-        cost_per_unit = allocated_cost / quantity if quantity > 0 else 0
-        
-        results.append({
-            'part_name': output.get('part_name'),
-            'quantity': quantity,
-            'allocated_cost': round(allocated_cost, 2),
-            'cost_per_unit': round(cost_per_unit, 2)
+    response = []
+    for run, allocation in zip(runs, allocations):
+        if 'error' in allocation:
+            response.append({'id': run.get('id'), 'error': allocation['error']})
+            continue
+        response.append({
+            'id': run.get('id'),
+            'input_cost': float(allocation['input_cost']),
+            'total_weight': float(allocation['total_weight']),
+            'cost_per_kg': float(allocation['cost_per_kg']),
+            'outputs': [{
+                'part_name': output.get('part_name'),
+                'quantity': output.get('quantity', 0),
+                'allocated_cost': float(allocated_cost),
+                'cost_per_unit': float(cost_per_unit)
+            } for output, allocated_cost, cost_per_unit in zip(
+                run.get('outputs', []), allocation['allocated_cost'], allocation['cost_per_unit'])]
         })
-    
+    return jsonify({'success': True, 'runs': response})
+
+# ============== ASSEMBLY ==============
+def _resolve_products(company_id, items):
+    """{product_id: quantity} for items given by product_id, name + size, or a
+    name alone when that name is unique (a trailing size in it is split off)"""
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        raise ValueError('items must be a list of objects')
+    ids = {i['product_id'] for i in items if i.get('product_id')}
+    names = set()
+    for item in items:
+        name = item.get('name')
+        if not item.get('product_id') and isinstance(name, str) and name:
+            names.add(name)
+            if item.get('size') is None and ' ' in name:
+                names.add(name.rsplit(' ', 1)[0])
+    rows = db.session.execute(
+        tenant_select(Product, Product.id, Product.name, Product.size, company_id=company_id)
+        .where(db.or_(Product.id.in_(ids), Product.name.in_(names)))
+    ).all()
+    by_id = {r.id: r for r in rows}
+    by_name = {(r.name, r.size): r for r in rows}
+    sizes = {}
+    for r in rows:
+        sizes.setdefault(r.name, []).append(r)
+
+    def match(item):
+        name, size = item.get('name'), item.get('size')
+        if size is not None or not isinstance(name, str):
+            return by_name.get((name, size))
+        if len(sizes.get(name, ())) == 1:
+            return sizes[name][0]
+        if len(sizes.get(name, ())) > 1:
+            raise ValueError(f"Product {name} comes in several sizes: "
+                             f"{', '.join(sorted(r.size or '' for r in sizes[name]))}")
+        return by_name.get(tuple(name.rsplit(' ', 1))) if ' ' in name else None
+
+    demand = {}
+    for item in items:
+        product = by_id.get(item.get('product_id')) or match(item)
+        if product is None:
+            raise ValueError(f"Unknown product: {item.get('product_id') or item.get('name')}")
+        quantity = _decimal(item.get('quantity', 0), 'quantity')
+        if quantity <= 0 or quantity != quantity.to_integral_value():
+            raise ValueError('quantity must be a positive whole number')
+        demand[product.id] = demand.get(product.id, 0) + int(quantity)
+    return demand
+
+def _part_stock(company_id, part_ids):
+    return {r.id: r for r in db.session.execute(
+        tenant_select(Part, Part.id, Part.current_stock, Part.avg_cost, company_id=company_id)
+        .where(Part.id.in_(part_ids))
+    ).all()}
+
+@bp.route('/api/products/<int:product_id>/bom', methods=['GET', 'PUT'])
+@login_required
+def product_bom_api(product_id):
+    company_id = current_user.company_id
+    if tenant_get(Product, product_id) is None:
+        return jsonify({'error': 'Unknown product'}), 404
+
+    if request.method == 'PUT':
+        components = (request.json or {}).get('components', [])
+        lines = []
+        for component in components:
+            component_type = 'product' if component.get('product_id') else 'part'
+            component_id = component.get('product_id') or component.get('part_id')
+            try:
+                quantity = _decimal(component.get('quantity', 0), 'quantity')
+            except ValueError:
+                quantity = None
+            if not component_id or quantity is None or quantity <= 0:
+                return jsonify({'error': 'Each component needs a part_id or product_id and a positive quantity'}), 400
+            lines.append((product_id, component_type, component_id, quantity))
+
+        for component_type, model in (('part', Part), ('product', Product)):
+            wanted = {l[2] for l in lines if l[1] == component_type}
+            found = set(db.session.execute(
+                tenant_select(model, model.id).where(model.id.in_(wanted))
+            ).scalars())
+            if wanted - found:
+                return jsonify({'error': f'Unknown {component_type} ids: {sorted(wanted - found)}'}), 400
+
+        others = [l for l in _load_bom_lines(company_id) if l.product_id != product_id]
+        try:
+            flatten(others + lines)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        db.session.execute(db.delete(BomLine).where(BomLine.company_id == company_id,
+                                                    BomLine.product_id == product_id))
+        if lines:
+            db.session.execute(db.insert(BomLine), [{
+                'company_id': company_id, 'product_id': p, 'component_type': t,
+                'component_id': c, 'quantity': round(q, 4)
+            } for p, t, c, q in lines])
+        db.session.commit()
+        bom_changed(company_id)
+
+    lines = db.session.execute(
+        tenant_select(BomLine, BomLine.component_type, BomLine.component_id, BomLine.quantity)
+        .where(BomLine.product_id == product_id)
+        .order_by(BomLine.id)
+    ).all()
     return jsonify({
-        'success': True,
-        'input_cost': input_cost,
-        'cost_per_kg': round(cost_per_kg, 2),
-        'outputs': results
+        'product_id': product_id,
+        'components': [{'component_type': l.component_type, 'component_id': l.component_id,
+                        'quantity': float(l.quantity)} for l in lines],
+        'parts': {str(part_id): float(qty)
+                  for part_id, qty in flat_boms(company_id).get(product_id, {}).items()}
     })
 
-def init_db():
-    with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        # Create demo data if no users exist
-        if User.query.count() == 0:  # FIXED: Changed from Company.query
-            print("Creating your seal manufacturing database...")
-            
-            # Create admin user
-            user = User(
-                email="admin@example.com",
-                company_name="Tanvir's Seal Manufacturing",
-                role="admin"
-            )
-            user.set_password("admin123")
-            db.session.add(user)
-            db.session.commit()
-            
-            # ========== ADD YOUR ACTUAL RAW MATERIALS (From Excel Sheet 1) ==========
-            print("Adding your raw materials...")
-            raw_materials = [
-                # name, grade, unit, stock, cost
-                ("Rubber Sheet - NBR", "NBR", "kg", 500, 180),
-                ("Rubber Sheet - Viton", "Viton", "kg", 300, 220),
-                ("Steel Coin", "Carbon Steel", "pieces", 1000, 85),
-                ("Steel Sheet", "SS304", "sheets", 200, 1200),
-                ("Steel Wire", "Spring Steel", "meters", 500, 45),
-                ("SSROD", "SS316", "meters", 150, 350),
-            ]
-            
-            for name, grade, unit, stock, cost in raw_materials:
-                material = RawMaterial(
-                    user_id=user.id,
-                    name=name,
-                    grade=grade,
-                    unit=unit,
-                    current_stock=stock,
-                    avg_cost=cost
-                )
-                db.session.add(material)
-            
-            # ========== ADD YOUR PARTS (From Excel Sheet 2) ==========
-            print("Adding your parts inventory...")
-            parts = [
-                # name, material_type, specific_type, weight_per_unit, stock
-                ("Wati", "Steel", "Wire/Coin/Sheet", 0.5, 800),
-                ("Washer", "Steel", "Wire/Coin/Sheet", 0.3, 600),
-                ("Bellow", "Rubber", "NBR/Viton", 0.8, 400),
-                ("Buch", "Rubber", "NBR/Viton", 0.6, 300),
-                ("Cap", "Rubber", "NBR/Viton", 0.4, 500),
-                ("Oring", "Rubber", "NBR/Viton", 0.1, 1000),
-                ("Spring", "Steel", "Wire", 0.2, 700),
-                ("Rotary face", "Carbon/Ceramic/Tungsten", "Ceramic HW, LW, Pink", 0.7, 200),
-                ("Stationary face", "Carbon/Ceramic/Tungsten", "Ceramic HW, LW, Pink", 0.7, 200),
-            ]
-            
-            for name, material_type, specific_type, weight, stock in parts:
-                part = Part(
-                    user_id=user.id,
-                    name=name,
-                    material_type=material_type,
-                    specific_type=specific_type,
-                    weight_per_unit=weight,
-                    current_stock=stock
-                )
-                db.session.add(part)
-            
-            # ========== ADD YOUR SEAL PRODUCTS (From Excel Sheet 3) ==========
-            print("Adding your seal products...")
-            products = [
-                # name, size
-                ("Open", "50mm"),
-                ("Open", "75mm"),
-                ("Open", "100mm"),
-                ("Close", "50mm"),
-                ("Close", "75mm"),
-                ("Close", "100mm"),
-                ("J2", "25mm"),
-                ("J2", "50mm"),
-                ("J2", "75mm"),
-                ("JC", "50mm"),
-                ("JC", "100mm"),
-                ("Single Robin", "Standard"),
-                ("Double Robin", "Standard"),
-                ("Stork", "Standard"),
-                ("MG", "Standard"),
-                ("Honda", "Standard"),
-                ("Type2100", "Standard"),
-            ]
-            
-            for name, size in products:
-                product = Product(
-                    user_id=user.id,
-                    name=name,
-                    size=size,
-                    current_stock=50,  # Starting stock
-                    selling_price=0  # Will calculate later
-                )
-                db.session.add(product)
-            
+@bp.route('/api/assembly/check', methods=['POST'])
+@login_required
+def assembly_check_api():
+    """Can these products be built from current part stock? One stock query for the whole list"""
+    try:
+        demand = _resolve_products(current_user.company_id, (request.json or {}).get('items', []))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    flat = flat_boms(current_user.company_id)
+    part_ids = {p for product_id in demand for p in flat.get(product_id, {})}
+    stock = {i: r.current_stock for i, r in _part_stock(current_user.company_id, part_ids).items()}
+
+    per_product, shortages = check_availability(flat, demand, stock)
+    return jsonify({
+        'available': not shortages and all(p['available'] for p in per_product.values()),
+        'products': [{'product_id': product_id,
+                      'requested': int(result['requested']),
+                      'buildable': result['buildable'],
+                      'available': result['available'],
+                      'has_bom': bool(flat.get(product_id))}
+                     for product_id, result in per_product.items()],
+        'shortages': [{'part_id': part_id, 'missing': float(missing)}
+                      for part_id, missing in sorted(shortages.items())]
+    })
+
+def post_assembly(company_id, demand, created_by=None):
+    """Consume parts, receive products and record assembly runs in one transaction"""
+    flat = flat_boms(company_id)
+    totals = requirements(flat, demand)
+    parts = _part_stock(company_id, totals)
+    now = datetime.utcnow()
+
+    runs, movements = [], []
+    for product_id, quantity in demand.items():
+        components = []
+        for part_id, per_unit in flat[product_id].items():
+            # Parts are whole pieces; a fractional requirement uses up the piece
+            used = int((per_unit * quantity).to_integral_value(ROUND_CEILING))
+            unit_cost = Decimal(str(parts[part_id].avg_cost or 0)) if part_id in parts else Decimal(0)
+            components.append((part_id, used, unit_cost, used * unit_cost))
+        total_cost = sum(c[3] for c in components)
+        run = AssemblyRun(company_id=company_id, product_id=product_id, quantity_assembled=quantity,
+                          total_cost=round(total_cost, 4),
+                          cost_per_unit=round(total_cost / quantity, 4), assembly_date=now,
+                          created_by=created_by)
+        runs.append((run, components))
+    db.session.add_all(run for run, _ in runs)
+    db.session.flush()
+
+    component_rows = []
+    for run, components in runs:
+        for part_id, used, unit_cost, cost in components:
+            component_rows.append({'assembly_id': run.id, 'part_id': part_id,
+                                   'quantity_used': used, 'unit_cost': round(unit_cost, 4),
+                                   'total_cost': round(cost, 4)})
+            movements.append({'transaction_type': 'ASSEMBLY', 'reference_type': 'part',
+                              'reference_id': part_id, 'quantity': -used,
+                              'unit_price': unit_cost, 'total_value': -cost,
+                              'notes': f'Consumed by assembly #{run.id}'})
+        movements.append({'transaction_type': 'ASSEMBLY', 'reference_type': 'product',
+                          'reference_id': run.product_id, 'quantity': run.quantity_assembled,
+                          'unit_price': run.cost_per_unit, 'total_value': run.total_cost,
+                          'notes': f'Assembly #{run.id}'})
+    db.session.execute(db.insert(AssemblyComponent), component_rows)
+
+    # Raises ValueError (and nothing is committed) if any part would go negative
+    ledger.post(db.session, company_id, movements, now=now, created_by=created_by)
+    db.session.commit()
+    inventory_changed(company_id)
+    return runs
+
+@bp.route('/api/assembly/run', methods=['POST'])
+@login_required
+def assembly_run_api():
+    try:
+        demand = _resolve_products(current_user.company_id, (request.json or {}).get('items', []))
+        runs = post_assembly(current_user.company_id, demand, created_by=current_user.id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'runs': [{
+        'id': run.id,
+        'product_id': run.product_id,
+        'quantity': run.quantity_assembled,
+        'total_cost': _money(run.total_cost),
+        'cost_per_unit': _money(run.cost_per_unit)
+    } for run, _ in runs]})
+
+# ============== LOW-STOCK ALERTS ==============
+@bp.route('/api/alerts/low-stock')
+@login_required
+def low_stock_api():
+    """Items below their reorder point, read from the alert index"""
+    rows = db.session.execute(
+        tenant_select(StockAlert, StockAlert.reference_id, StockAlert.current_stock,
+                      StockAlert.min_stock, StockAlert.raised_at, RawMaterial.name, RawMaterial.unit)
+        .join(RawMaterial, RawMaterial.id == StockAlert.reference_id)
+        .where(StockAlert.reference_type == 'material')
+        .order_by(StockAlert.raised_at)
+    ).all()
+    return jsonify({'items': [{
+        'id': r.reference_id,
+        'name': r.name,
+        'unit': r.unit,
+        'current_stock': float(r.current_stock or 0),
+        'min_stock': float(r.min_stock or 0),
+        'raised_at': r.raised_at.isoformat()
+    } for r in rows]})
+
+def _describe_alerts(alerts):
+    names = dict(db.session.execute(
+        db.select(RawMaterial.id, RawMaterial.name)
+        .where(RawMaterial.id.in_({a['reference_id'] for a in alerts if a['reference_type'] == 'material'}))
+    ).all())
+    for a in alerts:
+        a['name'] = names.get(a['reference_id'])
+
+@bp.cli.command('alerts')
+@click.option('--once', is_flag=True, help='Run a single pass and exit.')
+@click.option('--interval', default=int(os.getenv('ALERT_INTERVAL', 60)), show_default=True,
+              help='Seconds between passes.')
+def alerts_command(once, interval):
+    """Background worker: rebuild the low-stock index, then send new alerts to ALERT_SINKS."""
+    sinks = build_sinks()
+    # Catch up on anything that changed stock while no worker was running
+    for company_id in db.session.execute(db.select(Company.id)).scalars().all():
+        low_stock.refresh(db.session, company_id, 'material')
+        db.session.commit()
+    while True:
+        try:
+            sent = notify_pending(db.session, StockAlert, sinks, _describe_alerts)
             db.session.commit()
-            print("âœ… Database created with YOUR actual manufacturing data!")
-            print(f"   Raw Materials: {len(raw_materials)} items")
-            print(f"   Parts: {len(parts)} items")
-            print(f"   Seal Products: {len(products)} types")
-            print("\nðŸ‘¤ Login: admin@example.com / admin123")
+            if sent:
+                click.echo(f'Sent {sent} low-stock alerts')
+        except Exception as e:
+            db.session.rollback()
+            click.echo(f'Alert delivery failed, will retry: {e}', err=True)
+        if once:
+            return
+        time.sleep(interval)
+
+# ============== MATERIAL PLANNING ==============
+@bp.route('/api/mrp/plan', methods=['POST'])
+@login_required
+def mrp_plan_api():
+    """Net product demand against product, part and raw-material stock (nothing is written)"""
+    company_id = current_user.company_id
+    try:
+        demand = _resolve_products(company_id, (request.json or {}).get('items', []))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    flat = flat_boms(company_id)
+    matrix = bom_matrix({p: flat[p] for p in demand if p in flat})
+    product_stock = dict(db.session.execute(
+        tenant_select(Product, Product.id, Product.current_stock).where(Product.id.in_(demand))
+    ).all())
+    parts = db.session.execute(
+        tenant_select(Part, Part.id, Part.current_stock, Part.weight_per_unit, Part.material_id)
+        .where(Part.id.in_(set(matrix[1])))
+    ).all()
+    material_ids = {p.material_id for p in parts if p.material_id}
+    materials = {r.id: r for r in db.session.execute(
+        tenant_select(RawMaterial, RawMaterial.id, RawMaterial.name, RawMaterial.unit,
+                      RawMaterial.current_stock)
+        .where(RawMaterial.id.in_(material_ids))
+    ).all()}
+
+    result = plan(demand, product_stock, matrix,
+                  {p.id: p.current_stock for p in parts},
+                  {p.id: p.weight_per_unit for p in parts},
+                  {p.id: p.material_id for p in parts if p.material_id in materials},
+                  {m.id: m.current_stock for m in materials.values()})
+
+    def numbers(row):
+        return {k: float(v) if isinstance(v, Decimal) else v for k, v in row.items()}
+
+    return jsonify({
+        'products': [numbers(r) for r in result['products']],
+        'parts': [numbers(r) for r in result['parts']],
+        'materials': [dict(numbers(r), name=materials[r['material_id']].name,
+                           unit=materials[r['material_id']].unit) for r in result['materials']],
+        'without_bom': result['without_bom'],
+        'unmapped_parts': result['unmapped_parts']
+    })
+
+# ============== STOCK LEDGER ==============
+LEDGER_COLUMNS = (Transaction.id, Transaction.transaction_type, Transaction.reference_type,
+                  Transaction.reference_id, Transaction.quantity, Transaction.unit_price,
+                  Transaction.total_value, Transaction.notes, Transaction.transaction_date)
+
+def _serialize_transaction(row):
+    return {
+        'id': row.id,
+        'transaction_type': row.transaction_type,
+        'reference_type': row.reference_type,
+        'reference_id': row.reference_id,
+        'quantity': float(row.quantity or 0),
+        'unit_price': float(row.unit_price) if row.unit_price is not None else None,
+        'total_value': float(row.total_value) if row.total_value is not None else None,
+        'notes': row.notes,
+        'transaction_date': row.transaction_date.isoformat() if row.transaction_date else None
+    }
+
+@bp.route('/api/stock/movements', methods=['POST'])
+@login_required
+def stock_movements_api():
+    """Post purchases, sales and adjustments; all or nothing"""
+    movements = (request.json or {}).get('movements', [])
+    try:
+        rows = ledger.post(db.session, current_user.company_id, movements,
+                           allow_negative=bool((request.json or {}).get('allow_negative')),
+                           created_by=current_user.id)
+    except (KeyError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    inventory_changed(current_user.company_id)
+    return jsonify({'success': True, 'posted': len(rows)})
+
+@bp.route('/api/stock/ledger')
+@login_required
+def stock_ledger_api():
+    """Ledger rows in posting order, keyset-paginated like the list endpoints"""
+    try:
+        after = int(request.args.get('after', 0))
+        limit = max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    stmt = (tenant_select(Transaction, *LEDGER_COLUMNS)
+            .where(Transaction.id > after)
+            .order_by(Transaction.id)
+            .limit(limit))
+    if request.args.get('item_type'):
+        stmt = stmt.where(Transaction.reference_type == request.args['item_type'])
+    if request.args.get('item_id'):
+        stmt = stmt.where(Transaction.reference_id == request.args.get('item_id', type=int))
+    rows = db.session.execute(stmt).all()
+    return jsonify({
+        'items': [_serialize_transaction(r) for r in rows],
+        'next_cursor': rows[-1].id if len(rows) == limit else None
+    })
+
+@bp.route('/api/stock/balances')
+@login_required
+def stock_balances_api():
+    """On-hand balances now, or at ?as_of=<ISO timestamp> from the nearest checkpoint"""
+    item_type = request.args.get('item_type')
+    if item_type is not None and item_type not in ITEM_MODELS:
+        return jsonify({'error': f'Unknown item type: {item_type}'}), 400
+    as_of = request.args.get('as_of')
+    if as_of is not None:
+        try:
+            as_of = datetime.fromisoformat(as_of)
+        except ValueError:
+            return jsonify({'error': 'as_of must be an ISO 8601 timestamp'}), 400
+        balances = ledger.balances_at(db.session, current_user.company_id, as_of, item_type)
+        return jsonify({'as_of': as_of.isoformat(), 'balances': [{
+            'item_type': reference_type,
+            'item_id': reference_id,
+            'quantity': float(quantity),
+            'value': round(float(value), 2)
+        } for (reference_type, reference_id), (quantity, value) in sorted(balances.items())]})
+
+    # Current balances are the materialized current_stock columns
+    balances = []
+    for reference_type, model in ITEM_MODELS.items():
+        if item_type is not None and reference_type != item_type:
+            continue
+        rows = db.session.execute(
+            tenant_select(model, model.id, model.current_stock).order_by(model.id)
+        ).all()
+        balances.extend({'item_type': reference_type, 'item_id': r.id,
+                         'quantity': float(r.current_stock or 0)} for r in rows)
+    return jsonify({'as_of': None, 'balances': balances})
+
+@bp.cli.command('snapshot')
+@click.option('--user', 'email', help="Only checkpoint this account's company (default: all).")
+def snapshot_command(email):
+    """Checkpoint stock balances so historical queries stay fast; run periodically."""
+    companies = Company.query.order_by(Company.id)
+    if email:
+        companies = companies.join(User).filter(User.email == email)
+    companies = companies.all()
+    if email and not companies:
+        raise click.ClickException(f'No user with email {email}')
+    for company in companies:
+        count = ledger.checkpoint(db.session, company.id)
+        db.session.commit()
+        click.echo(f"{company.name}: {count} balances")
+
+# ============== SEARCH ==============
+# ?q= matches name, grade, material_type, specific_type and size by prefix,
+# substring or trigram similarity; item_type, material_type and unit filter
+# the results, and the facet counts cover every match. See search.py.
+MAX_SEARCH_PAGE_SIZE = 100
+
+@bp.route('/api/search')
+@login_required
+def search_api():
+    item_type = request.args.get('item_type')
+    if item_type is not None and item_type not in ITEM_MODELS:
+        return jsonify({'error': f'Unknown item type: {item_type}'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        results = catalog_search.search(db.session, current_user.company_id, request.args.get('q', ''),
+                                        item_type=item_type,
+                                        material_type=request.args.get('material_type'),
+                                        unit=request.args.get('unit'), limit=limit, offset=offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(results, query=request.args.get('q')))
+
+# ============== VALUATION ==============
+# Served from the aggregates valuation.py maintains on every ledger post;
+# ?from= / ?to= take months as YYYY-MM.
+def _period_args():
+    start, end = request.args.get('from'), request.args.get('to')
+    for value in (start, end):
+        if value is not None:
+            datetime.strptime(value, '%Y-%m')
+    return start, end
+
+def _item_names(keys):
+    """{(reference_type, id): display name} with one query per item type"""
+    names = {}
+    by_type = {}
+    for reference_type, reference_id in keys:
+        by_type.setdefault(reference_type, set()).add(reference_id)
+    for reference_type, ids in by_type.items():
+        model = ITEM_MODELS[reference_type]
+        columns = (model.id, model.name, model.size) if model is Product else (model.id, model.name)
+        for row in db.session.execute(tenant_select(model, *columns).where(model.id.in_(ids))):
+            names[(reference_type, row.id)] = f'{row.name} {row.size}' if model is Product else row.name
+    return names
+
+def _numbers(row):
+    return {k: round(float(v), 4) if isinstance(v, Decimal) else v for k, v in row.items()}
+
+@bp.route('/api/valuation/stock')
+@login_required
+def valuation_stock_api():
+    """On-hand value per item at moving average and at FIFO"""
+    item_type = request.args.get('item_type')
+    if item_type is not None and item_type not in ITEM_MODELS:
+        return jsonify({'error': f'Unknown item type: {item_type}'}), 400
+    items = valuation.stock(db.session, current_user.company_id, item_type)
+    names = _item_names((i['reference_type'], i['reference_id']) for i in items)
+    return jsonify({
+        'total_value_avg': round(float(sum(i['value_avg'] for i in items)), 2),
+        'total_value_fifo': round(float(sum(i['value_fifo'] for i in items)), 2),
+        'items': [dict(_numbers(i), name=names.get((i['reference_type'], i['reference_id'])))
+                  for i in items]
+    })
+
+@bp.route('/api/valuation/periods')
+@login_required
+def valuation_periods_api():
+    """Monthly receipts, issues, COGS, revenue and closing stock value"""
+    item_type = request.args.get('item_type')
+    if item_type is not None and item_type not in ITEM_MODELS:
+        return jsonify({'error': f'Unknown item type: {item_type}'}), 400
+    try:
+        start, end = _period_args()
+    except ValueError:
+        return jsonify({'error': 'from and to must be months as YYYY-MM'}), 400
+    periods = valuation.periods(db.session, current_user.company_id, start, end, item_type)
+    return jsonify({'periods': [_numbers(p) for p in periods]})
+
+@bp.route('/api/valuation/margins')
+@login_required
+def valuation_margins_api():
+    """Per product: realized margin, and margin at the current selling_price"""
+    try:
+        start, end = _period_args()
+    except ValueError:
+        return jsonify({'error': 'from and to must be months as YYYY-MM'}), 400
+    rows = valuation.margins(db.session, current_user.company_id, start, end)
+    products = {r.id: r for r in db.session.execute(
+        tenant_select(Product, Product.id, Product.name, Product.size, Product.selling_price)
+        .where(Product.id.in_([r['reference_id'] for r in rows]))
+    )}
+    result = []
+    for row in rows:
+        product_id = row.pop('reference_id')
+        product = products.get(product_id)
+        list_revenue = row['qty_sold'] * Decimal(str(product.selling_price or 0)) if product else Decimal(0)
+        result.append(_numbers(dict(
+            row,
+            product_id=product_id,
+            name=f'{product.name} {product.size}' if product else None,
+            selling_price=product.selling_price if product else None,
+            margin_fifo=row['revenue'] - row['cogs_fifo'],
+            margin_avg=row['revenue'] - row['cogs_avg'],
+            margin_pct=(row['revenue'] - row['cogs_avg']) / row['revenue'] * 100 if row['revenue'] else None,
+            list_revenue=list_revenue,
+            list_margin_avg=list_revenue - row['cogs_avg'],
+        )))
+    return jsonify({'from': start, 'to': end, 'products': result})
+
+def _revalue(companies):
+    for company in companies:
+        replayed = valuation.rebuild(db.session, company.id, Transaction)
+        db.session.commit()
+        click.echo(f"{company.name}: revalued {replayed} ledger rows")
+
+@bp.cli.command('revalue')
+@click.option('--user', 'email', help="Only this account's company (default: all).")
+def revalue_command(email):
+    """Rebuild FIFO layers and valuation aggregates from the full ledger."""
+    companies = Company.query.order_by(Company.id)
+    if email:
+        companies = companies.join(User).filter(User.email == email)
+    companies = companies.all()
+    if email and not companies:
+        raise click.ClickException(f'No user with email {email}')
+    _revalue(companies)
+
+# ============== BULK IMPORT ==============
+IMPORT_MODELS = {'materials': RawMaterial, 'parts': Part, 'products': Product}
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+def _reconcile_import(kind, company_id):
+    # Imported stock levels are set directly; record the difference as adjustments
+    ledger.reconcile(db.session, company_id, kind.rstrip('s'))
+    low_stock.refresh(db.session, company_id, kind.rstrip('s'))
+    db.session.commit()
+
+@bp.route('/api/import/<kind>', methods=['POST'])
+@login_required
+def import_api(kind):
+    """Bulk upsert from a CSV or NDJSON body (or a multipart 'file' upload)"""
+    model = IMPORT_MODELS.get(kind)
+    if model is None:
+        return jsonify({'error': f'Unknown import type: {kind}'}), 404
+    
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        mimetype = upload.mimetype if upload else request.mimetype
+        fmt = 'ndjson' if mimetype in ('application/x-ndjson', 'application/json') else 'csv'
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    chunk_size = max(1, request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int))
+    
+    stream = text_stream(upload.stream if upload else request.stream)
+    if request.args.get('async') == '1':
+        # Large files: store the body and let the job worker import it
+        return _submit_job('import', {'kind': kind, 'format': fmt, 'chunk_size': chunk_size},
+                           payload=stream.read())
+    summary = import_stream(db.session, model, kind, current_user.company_id, stream, fmt, chunk_size)
+    _reconcile_import(kind, current_user.company_id)
+    inventory_changed(current_user.company_id, kind)
+    return jsonify(dict(summary, success=True))
+
+@bp.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_MODELS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'email', required=True, help="Email of an account of the company that owns the data.")
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+def import_command(kind, path, email, fmt, chunk_size):
+    """Bulk import materials, parts or products from a CSV or NDJSON file."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f'No user with email {email}')
+    if fmt is None:
+        fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+    
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        summary = import_stream(db.session, IMPORT_MODELS[kind], kind, user.company_id, f, fmt,
+                                chunk_size)
+    _reconcile_import(kind, user.company_id)
+    inventory_changed(user.company_id, kind)
+    
+    click.echo(f"Inserted {summary['inserted']}, updated {summary['updated']}, "
+               f"failed {summary['failed']}")
+    for error in summary['errors']:
+        click.echo(f"  line {error['line']}: {error['error']}", err=True)
+
+# ============== BACKGROUND JOBS ==============
+RECOST_BATCH_SIZE = 500
+
+def _import_job(job):
+    kind = job.params['kind']
+    payload = job.payload or ''
+    total = max(1, payload.count('\n'))
+
+    def on_chunk(summary):
+        done = summary['inserted'] + summary['updated'] + summary['failed']
+        job.progress(min(99, done * 100 // total))
+
+    summary = import_stream(db.session, IMPORT_MODELS[kind], kind, job.company_id,
+                            io.StringIO(payload, newline=''), job.params['format'],
+                            job.params.get('chunk_size', DEFAULT_CHUNK_SIZE), on_chunk)
+    _reconcile_import(kind, job.company_id)
+    inventory_changed(job.company_id, kind)
+    return summary
+
+def _recost_inputs(params):
+    """{run_id: corrected input_cost} from the job's input_costs param"""
+    input_costs = params.get('input_costs') or {}
+    if not isinstance(input_costs, dict):
+        raise ValueError('input_costs must map run ids to costs')
+    corrected = {}
+    for run_id, cost in input_costs.items():
+        cost = _decimal(cost, f'input_cost for run {run_id}')
+        if cost < 0:
+            raise ValueError(f'input_cost for run {run_id} must not be negative')
+        corrected[int(run_id)] = cost
+    return corrected
+
+def _recost_job(job):
+    """Re-cost stored production runs; writes only with apply=true.
+
+    New input costs come from `input_costs` ({run_id: cost}) or, with
+    `reprice_materials`, from the input material's current avg_cost. Applied
+    changes rewrite the runs and outputs and post a REVALUATION per changed
+    output, so part stock value, cost layers and avg_cost follow.
+    """
+    runs = ProductionRun.__table__
+    corrected = _recost_inputs(job.params)
+    reprice = bool(job.params.get('reprice_materials'))
+    criteria = [runs.c.company_id == job.company_id]
+    if job.params.get('since'):
+        criteria.append(runs.c.production_date >= datetime.fromisoformat(job.params['since']))
+    if job.params.get('until'):
+        criteria.append(runs.c.production_date <= datetime.fromisoformat(job.params['until']))
+    if corrected and not reprice:
+        criteria.append(runs.c.id.in_(list(corrected)))
+    apply = bool(job.params.get('apply'))
+    total = db.session.execute(db.select(db.func.count()).where(*criteria)).scalar() or 1
+
+    summary = {'runs': 0, 'outputs': 0, 'changed': 0, 'cost_delta': Decimal(0)}
+    after = 0
+    while True:
+        batch = db.session.execute(
+            db.select(runs.c.id, runs.c.input_cost, runs.c.input_quantity, runs.c.input_material_id)
+            .where(runs.c.id > after, *criteria)
+            .order_by(runs.c.id).limit(RECOST_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        after = batch[-1].id
+        outputs = db.session.execute(
+            db.select(ProductionOutput.id, ProductionOutput.run_id, ProductionOutput.part_id,
+                      ProductionOutput.quantity_produced, ProductionOutput.output_weight,
+                      ProductionOutput.allocated_cost)
+            .where(ProductionOutput.run_id.in_([r.id for r in batch]))
+            .order_by(ProductionOutput.run_id, ProductionOutput.id)
+        ).all()
+        by_run = {}
+        for output in outputs:
+            by_run.setdefault(output.run_id, []).append(output)
+        material_costs = {}
+        if reprice:
+            material_costs = dict(db.session.execute(
+                tenant_select(RawMaterial, RawMaterial.id, RawMaterial.avg_cost,
+                              company_id=job.company_id)
+                .where(RawMaterial.id.in_({r.input_material_id for r in batch}))
+            ).all())
+
+        input_costs = []
+        for run in batch:
+            if run.id in corrected:
+                input_costs.append(corrected[run.id])
+            elif run.input_material_id in material_costs:
+                input_costs.append(Decimal(str(run.input_quantity or 0))
+                                   * Decimal(str(material_costs[run.input_material_id] or 0)))
+            else:
+                input_costs.append(run.input_cost)
+        # Stored output_weight is weight x quantity; allocate_runs wants them apart
+        allocations = allocate_runs([
+            (cost, [((o.output_weight or 0) / o.quantity_produced if o.quantity_produced else 0,
+                     o.quantity_produced or 0) for o in by_run.get(run.id, [])])
+            for run, cost in zip(batch, input_costs)
+        ])
+        output_updates, run_updates, movements = [], [], []
+        for run, allocation in zip(batch, allocations):
+            if 'error' in allocation:
+                continue
+            run_updates.append({'b_id': run.id, 'b_cost': allocation['input_cost'],
+                                'b_rate': allocation['cost_per_kg']})
+            for output, cost, per_unit in zip(by_run[run.id], allocation['allocated_cost'],
+                                              allocation['cost_per_unit']):
+                summary['outputs'] += 1
+                delta = cost - (output.allocated_cost or 0)
+                if delta:
+                    summary['changed'] += 1
+                    summary['cost_delta'] += delta
+                    output_updates.append({'b_id': output.id, 'b_cost': cost, 'b_unit': per_unit})
+                    movements.append({'transaction_type': 'REVALUATION', 'reference_type': 'part',
+                                      'reference_id': output.part_id, 'quantity': 0,
+                                      'total_value': delta,
+                                      'notes': f'Recost of production run #{run.id}'})
+        summary['runs'] += len(batch)
+
+        if apply and output_updates:
+            table = ProductionOutput.__table__
+            db.session.execute(
+                db.update(table).where(table.c.id == db.bindparam('b_id'))
+                .values(allocated_cost=db.bindparam('b_cost', type_=table.c.allocated_cost.type),
+                        cost_per_unit=db.bindparam('b_unit', type_=table.c.cost_per_unit.type)),
+                output_updates)
+            db.session.execute(
+                db.update(runs).where(runs.c.id == db.bindparam('b_id'))
+                .values(input_cost=db.bindparam('b_cost', type_=runs.c.input_cost.type),
+                        cost_per_kg=db.bindparam('b_rate', type_=runs.c.cost_per_kg.type)),
+                run_updates)
+            # Part values, cost layers and avg_cost move through the ledger
+            ledger.post(db.session, job.company_id, movements, created_by=job.created_by)
+        db.session.commit()
+        job.progress(min(99, summary['runs'] * 100 // total))
+
+    if apply and summary['changed']:
+        inventory_changed(job.company_id, 'parts')
+    summary['applied'] = apply
+    summary['cost_delta'] = float(summary['cost_delta'])
+    return summary
+
+def _stock_report_job(job):
+    as_of = job.params.get('as_of')
+    balances = ledger.balances_at(db.session, job.company_id,
+                                  datetime.fromisoformat(as_of) if as_of else None,
+                                  job.params.get('item_type'))
+    return {'as_of': as_of, 'balances': [{
+        'item_type': reference_type,
+        'item_id': reference_id,
+        'quantity': float(quantity),
+        'value': round(float(value), 2)
+    } for (reference_type, reference_id), (quantity, value) in sorted(balances.items())]}
+
+JOB_HANDLERS = {
+    'import': _import_job,
+    'recost': _recost_job,
+    'stock_report': _stock_report_job,
+}
+job_queue = JobQueue(Job, JOB_HANDLERS)
+
+def _serialize_job(job, detail=False):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error': job.error
+    }
+    if detail:
+        data['params'] = json.loads(job.params) if job.params else {}
+        data['result'] = json.loads(job.result) if job.result else None
+    return data
+
+def _submit_job(kind, params, payload=None):
+    try:
+        job = job_queue.submit(db.session, current_user.company_id, kind, params, payload,
+                               created_by=current_user.id)
+    except QueueFull as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 429
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    response = jsonify({'success': True, 'job': _serialize_job(job)})
+    response.status_code = 202
+    response.headers['Location'] = url_for('.job_api', job_id=job.id)
+    return response
+
+@bp.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+def jobs_api():
+    """POST {"kind": "recost" | "stock_report", "params": {...}} queues a job"""
+    if request.method == 'POST':
+        data = request.json or {}
+        if data.get('kind') == 'import':
+            return jsonify({'error': 'Use POST /api/import/<kind>?async=1'}), 400
+        return _submit_job(data.get('kind'), data.get('params') or {})
+
+    jobs = db.session.execute(
+        tenant_select(Job, Job.id, Job.kind, Job.status, Job.progress, Job.created_at,
+                      Job.started_at, Job.finished_at, Job.error)
+        .order_by(Job.id.desc()).limit(100)
+    ).all()
+    return jsonify({'jobs': [_serialize_job(j) for j in jobs]})
+
+@bp.route('/api/jobs/<int:job_id>')
+@login_required
+def job_api(job_id):
+    job = tenant_get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(_serialize_job(job, detail=True))
+
+@bp.cli.command('jobs')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+def jobs_command(once):
+    """Background worker: run queued jobs (JOB_WORKERS threads, JOBS_PER_TENANT each)."""
+    job_queue.serve(current_app._get_current_object(), lambda: db.session, once=once)
+
+# ============== SCHEMA & SEED ==============
+# Nothing here runs at import or worker boot: create_app() never touches the
+# database. Deploys run `flask init-db` once (render.yaml preDeployCommand);
+# every step is idempotent, so running it again is a no-op.
+def _upgrade_schema():
+    """Create missing tables and apply pending migrations; returns the versions applied"""
+    from migrations import LEDGER_MIGRATIONS, VALUATION_MIGRATION, upgrade  # only the CLI needs these
+
+    db.create_all()
+    applied = upgrade(db.engine, db.metadata)
+    companies = Company.query.order_by(Company.id).all()
+    if set(LEDGER_MIGRATIONS) & set(applied):
+        # On-hand stock that never went through the ledger enters it as adjustments
+        for company in companies:
+            ledger.checkpoint(db.session, company.id)
+        db.session.commit()
+    if VALUATION_MIGRATION in applied:
+        # Cost layers for stock that was posted before valuation existed
+        _revalue(companies)
+    return applied
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Create missing tables and apply pending schema migrations."""
+    applied = _upgrade_schema()
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+@bp.cli.command('init-db')
+@click.option('--seed/--no-seed', default=True,
+              help='Load the demo company if there are no users yet (default: on).')
+def init_db_command(seed):
+    """Create or upgrade the schema and seed demo data; safe to run on every deploy."""
+    applied = init_db(seed=seed)
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+def init_db(seed=True):
+    """Bring the schema up to date and, with `seed`, load demo data into an empty
+    database. Needs an app context."""
+    applied = _upgrade_schema()
+    if seed and User.query.count() == 0:
+        _seed_demo_company()
+    return applied
+
+def _seed_demo_company():
+    print("Creating your seal manufacturing database...")
+    
+    # Create admin user
+    user = User(
+        email="admin@example.com",
+        company=Company(name="Tanvir's Seal Manufacturing"),
+        role="admin"
+    )
+    user.set_password("admin123")
+    db.session.add(user)
+    db.session.commit()
+    
+    # ========== ADD YOUR ACTUAL RAW MATERIALS (From Excel Sheet 1) ==========
+    print("Adding your raw materials...")
+    raw_materials = [
+        # name, grade, unit, stock, cost
+        ("Rubber Sheet - NBR", "NBR", "kg", 500, 180),
+        ("Rubber Sheet - Viton", "Viton", "kg", 300, 220),
+        ("Steel Coin", "Carbon Steel", "pieces", 1000, 85),
+        ("Steel Sheet", "SS304", "sheets", 200, 1200),
+        ("Steel Wire", "Spring Steel", "meters", 500, 45),
+        ("SSROD", "SS316", "meters", 150, 350),
+    ]
+    
+    for name, grade, unit, stock, cost in raw_materials:
+        material = RawMaterial(
+            company_id=user.company_id,
+            name=name,
+            grade=grade,
+            unit=unit,
+            current_stock=stock,
+            avg_cost=cost
+        )
+        db.session.add(material)
+    
+    # ========== ADD YOUR PARTS (From Excel Sheet 2) ==========
+    print("Adding your parts inventory...")
+    parts = [
+        # name, material_type, specific_type, weight_per_unit, stock
+        ("Wati", "Steel", "Wire/Coin/Sheet", 0.5, 800),
+        ("Washer", "Steel", "Wire/Coin/Sheet", 0.3, 600),
+        ("Bellow", "Rubber", "NBR/Viton", 0.8, 400),
+        ("Buch", "Rubber", "NBR/Viton", 0.6, 300),
+        ("Cap", "Rubber", "NBR/Viton", 0.4, 500),
+        ("Oring", "Rubber", "NBR/Viton", 0.1, 1000),
+        ("Spring", "Steel", "Wire", 0.2, 700),
+        ("Rotary face", "Carbon/Ceramic/Tungsten", "Ceramic HW, LW, Pink", 0.7, 200),
+        ("Stationary face", "Carbon/Ceramic/Tungsten", "Ceramic HW, LW, Pink", 0.7, 200),
+    ]
+    
+    for name, material_type, specific_type, weight, stock in parts:
+        part = Part(
+            company_id=user.company_id,
+            name=name,
+            material_type=material_type,
+            specific_type=specific_type,
+            weight_per_unit=weight,
+            current_stock=stock
+        )
+        db.session.add(part)
+    
+    # ========== ADD YOUR SEAL PRODUCTS (From Excel Sheet 3) ==========
+    print("Adding your seal products...")
+    products = [
+        # name, size
+        ("Open", "50mm"),
+        ("Open", "75mm"),
+        ("Open", "100mm"),
+        ("Close", "50mm"),
+        ("Close", "75mm"),
+        ("Close", "100mm"),
+        ("J2", "25mm"),
+        ("J2", "50mm"),
+        ("J2", "75mm"),
+        ("JC", "50mm"),
+        ("JC", "100mm"),
+        ("Single Robin", "Standard"),
+        ("Double Robin", "Standard"),
+        ("Stork", "Standard"),
+        ("MG", "Standard"),
+        ("Honda", "Standard"),
+        ("Type2100", "Standard"),
+    ]
+    
+    for name, size in products:
+        product = Product(
+            company_id=user.company_id,
+            name=name,
+            size=size,
+            current_stock=50,  # Starting stock
+            selling_price=0  # Will calculate later
+        )
+        db.session.add(product)
+    
+    db.session.commit()
+    # Opening balances become the first ledger rows and checkpoint
+    ledger.checkpoint(db.session, user.company_id)
+    low_stock.refresh(db.session, user.company_id, 'material')
+    db.session.commit()
+    print("âœ… Database created with YOUR actual manufacturing data!")
+    print(f"   Raw Materials: {len(raw_materials)} items")
+    print(f"   Parts: {len(parts)} items")
+    print(f"   Seal Products: {len(products)} types")
+    print("\nðŸ‘¤ Login: admin@example.com / admin123")
+
+# ============== APPLICATION FACTORY ==============
+def create_app(config=None):
+    """Build the app from the environment (plus `config` overrides).
+
+    Only wires up extensions, hooks and the blueprint: engines connect lazily
+    and the schema is left to `flask init-db`, so worker boot does no I/O.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'seal-inventory-secret-2024')
+
+    # Database configuration for Render
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url.replace("postgres://", "postgresql://", 1)
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # PASSWORD_HASH_METHOD: Werkzeug method string for new hashes, see database.py
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD')
+    app.config['IDENTITY_IN_SESSION'] = os.getenv('IDENTITY_IN_SESSION') == '1'
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    with app.app_context():
+        # These only register engine event hooks; no connection is opened
+        install_sqlite_pragmas(db.engine)
+        install_statement_timeout(db.engine)
+        # Request latency, SQL counts, slow-query log and /metrics
+        app.extensions['inventory_metrics'] = install_metrics(app, db.engine)
+    install_compression(app)
+    login_manager.init_app(app)
+    if int(os.getenv('TRUSTED_PROXIES', 0)):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('TRUSTED_PROXIES')))
+    app.register_blueprint(bp)
+
+    # Build mapper relationships now rather than on a worker's first query;
+    # with preload_app this happens once, in the gunicorn master
+    configure_mappers()
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
-    init_db()
+    with app.app_context():
+        init_db()
     port = int(os.environ.get("PORT", 5000))
     print(f"ðŸš€ Starting Inventory System at: http://localhost:{port}")
     app.run(host='0.0.0.0', port=port, debug=False)
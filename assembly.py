@@ -0,0 +1,89 @@
+# assembly.py - Bill-of-materials explosion and availability checks
+#
+# A BOM line says "one <product> needs <quantity> of <component>", where the
+# component is a part or another product (a sub-assembly). flatten() resolves
+# every product down to leaf parts once, so availability and assembly work
+# on a {part_id: quantity} map instead of walking the tree per request.
+from decimal import Decimal
+
+
+def _dec(value):
+    return Decimal(str(value or 0))
+
+
+def flatten(lines):
+    """Explode BOM lines into {product_id: {part_id: quantity per unit}}.
+
+    `lines` is an iterable of (product_id, component_type, component_id,
+    quantity) with component_type 'part' or 'product'. Raises ValueError if
+    a product (directly or indirectly) contains itself.
+    """
+    children = {}
+    for product_id, component_type, component_id, quantity in lines:
+        children.setdefault(product_id, []).append((component_type, component_id, _dec(quantity)))
+
+    flat = {}
+    in_progress = set()
+
+    def explode(product_id):
+        if product_id in flat:
+            return flat[product_id]
+        if product_id in in_progress:
+            raise ValueError(f'Bill of materials for product {product_id} contains itself')
+        in_progress.add(product_id)
+        parts = {}
+        for component_type, component_id, quantity in children.get(product_id, ()):
+            if component_type == 'part':
+                parts[component_id] = parts.get(component_id, 0) + quantity
+            else:
+                for part_id, per_unit in explode(component_id).items():
+                    parts[part_id] = parts.get(part_id, 0) + per_unit * quantity
+        in_progress.discard(product_id)
+        flat[product_id] = parts
+        return parts
+
+    for product_id in children:
+        explode(product_id)
+    return flat
+
+
+def requirements(flat, demand):
+    """Total part quantities for {product_id: quantity}; products without a BOM raise ValueError"""
+    totals = {}
+    for product_id, quantity in demand.items():
+        bom = flat.get(product_id)
+        if not bom:
+            raise ValueError(f'Product {product_id} has no bill of materials')
+        quantity = _dec(quantity)
+        for part_id, per_unit in bom.items():
+            totals[part_id] = totals.get(part_id, 0) + per_unit * quantity
+    return totals
+
+
+def check_availability(flat, demand, stock):
+    """Availability of a whole demand list against {part_id: on-hand}.
+
+    Returns (per_product, shortages): per_product maps each product to the
+    most units buildable from current stock on its own and whether its
+    requested quantity fits; shortages lists parts the combined demand
+    cannot cover, as {part_id: missing quantity}.
+    """
+    per_product = {}
+    for product_id, quantity in demand.items():
+        bom = flat.get(product_id) or {}
+        buildable = min((int(_dec(stock.get(part_id)) // per_unit)
+                         for part_id, per_unit in bom.items() if per_unit > 0),
+                        default=0)
+        per_product[product_id] = {
+            'requested': _dec(quantity),
+            'buildable': max(buildable, 0),
+            'available': bool(bom) and buildable >= _dec(quantity),
+        }
+
+    totals = requirements(flat, {p: q for p, q in demand.items() if flat.get(p)})
+    shortages = {}
+    for part_id, needed in totals.items():
+        missing = needed - _dec(stock.get(part_id))
+        if missing > 0:
+            shortages[part_id] = missing
+    return per_product, shortages
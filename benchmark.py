@@ -0,0 +1,334 @@
+# benchmark.py - Synthetic multi-tenant load test for the main endpoints
+#
+#   python benchmark.py                          # Flask test client, compare to baseline
+#   python benchmark.py --server gunicorn        # drive a local gunicorn over HTTP
+#   python benchmark.py --tenants 20 --items 2000 --save
+#
+# A fresh SQLite database is seeded with N tenants x M materials, parts and
+# products, then /login, /dashboard, /api/materials, /api/parts and
+# /api/production/run are exercised. p50/p95/p99 latency, throughput and peak
+# RSS are printed and compared with the JSON baseline (--save replaces it).
+# The exit status is 1 when an endpoint's p95 regresses past --tolerance.
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.security import generate_password_hash
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+PASSWORD = 'bench-password'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tenants', type=int, default=5)
+    parser.add_argument('--items', type=int, default=500,
+                        help='materials, parts and products per tenant')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='client threads when driving gunicorn')
+    parser.add_argument('--server', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative p95 regression before failing')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+# ============== DATA GENERATOR ==============
+def seed(app_module, tenants, items, rng):
+    """Bulk-insert tenants and their catalogs; returns [(email, material_ids, part_names)]"""
+    app, db = app_module.app, app_module.db
+    insert = db.insert
+    with app.app_context():
+        app_module.init_db(seed=False)
+        password_hash = generate_password_hash(PASSWORD)
+
+        accounts = []
+        for t in range(tenants):
+            user = app_module.User(email=f'bench{t}@example.com',
+                                   company=app_module.Company(name=f'Bench Co {t}'),
+                                   password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            company_id = user.company_id
+
+            db.session.execute(insert(app_module.RawMaterial), [{
+                'company_id': company_id, 'name': f'Material {i}', 'grade': rng.choice(('NBR', 'Viton', 'SS304')),
+                'unit': 'kg', 'current_stock': 1_000_000, 'min_stock': rng.randint(0, 50),
+                'avg_cost': rng.randint(40, 1200)
+            } for i in range(items)])
+            db.session.execute(insert(app_module.Part), [{
+                'company_id': company_id, 'name': f'Part {i}', 'material_type': rng.choice(('Steel', 'Rubber')),
+                'specific_type': 'Bench', 'weight_per_unit': round(rng.uniform(0.05, 1.5), 4),
+                'current_stock': rng.randint(0, 1000), 'avg_cost': 0
+            } for i in range(items)])
+            db.session.execute(insert(app_module.Product), [{
+                'company_id': company_id, 'name': f'Seal {i}', 'size': rng.choice(('25mm', '50mm', '75mm')),
+                'current_stock': rng.randint(0, 100), 'selling_price': 0
+            } for i in range(items)])
+
+            # Opening balances enter the ledger the same way init_db() does it
+            app_module.ledger.checkpoint(db.session, company_id)
+            app_module.low_stock.refresh(db.session, company_id, 'material')
+            db.session.commit()
+
+            material_ids = db.session.execute(
+                db.select(app_module.RawMaterial.id).where(app_module.RawMaterial.company_id == company_id)
+                .limit(20)).scalars().all()
+            part_names = [f'Part {i}' for i in range(min(items, 50))]
+            accounts.append((user.email, material_ids, part_names))
+        return accounts
+
+
+# ============== SCENARIOS ==============
+def production_body(rng, account, post):
+    _, material_ids, part_names = account
+    body = {'outputs': [{'part_name': name, 'quantity': rng.randint(1, 50)}
+                        for name in rng.sample(part_names, min(3, len(part_names)))]}
+    if post:
+        body.update(post=True, input_material_id=rng.choice(material_ids), input_quantity=5)
+    else:
+        body['input_cost'] = rng.randint(100, 10000)
+        for output in body['outputs']:
+            output['weight'] = 0.5
+    return body
+
+
+# (name, method, path, body factory or None)
+SCENARIOS = [
+    ('dashboard', 'GET', '/dashboard', None),
+    ('materials_full', 'GET', '/api/materials', None),
+    ('materials_page', 'GET', '/api/materials?limit=100', None),
+    ('parts_full', 'GET', '/api/parts', None),
+    ('search', 'GET', '/api/search?q=viton', None),
+    ('search_fuzzy', 'GET', '/api/search?q=vition+sel', None),
+    ('production_preview', 'POST', '/api/production/run',
+     lambda rng, account: production_body(rng, account, post=False)),
+    ('production_post', 'POST', '/api/production/run',
+     lambda rng, account: production_body(rng, account, post=True)),
+]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(latencies, wall_seconds):
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 1) if wall_seconds else None,
+    }
+
+
+# ============== DRIVERS ==============
+def run_client(app_module, accounts, args, rng):
+    """In-process run through the Flask test client, one logged-in client per tenant"""
+    clients = []
+    login = []
+    for account in accounts:
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/login', data={'email': account[0], 'password': PASSWORD})
+        login.append(time.perf_counter() - start)
+        assert response.status_code == 302, f'login failed for {account[0]}'
+        clients.append((client, account))
+
+    results = {'login': summarize(login, sum(login))}
+    for name, method, path, body in SCENARIOS:
+        latencies = []
+        wall = time.perf_counter()
+        for _ in range(args.requests):
+            client, account = rng.choice(clients)
+            start = time.perf_counter()
+            if method == 'GET':
+                response = client.get(path)
+                response.get_data()  # drain streamed bodies
+            else:
+                response = client.post(path, json=body(rng, account))
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code < 400, f'{name}: HTTP {response.status_code}'
+        results[name] = summarize(latencies, time.perf_counter() - wall)
+    return results
+
+
+def _opener(base_url, email):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    # Stop at the redirect so the login is timed on its own
+    opener.add_handler(type('NoRedirect', (urllib.request.HTTPRedirectHandler,),
+                            {'redirect_request': lambda *a, **k: None})())
+    data = urllib.parse.urlencode({'email': email, 'password': PASSWORD}).encode()
+    start = time.perf_counter()
+    try:
+        opener.open(base_url + '/login', data=data)
+    except urllib.error.HTTPError as e:
+        if e.code != 302:
+            raise
+    return opener, time.perf_counter() - start
+
+
+def _wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server did not come up at {url}')
+
+
+def run_gunicorn(accounts, args, rng, env):
+    """Start gunicorn with the repo config and drive it from client threads"""
+    base_url = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'app:app'],
+        env=dict(env, PORT=str(args.port), GUNICORN_LOG_LEVEL='warning'),
+        stdout=subprocess.DEVNULL)
+    try:
+        _wait_for(base_url + '/api/health')
+        openers = []
+        login = []
+        for account in accounts:
+            opener, seconds = _opener(base_url, account[0])
+            openers.append((opener, account))
+            login.append(seconds)
+
+        results = {'login': summarize(login, sum(login))}
+        for name, method, path, body in SCENARIOS:
+            latencies = []
+            lock = threading.Lock()
+            remaining = [args.requests]
+
+            def worker(seed):
+                local_rng = random.Random(seed)
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                    opener, account = local_rng.choice(openers)
+                    data = None
+                    headers = {}
+                    if method == 'POST':
+                        data = json.dumps(body(local_rng, account)).encode()
+                        headers['Content-Type'] = 'application/json'
+                    start = time.perf_counter()
+                    with opener.open(urllib.request.Request(base_url + path, data=data,
+                                                            headers=headers)) as response:
+                        response.read()
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+
+            threads = [threading.Thread(target=worker, args=(rng.random(),))
+                       for _ in range(args.concurrency)]
+            wall = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, time.perf_counter() - wall)
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def compare(results, baseline, tolerance):
+    """Print p95 deltas against the baseline; returns the regressed endpoints"""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] if previous['p95_ms'] else 0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print(f"  {name:20s} p95 {previous['p95_ms']:9.2f} -> {current['p95_ms']:9.2f} ms "
+              f"({change:+.0%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='seal-bench-')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    # Every simulated tenant logs in from this one address
+    env.setdefault('LOGIN_IP_BURST', str(max(20, args.tenants * 2)))
+    # The app reads its database URL at import time
+    os.environ.update(env)
+    import app as app_module
+
+    started = time.perf_counter()
+    accounts = seed(app_module, args.tenants, args.items, rng)
+    print(f'Seeded {args.tenants} tenants x {args.items} items in '
+          f'{time.perf_counter() - started:.1f}s ({workdir})')
+
+    if args.server == 'gunicorn':
+        endpoints = run_gunicorn(accounts, args, rng, env)
+        rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    else:
+        endpoints = run_client(app_module, accounts, args, rng)
+        rss = peak_rss_mb(resource.RUSAGE_SELF)
+
+    results = {
+        'server': args.server,
+        'tenants': args.tenants,
+        'items': args.items,
+        'requests_per_endpoint': args.requests,
+        'concurrency': args.concurrency if args.server == 'gunicorn' else 1,
+        'peak_rss_mb': rss,
+        'endpoints': endpoints,
+    }
+    for name, stats in endpoints.items():
+        print(f"{name:20s} p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+              f"p99 {stats['p99_ms']:8.2f} ms  {stats['throughput_rps'] or 0:8.1f} req/s")
+    print(f'Peak RSS: {rss} MB')
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get('server'), baseline.get('tenants'), baseline.get('items')) != \
+                (args.server, args.tenants, args.items):
+            print('Baseline was recorded with different settings; comparing anyway')
+        print(f'Compared with {args.baseline}:')
+        regressions = compare(results, baseline, args.tolerance)
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
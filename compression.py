@@ -0,0 +1,102 @@
+# compression.py - gzip/brotli response compression, including streamed bodies
+#
+#   COMPRESS_MIN_SIZE  smallest known-length body worth compressing (default 1024)
+#   COMPRESS_LEVEL     gzip level 1-9 (default 6)
+#
+# Brotli is used when the optional `brotli` package is installed and the
+# client accepts it; otherwise gzip.
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain',
+                'text/csv')
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 16+ writes the gzip header and trailer
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, chunk):
+        return self._z.compress(chunk)
+
+    def flush(self):
+        # Sync flush sends each streamed batch to the client right away
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._b = brotli.Compressor()
+
+    def process(self, chunk):
+        return self._b.process(chunk)
+
+    def flush(self):
+        return self._b.flush()
+
+    def finish(self):
+        return self._b.finish()
+
+
+def _encoding(accept_encoding):
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+def _stream(iterable, compressor):
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # A client that disconnects closes this generator, not the wrapped
+        # body; close it so stream_with_context releases its app context
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def install(app, env=os.environ):
+    """Compress eligible responses in an after_request hook"""
+    from flask import request
+
+    min_size = int(env.get('COMPRESS_MIN_SIZE', 1024))
+    level = int(env.get('COMPRESS_LEVEL', 6))
+
+    @app.after_request
+    def _compress(response):
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = _encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        compressor = _Brotli() if encoding == 'br' else _Gzip(level)
+
+        if response.is_streamed:
+            response.response = _stream(response.response, compressor)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(compressor.process(body) + compressor.finish())
+        response.headers['Content-Encoding'] = encoding
+        return response
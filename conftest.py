@@ -0,0 +1,40 @@
+import pytest
+from flask import g
+
+from app import bom_cache, create_app, dashboard_cache, init_db, user_cache
+from database import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on a fresh SQLite file with the demo company seeded"""
+    # Process-wide caches would carry ids over from the previous database
+    for cache in (user_cache, dashboard_cache, bom_cache):
+        cache.clear()
+    app = create_app({'TESTING': True,
+                      'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'inventory.db'}"})
+    # Requests reuse the app context pushed below, and with it g; drop the
+    # user Flask-Login cached there so each request loads its own session's
+    @app.before_request
+    def _forget_loaded_user():
+        g.pop('_login_user', None)
+
+    with app.app_context():
+        init_db()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def company_id(app):
+    from database import Company
+    return Company.query.order_by(Company.id).first().id
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as the demo admin"""
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@example.com', 'password': 'admin123'})
+    return client
@@ -0,0 +1,98 @@
+# costing.py - Weight-based cost allocation for production runs
+from decimal import Decimal, InvalidOperation, ROUND_DOWN, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+RATE = Decimal('0.0001')   # Numeric(12,4) precision used for stored rates
+
+
+def _dec(value):
+    return Decimal(str(value or 0))
+
+
+def _amount(value, field):
+    """A request value as a finite, non-negative Decimal (missing is zero)"""
+    try:
+        number = _dec(value)
+    except InvalidOperation:
+        raise ValueError(f'{field} must be a number') from None
+    if not number.is_finite():
+        raise ValueError(f'{field} must be a number')
+    if number < 0:
+        raise ValueError(f'{field} must not be negative')
+    return number
+
+
+def allocate_runs(runs):
+    """Allocate input cost over outputs for many runs at once.
+
+    `runs` is a sequence of (input_cost, [(weight, quantity), ...]). All
+    outputs are flattened into parallel columns and processed in a few passes
+    over the whole batch instead of one loop per run. Allocated costs are
+    rounded to cents with the largest-remainder method, so each run's
+    allocations sum exactly to its input cost.
+
+    Returns one dict per run with total_weight, cost_per_kg and per-output
+    output_weight / allocated_cost / cost_per_unit lists, or an 'error' key
+    (non-numeric or negative values fail only their own run).
+    """
+    # Columnar layout: one entry per output across all runs
+    run_index, quantity, output_weight = [], [], []
+    input_cost, errors = [], {}
+    for i, (cost, outputs) in enumerate(runs):
+        try:
+            cost = _amount(cost, 'input_cost').quantize(CENT, ROUND_HALF_UP)
+            parsed = [(_amount(weight, 'Output weight'), _amount(qty, 'Output quantity'))
+                      for weight, qty in outputs]
+        except ValueError as e:
+            input_cost.append(Decimal(0))
+            errors[i] = str(e)
+            continue
+        input_cost.append(cost)
+        for weight, qty in parsed:
+            run_index.append(i)
+            quantity.append(qty)
+            output_weight.append(weight * qty)
+
+    total_weight = [Decimal(0)] * len(runs)
+    for i, w in zip(run_index, output_weight):
+        total_weight[i] += w
+
+    # Exact share, floored to cents; the remainders decide who gets leftovers
+    floored, remainder = [], []
+    for i, w in zip(run_index, output_weight):
+        share = input_cost[i] * w / total_weight[i] if total_weight[i] > 0 else Decimal(0)
+        cents = share.quantize(CENT, ROUND_DOWN)
+        floored.append(cents)
+        remainder.append(share - cents)
+
+    leftover = list(input_cost)
+    for i, cents in zip(run_index, floored):
+        leftover[i] -= cents
+    for n in sorted(range(len(run_index)), key=lambda n: (run_index[n], -remainder[n], n)):
+        i = run_index[n]
+        if leftover[i] > 0 and output_weight[n] > 0:
+            floored[n] += CENT
+            leftover[i] -= CENT
+
+    results = []
+    for i in range(len(runs)):
+        if i in errors:
+            results.append({'error': errors[i]})
+        elif total_weight[i] > 0:
+            results.append({
+                'input_cost': input_cost[i],
+                'total_weight': total_weight[i],
+                'cost_per_kg': (input_cost[i] / total_weight[i]).quantize(RATE, ROUND_HALF_UP),
+                'output_weight': [], 'allocated_cost': [], 'cost_per_unit': []
+            })
+        else:
+            results.append({'error': 'No valid outputs'})
+    for n, i in enumerate(run_index):
+        result = results[i]
+        if 'error' in result:
+            continue
+        result['output_weight'].append(output_weight[n])
+        result['allocated_cost'].append(floored[n])
+        result['cost_per_unit'].append(
+            (floored[n] / quantity[n]).quantize(RATE, ROUND_HALF_UP) if quantity[n] > 0 else Decimal(0))
+    return results
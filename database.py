@@ -1,9 +1,31 @@
 # database.py - Database models for your inventory system
-from flask_sqlalchemy import SQLAlchemy
+#
+# Inventory belongs to a Company: every inventory table carries company_id and
+# all users of a company work on the same rows. app.py binds `db` to the app
+# and reads tenant data through tenant_select()/tenant_get().
+import functools
 from datetime import datetime
 
+from flask import current_app
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from werkzeug.security import check_password_hash, generate_password_hash
+
 db = SQLAlchemy()
 
+# ============== PASSWORD HASHING ==============
+# PASSWORD_HASH_METHOD takes Werkzeug method strings such as
+# "pbkdf2:sha256:260000" or "scrypt:16384:8:1"; unset keeps Werkzeug's
+# default. Stored hashes made with other settings are upgraded on next login.
+def _hash_options():
+    method = current_app.config.get('PASSWORD_HASH_METHOD')
+    return {'method': method} if method else {}
+
+@functools.lru_cache(maxsize=None)
+def _hash_method_prefix(method):
+    # Werkzeug fills in defaults (e.g. iterations); hash once to learn the full form
+    return generate_password_hash('', **({'method': method} if method else {})).split('$', 1)[0]
+
 # ============== USER MANAGEMENT ==============
 class Company(db.Model):
     __tablename__ = 'companies'
@@ -16,18 +38,43 @@ class Company(db.Model):
     materials = db.relationship('RawMaterial', backref='company', lazy=True)
     products = db.relationship('Product', backref='company', lazy=True)
 
-class User(db.Model):
+class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_company', 'company_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
-    role = db.Column(db.String(50), default='user')
+    role = db.Column(db.String(50), default='user')   # 'admin' may add colleagues
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def company_name(self):
+        return self.company.name if self.company else None
+    
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password, **_hash_options())
+    
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+    
+    def needs_rehash(self):
+        """True when the stored hash was made with other PASSWORD_HASH_METHOD settings"""
+        method = current_app.config.get('PASSWORD_HASH_METHOD')
+        return self.password_hash.split('$', 1)[0] != _hash_method_prefix(method)
 
 # ============== YOUR INVENTORY TABLES ==============
 class RawMaterial(db.Model):
     __tablename__ = 'raw_materials'
+    __table_args__ = (
+        db.Index('ix_raw_materials_company_id', 'company_id', 'id'),
+        db.Index('ix_raw_materials_company_name', 'company_id', 'name'),
+        db.Index('ix_raw_materials_company_low_stock', 'company_id',
+                 sqlite_where=db.text('current_stock < min_stock'),
+                 postgresql_where=db.text('current_stock < min_stock')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     
@@ -49,6 +96,10 @@ class RawMaterial(db.Model):
 
 class Part(db.Model):
     __tablename__ = 'parts'
+    __table_args__ = (
+        db.Index('ix_parts_company_id', 'company_id', 'id'),
+        db.Index('ix_parts_company_name', 'company_id', 'name'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     
@@ -61,11 +112,16 @@ class Part(db.Model):
     weight_per_unit = db.Column(db.Numeric(10,4))     # Weight in kg per piece
     current_stock = db.Column(db.Integer, default=0)
     avg_cost = db.Column(db.Numeric(12,4), default=0)  # Calculated from production
+    material_id = db.Column(db.Integer, db.ForeignKey('raw_materials.id'))  # Cut from (for MRP)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_company_id', 'company_id', 'id'),
+        db.Index('ix_products_company_name', 'company_id', 'name', 'size'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     
@@ -82,6 +138,9 @@ class Product(db.Model):
 # ============== PRODUCTION TABLES (Multi-output) ==============
 class ProductionRun(db.Model):
     __tablename__ = 'production_runs'
+    __table_args__ = (
+        db.Index('ix_production_runs_company_date', 'company_id', 'production_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     
@@ -99,6 +158,10 @@ class ProductionRun(db.Model):
 
 class ProductionOutput(db.Model):
     __tablename__ = 'production_outputs'
+    __table_args__ = (
+        db.Index('ix_production_outputs_run', 'run_id'),
+        db.Index('ix_production_outputs_part', 'part_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     run_id = db.Column(db.Integer, db.ForeignKey('production_runs.id'))
     part_id = db.Column(db.Integer, db.ForeignKey('parts.id'))
@@ -116,8 +179,25 @@ class ProductionOutput(db.Model):
     part = db.relationship('Part', backref='productions')
 
 # ============== ASSEMBLY TABLES ==============
+class BomLine(db.Model):
+    __tablename__ = 'bom_lines'
+    __table_args__ = (
+        db.Index('ix_bom_lines_company_product', 'company_id', 'product_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # One unit of product_id needs `quantity` of a part or of another product
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
+    component_type = db.Column(db.String(20))    # 'part' or 'product' (sub-assembly)
+    component_id = db.Column(db.Integer)
+    quantity = db.Column(db.Numeric(12,4))
+
 class AssemblyRun(db.Model):
     __tablename__ = 'assembly_runs'
+    __table_args__ = (
+        db.Index('ix_assembly_runs_company_date', 'company_id', 'assembly_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
@@ -127,9 +207,13 @@ class AssemblyRun(db.Model):
     cost_per_unit = db.Column(db.Numeric(12,4))
     
     assembly_date = db.Column(db.DateTime, default=datetime.utcnow)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
 
 class AssemblyComponent(db.Model):
     __tablename__ = 'assembly_components'
+    __table_args__ = (
+        db.Index('ix_assembly_components_assembly', 'assembly_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     assembly_id = db.Column(db.Integer, db.ForeignKey('assembly_runs.id'))
     part_id = db.Column(db.Integer, db.ForeignKey('parts.id'))
@@ -145,6 +229,10 @@ class AssemblyComponent(db.Model):
 # ============== TRANSACTION LOG ==============
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_company_date', 'company_id', 'transaction_date'),
+        db.Index('ix_transactions_company_item', 'company_id', 'reference_type', 'reference_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     
@@ -158,4 +246,133 @@ class Transaction(db.Model):
     
     notes = db.Column(db.Text)
     transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
\ No newline at end of file
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_company_taken', 'company_id', 'taken_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # Balance of one item at a checkpoint; all rows of a checkpoint share taken_at
+    reference_type = db.Column(db.String(50))
+    reference_id = db.Column(db.Integer)
+    quantity = db.Column(db.Numeric(12,4))
+    value = db.Column(db.Numeric(12,4))
+    
+    last_transaction_id = db.Column(db.Integer)  # ledger rows up to this id are included
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StockAlert(db.Model):
+    __tablename__ = 'stock_alerts'
+    __table_args__ = (
+        db.Index('ix_stock_alerts_company_item', 'company_id', 'reference_type', 'reference_id', unique=True),
+        db.Index('ix_stock_alerts_pending', 'notified_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # An item currently below its reorder point; deleted when it recovers
+    reference_type = db.Column(db.String(50))
+    reference_id = db.Column(db.Integer)
+    current_stock = db.Column(db.Numeric(12,4))
+    min_stock = db.Column(db.Numeric(12,4))
+    
+    raised_at = db.Column(db.DateTime, default=datetime.utcnow)
+    notified_at = db.Column(db.DateTime)           # NULL until the alert worker sends it
+
+class CollectionVersion(db.Model):
+    __tablename__ = 'collection_versions'
+    
+    # Bumped by every write to a company's collection; drives list ETags
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    collection = db.Column(db.String(50), primary_key=True)  # 'materials', 'parts', 'products', 'boms'
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status', 'status', 'id'),
+        db.Index('ix_jobs_company_id', 'company_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # Background job; see jobs.py
+    kind = db.Column(db.String(50))              # 'import', 'recost', 'stock_report'
+    status = db.Column(db.String(20))            # queued, running, done, failed
+    progress = db.Column(db.Integer, default=0)  # percent
+    params = db.Column(db.Text)                  # JSON
+    payload = db.Column(db.Text)                 # uploaded file body for imports
+    result = db.Column(db.Text)                  # JSON
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)        # last sign of life from the worker running it
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+
+# ============== VALUATION ==============
+class ItemCost(db.Model):
+    __tablename__ = 'item_costs'
+    __table_args__ = (
+        db.Index('ix_item_costs_company_item', 'company_id', 'reference_type', 'reference_id', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # Running cost state of one item; see valuation.py
+    reference_type = db.Column(db.String(50))    # 'material', 'part', 'product'
+    reference_id = db.Column(db.Integer)
+    quantity = db.Column(db.Numeric(12,4), default=0)
+    avg_cost = db.Column(db.Numeric(12,4), default=0)     # moving average per unit
+    fifo_value = db.Column(db.Numeric(14,4), default=0)   # sum of open cost layers
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CostLayer(db.Model):
+    __tablename__ = 'cost_layers'
+    __table_args__ = (
+        # Partial index: consumption only ever reads layers with stock left
+        db.Index('ix_cost_layers_open', 'company_id', 'reference_type', 'reference_id', 'id',
+                 sqlite_where=db.text('remaining > 0'),
+                 postgresql_where=db.text('remaining > 0')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # One receipt, consumed oldest first (FIFO)
+    reference_type = db.Column(db.String(50))
+    reference_id = db.Column(db.Integer)
+    quantity = db.Column(db.Numeric(12,4))
+    remaining = db.Column(db.Numeric(12,4))
+    unit_cost = db.Column(db.Numeric(12,4))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ValuationPeriod(db.Model):
+    __tablename__ = 'valuation_periods'
+    __table_args__ = (
+        db.Index('ix_valuation_periods_key', 'company_id', 'period', 'reference_type', 'reference_id',
+                 unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
+    
+    # Movement totals of one item in one month ('YYYY-MM')
+    period = db.Column(db.String(7))
+    reference_type = db.Column(db.String(50))
+    reference_id = db.Column(db.Integer)
+    
+    qty_in = db.Column(db.Numeric(14,4), default=0)
+    value_in = db.Column(db.Numeric(14,4), default=0)
+    qty_out = db.Column(db.Numeric(14,4), default=0)
+    cost_out_fifo = db.Column(db.Numeric(14,4), default=0)   # issues valued oldest layer first
+    cost_out_avg = db.Column(db.Numeric(14,4), default=0)    # issues valued at moving average
+    
+    # Sales only (a subset of the issues above)
+    qty_sold = db.Column(db.Numeric(14,4), default=0)
+    revenue = db.Column(db.Numeric(14,4), default=0)
+    cogs_fifo = db.Column(db.Numeric(14,4), default=0)
+    cogs_avg = db.Column(db.Numeric(14,4), default=0)
@@ -0,0 +1,76 @@
+# db_config.py - Engine/pool settings for Postgres and SQLite, driven by env vars
+#
+#   DB_POOL_SIZE            persistent connections per worker (default 5)
+#   DB_MAX_OVERFLOW         extra connections allowed under burst (default 10)
+#   DB_POOL_TIMEOUT         seconds to wait for a free connection (default 30)
+#   DB_POOL_RECYCLE         seconds before a connection is replaced (default 1800)
+#   DB_POOL_PRE_PING        "0" disables the liveness check on checkout
+#   DB_STATEMENT_TIMEOUT_MS Postgres statement_timeout for web requests, 0 = none
+#                           (default 30000); CLI commands and the job worker run
+#                           without one
+#   SQLITE_BUSY_TIMEOUT_MS  how long SQLite waits on a locked database (default 5000)
+#   SQLITE_WAL              "0" keeps the rollback journal instead of WAL
+import os
+
+from flask import has_request_context
+from sqlalchemy import event
+
+
+def _int(env, name, default):
+    return int(env.get(name, default))
+
+
+def engine_options(database_uri, env=os.environ):
+    """Options for SQLALCHEMY_ENGINE_OPTIONS based on the database type"""
+    if database_uri == 'sqlite://' or database_uri.startswith('sqlite:///:memory:'):
+        # In-memory databases use a single static connection; no pool to tune
+        return {}
+    options = {
+        'pool_size': _int(env, 'DB_POOL_SIZE', 5),
+        'max_overflow': _int(env, 'DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _int(env, 'DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _int(env, 'DB_POOL_RECYCLE', 1800),
+    }
+    if database_uri.startswith('sqlite'):
+        # Local file: connections never go stale, and the busy timeout is
+        # applied by the connect hook below
+        options['pool_recycle'] = -1
+        options['connect_args'] = {'timeout': _int(env, 'SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}
+        return options
+
+    options['pool_pre_ping'] = env.get('DB_POOL_PRE_PING', '1') != '0'
+    return options
+
+
+def install_statement_timeout(engine, env=os.environ):
+    """Cap statements in transactions begun while serving a request.
+
+    Set per transaction (SET LOCAL) rather than per connection, so init-db,
+    migrate, revalue and the job worker, which run outside any request and
+    expect long statements, are never cut off mid-way.
+    """
+    timeout = _int(env, 'DB_STATEMENT_TIMEOUT_MS', 30000)
+    if not timeout or engine.dialect.name != 'postgresql':
+        return
+
+    @event.listens_for(engine, 'begin')
+    def _set_statement_timeout(conn):
+        if has_request_context():
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {timeout}')
+
+
+def install_sqlite_pragmas(engine, env=os.environ):
+    """WAL lets readers run alongside a writer; NORMAL sync is safe under WAL"""
+    if engine.dialect.name != 'sqlite':
+        return
+    wal = env.get('SQLITE_WAL', '1') != '0'
+    busy_timeout = _int(env, 'SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+        cursor.close()
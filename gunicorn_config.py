@@ -0,0 +1,56 @@
+# gunicorn_config.py - Production server settings
+#   gunicorn -c gunicorn_config.py app:app
+#
+#   WEB_CONCURRENCY        worker processes (default: 2 x CPUs + 1, capped)
+#   GUNICORN_MAX_WORKERS   cap for the CPU-based default (default 8)
+#   GUNICORN_WORKER_CLASS  gthread (default), sync or gevent
+#   GUNICORN_THREADS       threads per gthread worker (default 4)
+#   GUNICORN_TIMEOUT       seconds before a stuck worker is restarted (default 60)
+#
+# Each worker keeps its own SQLAlchemy pool, so workers x (DB_POOL_SIZE +
+# DB_MAX_OVERFLOW) must stay below the Postgres connection limit.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY',
+    min(multiprocessing.cpu_count() * 2 + 1, int(os.environ.get('GUNICORN_MAX_WORKERS', 8)))
+))
+if worker_class == 'gthread':
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+elif worker_class == 'gevent':
+    # Requires `pip install gevent` (and psycogreen for Postgres)
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks can't build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+# Import the app and models once in the master, then fork
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the children
+    from app import app, db
+
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+
+    with app.app_context():
+        db.engine.dispose(close=False)
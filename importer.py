@@ -0,0 +1,205 @@
+# importer.py - Chunked CSV/NDJSON import of materials, parts and products
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import insert, select, update
+
+# Column -> type for each importable item kind
+FIELDS = {
+    'materials': {
+        'name': str, 'grade': str, 'unit': str,
+        'current_stock': Decimal, 'min_stock': Decimal, 'avg_cost': Decimal,
+    },
+    'parts': {
+        'name': str, 'material_type': str, 'specific_type': str,
+        'weight_per_unit': Decimal, 'current_stock': int, 'avg_cost': Decimal,
+        'material_id': int,
+    },
+    'products': {
+        'name': str, 'size': str, 'current_stock': int, 'selling_price': Decimal,
+    },
+}
+
+# Columns that point at another table's rows; the ids must belong to the
+# importing company
+REFERENCES = {
+    'parts': {'material_id': 'raw_materials'},
+}
+
+# Columns that identify an existing row to update instead of inserting
+KEYS = {
+    'materials': ('name',),
+    'parts': ('name',),
+    'products': ('name', 'size'),
+}
+
+# Values applied to newly inserted rows only
+DEFAULTS = {
+    'materials': {'unit': 'kg', 'current_stock': 0, 'min_stock': 0, 'avg_cost': 0},
+    'parts': {'current_stock': 0, 'avg_cost': 0},
+    'products': {'current_stock': 0, 'selling_price': 0},
+}
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_records(stream, fmt):
+    """Yield (line_number, record_or_None, error_or_None) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, 'Expected a JSON object'
+                continue
+            yield line_number, record, None
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def _convert(field, kind, raw):
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return None
+    if kind is str:
+        return str(raw).strip()
+    try:
+        value = Decimal(str(raw).strip())
+    except InvalidOperation:
+        raise ValueError(f'{field}: not a number')
+    if not value.is_finite():
+        raise ValueError(f'{field}: not a number')
+    if kind is int:
+        if value != value.to_integral_value():
+            raise ValueError(f'{field}: must be a whole number')
+        return int(value)
+    return value
+
+
+def validate(kind, record):
+    """Return the known, type-converted columns of a record or raise ValueError"""
+    clean = {}
+    for field, field_type in FIELDS[kind].items():
+        if field in record:
+            value = _convert(field, field_type, record[field])
+            if value is not None:
+                clean[field] = value
+    if not clean.get('name'):
+        raise ValueError('name is required')
+    return clean
+
+
+def foreign_ids(session, model, kind, company_id, rows):
+    """{field: ids in `rows` that are not the company's rows of the referenced table}"""
+    unknown = {}
+    for field, table_name in REFERENCES.get(kind, {}).items():
+        ids = {row[field] for row in rows if field in row}
+        if not ids:
+            continue
+        table = model.metadata.tables[table_name]
+        own = set(session.execute(
+            select(table.c.id).where(table.c.company_id == company_id, table.c.id.in_(ids))
+        ).scalars())
+        unknown[field] = ids - own
+    return unknown
+
+
+def upsert_chunk(session, model, kind, company_id, rows):
+    """Insert new rows with one multi-row INSERT and update matched ones by id"""
+    keys = KEYS[kind]
+    # Later rows win when the same key appears twice in a chunk
+    by_key = {tuple(row.get(k) for k in keys): row for row in rows}
+
+    names = {row['name'] for row in rows}
+    existing = session.execute(
+        select(model.id, *(getattr(model, k) for k in keys))
+        .where(model.company_id == company_id, model.name.in_(names))
+    ).all()
+    existing_ids = {tuple(r[1:]): r.id for r in existing}
+
+    inserts, updates = [], []
+    for key, row in by_key.items():
+        row_id = existing_ids.get(key)
+        if row_id is None:
+            inserts.append(dict(DEFAULTS[kind], company_id=company_id, **row))
+        else:
+            updates.append(dict(row, id=row_id))
+
+    if inserts:
+        session.execute(insert(model), inserts)
+    if updates:
+        session.execute(update(model), updates)
+    return len(inserts), len(updates)
+
+
+def import_stream(session, model, kind, company_id, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE,
+                  on_chunk=None):
+    """Stream records into the database chunk by chunk, committing each chunk.
+
+    Invalid rows and chunks that fail to write are reported in ``errors``;
+    the rest of the file is still imported. ``on_chunk(summary)`` is called
+    after each chunk, e.g. to report progress.
+    """
+    summary = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def record_error(line_number, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': message})
+
+    def flush(chunk):
+        unknown = foreign_ids(session, model, kind, company_id, [row for _, row in chunk])
+        if any(unknown.values()):
+            valid = []
+            for line_number, row in chunk:
+                bad = [field for field, ids in unknown.items() if row.get(field) in ids]
+                if bad:
+                    record_error(line_number, f'{bad[0]}: unknown id {row[bad[0]]}')
+                else:
+                    valid.append((line_number, row))
+            chunk = valid
+        try:
+            inserted, updated = upsert_chunk(session, model, kind, company_id,
+                                             [row for _, row in chunk])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for line_number, _ in chunk:
+                record_error(line_number, f'Write failed: {e}')
+        else:
+            summary['inserted'] += inserted
+            summary['updated'] += updated
+        if on_chunk is not None:
+            on_chunk(summary)
+
+    chunk = []
+    for line_number, record, error in read_records(stream, fmt):
+        if error is None:
+            try:
+                chunk.append((line_number, validate(kind, record)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            record_error(line_number, error)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return summary
+
+
+def text_stream(binary):
+    """Decode an uploaded byte stream without reading it all into memory"""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
@@ -0,0 +1,213 @@
+# jobs.py - Database-backed job queue for long-running tenant operations
+#
+# Requests insert a row into the jobs table and return at once; the
+# `flask jobs` worker claims queued rows and runs their handlers on a thread
+# pool, updating progress as it goes. No broker is needed: the table is the
+# queue, and a claim is a conditional UPDATE, so several workers can share it.
+#
+#   JOB_WORKERS          handler threads per worker process (default 2)
+#   JOBS_PER_TENANT      jobs one company may have running at once (default 1)
+#   MAX_QUEUED_JOBS      queued jobs allowed per company (default 20)
+#   JOB_POLL_SECONDS     idle wait between queue checks (default 2)
+#   JOB_HEARTBEAT_SECONDS  how often a worker marks its running jobs alive (default 10)
+#   JOB_STALE_SECONDS    running jobs without a heartbeat for this long are failed
+#                        by any worker, so a crashed one cannot block its
+#                        companies' queues (default 60)
+#
+# On SIGTERM (deploys) a worker stops claiming and fails its in-flight jobs
+# at once; a handler that still finishes before the process is killed
+# records its result over that.
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+log = logging.getLogger('inventory.jobs')
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to a handler: the company it runs for, its inputs and a progress reporter"""
+
+    def __init__(self, queue, session, job):
+        self._queue = queue
+        self._session = session
+        self.id = job.id
+        self.company_id = job.company_id
+        self.created_by = job.created_by
+        self.params = json.loads(job.params) if job.params else {}
+        self.payload = job.payload
+        self._last_progress = -1
+
+    def progress(self, percent):
+        """Record progress (0-100); commits the caller's session as well"""
+        percent = max(0, min(100, int(percent)))
+        if percent == self._last_progress:
+            return
+        self._last_progress = percent
+        job = self._queue.job
+        self._session.execute(update(job).where(job.id == self.id).values(progress=percent))
+        self._session.commit()
+
+
+class JobQueue:
+    """Submits, claims and runs jobs stored in `job_model`.
+
+    `handlers` maps a job kind to handler(context) -> JSON-serializable result.
+    """
+
+    def __init__(self, job_model, handlers, env=os.environ):
+        self.job = job_model
+        self.handlers = handlers
+        self.workers = int(env.get('JOB_WORKERS', 2))
+        self.per_tenant = int(env.get('JOBS_PER_TENANT', 1))
+        self.max_queued = int(env.get('MAX_QUEUED_JOBS', 20))
+        self.poll_seconds = float(env.get('JOB_POLL_SECONDS', 2))
+        self.heartbeat = float(env.get('JOB_HEARTBEAT_SECONDS', 10))
+        self.stale = int(env.get('JOB_STALE_SECONDS', 60))
+
+    def submit(self, session, company_id, kind, params=None, payload=None, created_by=None):
+        """Queue a job for a company and return it; caller commits"""
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job type: {kind}')
+        job = self.job
+        queued = session.execute(
+            select(func.count()).select_from(job)
+            .where(job.company_id == company_id, job.status == QUEUED)
+        ).scalar()
+        if queued >= self.max_queued:
+            raise QueueFull(f'{queued} jobs already queued')
+        row = job(company_id=company_id, created_by=created_by, kind=kind, status=QUEUED, progress=0,
+                  params=json.dumps(params or {}), payload=payload,
+                  created_at=datetime.utcnow())
+        session.add(row)
+        session.flush()
+        return row
+
+    def claim(self, session):
+        """Mark the oldest runnable job as running and return its id, or None.
+
+        Companies already at JOBS_PER_TENANT running jobs are skipped, so one
+        company's month-end backlog cannot starve the others.
+        """
+        job = self.job
+        running = session.execute(
+            select(job.company_id, func.count()).where(job.status == RUNNING).group_by(job.company_id)
+        ).all()
+        full = {company_id for company_id, count in running if count >= self.per_tenant}
+
+        candidates = session.execute(
+            select(job.id, job.company_id).where(job.status == QUEUED).order_by(job.id).limit(50)
+        ).all()
+        for job_id, company_id in candidates:
+            if company_id in full:
+                continue
+            claimed = session.execute(
+                update(job).where(job.id == job_id, job.status == QUEUED)
+                .values(status=RUNNING, started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+            ).rowcount
+            session.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def run(self, session, job_id):
+        """Run one claimed job to completion, recording its result or error"""
+        job = self.job
+        row = session.get(job, job_id)
+        kind = row.kind
+        context = JobContext(self, session, row)
+        try:
+            result = self.handlers[kind](context)
+        except Exception as e:
+            session.rollback()
+            log.error('Job %s (%s) failed: %s', job_id, kind, traceback.format_exc())
+            values = {'status': FAILED, 'error': str(e)[:2000]}
+        else:
+            values = {'status': DONE, 'progress': 100, 'error': None,
+                      'result': json.dumps(result, default=str)}
+        # The uploaded body is only needed while the job runs
+        session.execute(update(job).where(job.id == job_id)
+                        .values(finished_at=datetime.utcnow(), payload=None, **values))
+        session.commit()
+
+    def beat(self, session, job_ids):
+        """Mark this worker's running jobs as alive"""
+        job = self.job
+        if job_ids:
+            session.execute(update(job).where(job.id.in_(job_ids), job.status == RUNNING)
+                            .values(heartbeat_at=datetime.utcnow()))
+        session.commit()
+
+    def _fail_running(self, session, *criteria):
+        job = self.job
+        count = session.execute(
+            update(job).where(job.status == RUNNING, *criteria)
+            .values(status=FAILED, error='Worker stopped before the job finished',
+                    finished_at=datetime.utcnow(), payload=None)
+        ).rowcount
+        session.commit()
+        return count
+
+    def fail_stale(self, session):
+        """Fail jobs whose worker stopped sending heartbeats"""
+        job = self.job
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale)
+        return self._fail_running(session, func.coalesce(job.heartbeat_at, job.started_at) < cutoff)
+
+    def serve(self, app, session_factory, once=False):
+        """Worker loop: keep up to JOB_WORKERS handlers busy until interrupted.
+
+        `session_factory()` must return the session for the current thread's
+        app context (db.session with Flask-SQLAlchemy).
+        """
+        from concurrent.futures import ThreadPoolExecutor  # only the worker process needs it
+
+        stopping = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *_: stopping.set())
+
+        def execute(job_id):
+            with app.app_context():
+                self.run(session_factory(), job_id)
+
+        active = {}  # future -> job id
+        last_beat = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not stopping.is_set():
+                active = {f: job_id for f, job_id in active.items() if not f.done()}
+                if time.monotonic() - last_beat >= self.heartbeat:
+                    with app.app_context():
+                        # Own jobs first, so they are never taken for stale
+                        self.beat(session_factory(), list(active.values()))
+                        failed = self.fail_stale(session_factory())
+                    if failed:
+                        log.warning('Failed %s jobs with no heartbeat', failed)
+                    last_beat = time.monotonic()
+                if len(active) < self.workers:
+                    with app.app_context():
+                        claimed = self.claim(session_factory())
+                    if claimed:
+                        active[pool.submit(execute, claimed)] = claimed
+                        continue
+                if once and not active:
+                    return
+                stopping.wait(self.poll_seconds)
+
+            in_flight = [job_id for f, job_id in active.items() if not f.done()]
+            if in_flight:
+                log.warning('Stopping with jobs %s still running', in_flight)
+                with app.app_context():
+                    self._fail_running(session_factory(), self.job.id.in_(in_flight))
@@ -0,0 +1,320 @@
+# ledger.py - Append-only stock movement ledger with materialized balances
+#
+# Every stock change is written as a Transaction row (signed quantity and
+# value) in the same transaction as an in-database increment of the item's
+# current_stock, so current_stock is the materialized on-hand balance and
+# concurrent writers cannot lose each other's updates. Periodic checkpoints
+# copy every balance into stock_snapshots; a point-in-time balance is the
+# latest checkpoint at or before that time plus the ledger rows after it.
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import Integer, Numeric, bindparam, func, insert, select, update
+
+MOVEMENT_TYPES = ('PURCHASE', 'PRODUCTION', 'ASSEMBLY', 'SALE', 'ADJUSTMENT', 'REVALUATION')
+
+# Changes the value of the stock on hand without moving any (quantity 0)
+REVALUATION = 'REVALUATION'
+
+# Types that only move stock one way; the others both receive and issue
+DIRECTIONS = {'PURCHASE': 1, 'SALE': -1}
+
+
+# Untyped Decimal parameters are rejected by sqlite3; bind them as Numeric
+QUANTITY = Numeric(12, 4)
+
+
+def _dec(value):
+    return Decimal(str(value or 0))
+
+
+def _number(movement, field):
+    """A movement field as a finite Decimal, or None when absent"""
+    value = movement.get(field)
+    if value is None:
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'{field} must be a number') from None
+    if isinstance(value, bool) or not number.is_finite():
+        raise ValueError(f'{field} must be a number')
+    return number
+
+
+class Ledger:
+    """Posts movements and answers balance queries for one set of models.
+
+    `items` maps a reference_type ('material', 'part', 'product') to its
+    model; every model needs id, company_id and current_stock columns. Cost
+    averaging is left to listeners (see valuation.py). Functions in
+    `listeners` are called as listener(session, company_id, {reference_type:
+    ids}, rows) after each post or reconcile, inside the same transaction;
+    `rows` are the ledger rows written, in posting order.
+
+    A SALE row keeps the selling price as unit_price, but its total_value is
+    the cost of the stock issued, so balance values stay at cost. `costs`,
+    called as costs(session, company_id, keys) -> {key: unit cost}, prices
+    them; without it sales carry no value.
+    """
+
+    def __init__(self, transaction_model, snapshot_model, items, listeners=(), costs=None):
+        self.transaction = transaction_model
+        self.snapshot = snapshot_model
+        self.items = items
+        self.listeners = list(listeners)
+        self.costs = costs
+
+    def _model(self, reference_type):
+        model = self.items.get(reference_type)
+        if model is None:
+            raise ValueError(f'Unknown item type: {reference_type}')
+        return model
+
+    def post(self, session, company_id, movements, now=None, allow_negative=False,
+             created_by=None):
+        """Append ledger rows and apply them to current_stock; caller commits.
+
+        Each movement is a dict with transaction_type, reference_type,
+        reference_id, a signed quantity and optionally unit_price,
+        total_value and notes; a REVALUATION has quantity 0 and a total_value
+        (the change in stock value). `created_by` is the posting user's id. Raises
+        ValueError for unknown items, malformed numbers, fractions of items
+        counted in whole units, a quantity of the wrong sign for its type
+        (purchases receive, sales issue) or, unless
+        allow_negative, when an item would go below zero.
+        """
+        now = now or datetime.utcnow()
+        rows = []
+        # (reference_type, reference_id) -> quantity delta
+        totals = defaultdict(Decimal)
+        for movement in movements:
+            kind = movement.get('transaction_type')
+            if kind not in MOVEMENT_TYPES:
+                raise ValueError(f'Unknown movement type: {kind}')
+            model = self._model(movement.get('reference_type'))
+            if kind == REVALUATION:
+                rows.append(self._revaluation_row(company_id, movement, now, created_by))
+                totals[(movement['reference_type'], movement['reference_id'])] += 0  # tenant check
+                continue
+            quantity = _number(movement, 'quantity')
+            if not quantity:
+                raise ValueError('quantity must be a non-zero number')
+            if (isinstance(model.__table__.c.current_stock.type, Integer)
+                    and quantity != quantity.to_integral_value()):
+                raise ValueError(f"{movement['reference_type']} quantity must be a whole number")
+            direction = DIRECTIONS.get(kind)
+            if direction and quantity * direction < 0:
+                raise ValueError(f'{kind} quantity must be '
+                                 f'{"positive" if direction > 0 else "negative"}')
+            unit_price = _number(movement, 'unit_price')
+            total_value = _number(movement, 'total_value')
+            if unit_price is not None and unit_price < 0:
+                raise ValueError('unit_price must not be negative')
+            if total_value is not None and total_value * quantity < 0:
+                raise ValueError('total_value must have the sign of quantity')
+            if total_value is None and unit_price is not None:
+                total_value = quantity * unit_price
+            if unit_price is None and total_value is not None:
+                unit_price = total_value / quantity
+            if kind == 'SALE':
+                total_value = None  # valued at cost below
+
+            totals[(movement['reference_type'], movement['reference_id'])] += quantity
+
+            rows.append({
+                'company_id': company_id,
+                'transaction_type': kind,
+                'reference_type': movement['reference_type'],
+                'reference_id': movement['reference_id'],
+                'quantity': round(quantity, 4),
+                'unit_price': round(unit_price, 4) if unit_price is not None else None,
+                'total_value': round(total_value, 4) if total_value is not None else None,
+                'notes': movement.get('notes'),
+                'transaction_date': now,
+                'created_by': created_by,
+            })
+        if not rows:
+            return []
+
+        sales = [row for row in rows if row['transaction_type'] == 'SALE']
+        if sales and self.costs is not None:
+            # Costs as they stood before this post
+            costs = self.costs(session, company_id,
+                               {(row['reference_type'], row['reference_id']) for row in sales})
+            for row in sales:
+                unit_cost = costs.get((row['reference_type'], row['reference_id']))
+                if unit_cost is not None:
+                    row['total_value'] = round(row['quantity'] * unit_cost, 4)
+
+        by_type = defaultdict(dict)
+        for (reference_type, reference_id), total in totals.items():
+            by_type[reference_type][reference_id] = total
+
+        for reference_type, deltas in by_type.items():
+            model = self.items[reference_type]
+            self._check_stock(session, model, company_id, deltas, allow_negative)
+            table = model.__table__
+            moved = [{'b_id': i, 'b_delta': delta} for i, delta in deltas.items() if delta]
+            if moved:
+                session.execute(
+                    update(table)
+                    .where(table.c.id == bindparam('b_id'))
+                    .values(current_stock=func.coalesce(table.c.current_stock, 0) + bindparam('b_delta', type_=QUANTITY)),
+                    moved
+                )
+
+        session.execute(insert(self.transaction), rows)
+        changed = {reference_type: set(deltas) for reference_type, deltas in by_type.items()}
+        self._notify(session, company_id, changed, rows)
+        return rows
+
+    @staticmethod
+    def _revaluation_row(company_id, movement, now, created_by):
+        if _number(movement, 'quantity'):
+            raise ValueError('REVALUATION quantity must be 0')
+        total_value = _number(movement, 'total_value')
+        if not total_value:
+            raise ValueError('REVALUATION needs a non-zero total_value')
+        return {
+            'company_id': company_id,
+            'transaction_type': REVALUATION,
+            'reference_type': movement['reference_type'],
+            'reference_id': movement['reference_id'],
+            'quantity': Decimal(0),
+            'unit_price': None,
+            'total_value': round(total_value, 4),
+            'notes': movement.get('notes'),
+            'transaction_date': now,
+            'created_by': created_by,
+        }
+
+    def _notify(self, session, company_id, changed, rows):
+        for listener in self.listeners:
+            listener(session, company_id, changed, rows)
+
+    def _check_stock(self, session, model, company_id, deltas, allow_negative):
+        """Lock the affected rows (on Postgres) and verify tenant and stock"""
+        stmt = (select(model.id, model.current_stock)
+                .where(model.company_id == company_id, model.id.in_(list(deltas))))
+        if session.get_bind().dialect.name != 'sqlite':
+            stmt = stmt.with_for_update()
+        stock = dict(session.execute(stmt).all())
+        for item_id, delta in deltas.items():
+            if item_id not in stock:
+                raise ValueError(f'Unknown {model.__tablename__} id: {item_id}')
+            if not allow_negative and delta < 0 and _dec(stock[item_id]) + delta < 0:
+                raise ValueError(f'Insufficient stock for {model.__tablename__} id {item_id}')
+
+    # ---------- checkpoints ----------
+
+    def _latest_checkpoint(self, session, company_id, as_of=None):
+        snapshot = self.snapshot
+        stmt = select(snapshot.taken_at, snapshot.last_transaction_id).where(
+            snapshot.company_id == company_id)
+        if as_of is not None:
+            stmt = stmt.where(snapshot.taken_at <= as_of)
+        return session.execute(
+            stmt.order_by(snapshot.taken_at.desc()).limit(1)
+        ).first()
+
+    def _ledger_totals(self, session, company_id, after_id=0, as_of=None, reference_type=None):
+        """Sum of quantity and value per item for ledger rows after a checkpoint"""
+        tx = self.transaction
+        stmt = (select(tx.reference_type, tx.reference_id,
+                       func.sum(tx.quantity), func.sum(func.coalesce(tx.total_value, 0)))
+                .where(tx.company_id == company_id, tx.id > after_id)
+                .group_by(tx.reference_type, tx.reference_id))
+        if as_of is not None:
+            stmt = stmt.where(tx.transaction_date <= as_of)
+        if reference_type is not None:
+            stmt = stmt.where(tx.reference_type == reference_type)
+        return {(r[0], r[1]): (_dec(r[2]), _dec(r[3])) for r in session.execute(stmt)}
+
+    def _snapshot_rows(self, session, company_id, taken_at, reference_type=None):
+        snapshot = self.snapshot
+        stmt = (select(snapshot.reference_type, snapshot.reference_id,
+                       snapshot.quantity, snapshot.value)
+                .where(snapshot.company_id == company_id, snapshot.taken_at == taken_at))
+        if reference_type is not None:
+            stmt = stmt.where(snapshot.reference_type == reference_type)
+        return {(r[0], r[1]): (_dec(r[2]), _dec(r[3])) for r in session.execute(stmt)}
+
+    def balances_at(self, session, company_id, as_of=None, reference_type=None):
+        """{(reference_type, reference_id): (quantity, value)} as of a moment.
+
+        Reads one checkpoint and the ledger rows written after it, so the
+        cost is bounded by the checkpoint interval rather than history length.
+        """
+        checkpoint = self._latest_checkpoint(session, company_id, as_of)
+        if checkpoint is None:
+            balances, after_id = {}, 0
+        else:
+            balances = self._snapshot_rows(session, company_id, checkpoint.taken_at, reference_type)
+            after_id = checkpoint.last_transaction_id or 0
+        for key, (quantity, value) in self._ledger_totals(
+                session, company_id, after_id, as_of, reference_type).items():
+            base_quantity, base_value = balances.get(key, (Decimal(0), Decimal(0)))
+            balances[key] = (base_quantity + quantity, base_value + value)
+        return balances
+
+    def reconcile(self, session, company_id, reference_type=None, now=None):
+        """Write ADJUSTMENT rows wherever current_stock drifted from the ledger.
+
+        Covers stock set outside post() (item creation, bulk import, rows
+        that predate the ledger). Returns the number of adjustments; caller commits.
+        """
+        now = now or datetime.utcnow()
+        expected = self.balances_at(session, company_id, reference_type=reference_type)
+        movements = []
+        for kind, model in self.items.items():
+            if reference_type is not None and kind != reference_type:
+                continue
+            columns = [model.id, model.current_stock]
+            if hasattr(model, 'avg_cost'):
+                columns.append(model.avg_cost)
+            for row in session.execute(select(*columns).where(model.company_id == company_id)):
+                drift = _dec(row[1]) - expected.get((kind, row[0]), (Decimal(0),))[0]
+                if drift:
+                    movements.append({
+                        'company_id': company_id,
+                        'transaction_type': 'ADJUSTMENT',
+                        'reference_type': kind,
+                        'reference_id': row[0],
+                        'quantity': round(drift, 4),
+                        'unit_price': round(_dec(row[2]), 4) if len(row) > 2 else None,
+                        'total_value': round(drift * _dec(row[2]), 4) if len(row) > 2 else None,
+                        'notes': 'Reconciled to on-hand balance',
+                        'transaction_date': now,
+                    })
+        if movements:
+            session.execute(insert(self.transaction), movements)
+            changed = defaultdict(set)
+            for movement in movements:
+                changed[movement['reference_type']].add(movement['reference_id'])
+            self._notify(session, company_id, dict(changed), movements)
+        return len(movements)
+
+    def checkpoint(self, session, company_id, now=None):
+        """Reconcile, then store every current balance as a snapshot row"""
+        now = now or datetime.utcnow()
+        self.reconcile(session, company_id, now=now)
+        tx = self.transaction
+        last_id = session.execute(
+            select(func.max(tx.id)).where(tx.company_id == company_id)
+        ).scalar() or 0
+
+        balances = self.balances_at(session, company_id)
+        rows = [{
+            'company_id': company_id,
+            'reference_type': reference_type,
+            'reference_id': reference_id,
+            'quantity': round(quantity, 4),
+            'value': round(value, 4),
+            'last_transaction_id': last_id,
+            'taken_at': now,
+        } for (reference_type, reference_id), (quantity, value) in balances.items()]
+        if rows:
+            session.execute(insert(self.snapshot), rows)
+        return len(rows)
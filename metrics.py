@@ -0,0 +1,179 @@
+# metrics.py - Per-endpoint latency, SQL counts and a slow-query log
+#
+# install(app, engine) times every request and every SQL statement. Figures
+# are kept per worker process and exposed in Prometheus text format; scrape
+# each worker (or run one worker) for complete numbers.
+#
+#   SLOW_QUERY_MS         log statements slower than this (default 200, 0 = off)
+#   REPEATED_QUERY_LIMIT  warn when one statement runs more often than this in
+#                         a single request, the usual sign of an N+1 (default 10)
+#   METRICS_TOKEN         /metrics requires "Authorization: Bearer <token>"; without
+#                         it the endpoint only answers in debug or testing mode
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, abort, has_request_context, request
+from sqlalchemy import event
+
+log = logging.getLogger('inventory.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+_IN_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)|\((?:\s*%\(\w+\)s\s*,)+\s*%\(\w+\)s\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """One line, IN lists of any length collapsed, so repeats compare equal"""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Per-request counters live in the WSGI environ rather than on g: a streamed
+# body runs in a new app context (so a new g) but the same request
+STATS_KEY = 'inventory.metrics'
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.statements = Counter()
+
+
+class Metrics:
+    """Thread-safe store for request and database measurements"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.db_time = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.slow_queries = 0
+        self.repeated = Counter()
+
+    def record_request(self, labels, seconds, query_count, db_seconds):
+        with self._lock:
+            self.latency[labels].observe(seconds)
+            self.queries[labels].observe(query_count)
+            self.db_time[labels].observe(db_seconds)
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def record_repeated(self, endpoint):
+        with self._lock:
+            self.repeated[endpoint] += 1
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, series):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (endpoint, method, status), h in sorted(series.items()):
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{{labels}}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {h.count}')
+
+        with self._lock:
+            histogram('http_request_duration_seconds', 'Request latency by endpoint.', self.latency)
+            histogram('db_queries_per_request', 'SQL statements executed per request.', self.queries)
+            histogram('db_time_per_request_seconds', 'Time spent in SQL per request.', self.db_time)
+            lines.append('# HELP db_slow_queries_total Statements slower than SLOW_QUERY_MS.')
+            lines.append('# TYPE db_slow_queries_total counter')
+            lines.append(f'db_slow_queries_total {self.slow_queries}')
+            lines.append('# HELP db_repeated_queries_total Requests that repeated one statement '
+                         'more than REPEATED_QUERY_LIMIT times (likely N+1).')
+            lines.append('# TYPE db_repeated_queries_total counter')
+            for endpoint, count in sorted(self.repeated.items()):
+                lines.append(f'db_repeated_queries_total{{endpoint="{endpoint}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def install(app, engine, env=os.environ):
+    """Hook request timing, SQL timing and the /metrics endpoint into an app"""
+    metrics = Metrics()
+    slow_seconds = int(env.get('SLOW_QUERY_MS', 200)) / 1000
+    repeat_limit = int(env.get('REPEATED_QUERY_LIMIT', 10))
+    token = env.get('METRICS_TOKEN')
+
+    @app.before_request
+    def _start_timer():
+        request.environ[STATS_KEY] = RequestStats()
+
+    @app.after_request
+    def _record_on_close(response):
+        stats = request.environ.pop(STATS_KEY, None)
+        if stats is None:
+            return response
+        # Streamed bodies are produced after this hook, under a fresh app
+        # context; keep counting into the same stats until the response closes
+        request.environ[STATS_KEY] = stats
+        labels = (request.endpoint or 'unmatched', request.method, response.status_code)
+        response.call_on_close(lambda: _record_request(labels, stats))
+        return response
+
+    def _record_request(labels, stats):
+        metrics.record_request(labels, time.perf_counter() - stats.start, stats.query_count,
+                               stats.query_seconds)
+        if stats.statements:
+            statement, count = stats.statements.most_common(1)[0]
+            if count > repeat_limit:
+                metrics.record_repeated(labels[0])
+                log.warning('%s ran the same statement %d times (possible N+1): %s',
+                            labels[0], count, statement[:300])
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if slow_seconds and elapsed >= slow_seconds:
+            metrics.record_slow_query()
+            # Statement text only; bound parameters may hold customer data
+            log.warning('Slow query (%.0f ms): %s', elapsed * 1000, normalize(statement)[:1000])
+        stats = request.environ.get(STATS_KEY) if has_request_context() else None
+        if stats is not None:
+            stats.query_count += 1
+            stats.query_seconds += elapsed
+            stats.statements[normalize(statement)] += 1
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not token:
+            # Endpoint names and traffic are not for the public internet
+            if not (app.debug or app.testing):
+                abort(404)
+        elif request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
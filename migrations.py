@@ -0,0 +1,164 @@
+# migrations.py - Versioned schema upgrades for existing SQLite/Postgres databases
+#
+# db.create_all() only creates missing tables, so anything added to an
+# existing table (columns, indexes) needs a migration here. Each migration is
+# idempotent and runs in its own transaction; the applied version is stored in
+# the schema_version table.
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, select, text
+
+from search import create_index as create_search_index
+
+_version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', _version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200)),
+)
+
+
+def _create_missing_indexes(connection, metadata):
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            # Indexes on columns a later migration adds are created by that migration
+            if index.name not in existing and all(c.name in columns for c in index.columns):
+                index.create(connection)
+
+
+def _add_missing_columns(connection, metadata):
+    """ALTER TABLE ... ADD COLUMN for declared columns an existing table lacks.
+
+    Only nullable columns without server defaults can be added this way,
+    which is what new optional fields on existing models look like.
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    preparer = connection.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} '
+                f'ADD COLUMN {preparer.format_column(column)} {column_type}'
+            ))
+
+
+def _company_tenancy(connection, metadata):
+    """Move tenancy from users to companies.
+
+    Every existing user gets a company of their own, named after the old
+    users.company_name, becomes its admin, and their rows move to it; user_id is copied to
+    created_by where the table has one. The old user_id columns are left in
+    place, unmapped, and their indexes are dropped.
+    """
+    preparer = connection.dialect.identifier_preparer
+    inspector = inspect(connection)
+    legacy = {name: {c['name'] for c in inspector.get_columns(name)}
+              for name in inspector.get_table_names()}
+
+    # collection_versions had user_id in its primary key; rebuild it per company
+    old_versions = []
+    if 'user_id' in legacy.get('collection_versions', ()):
+        old_versions = connection.execute(
+            text('SELECT user_id, collection, version FROM collection_versions')).all()
+        connection.execute(text('DROP TABLE collection_versions'))
+        metadata.tables['collection_versions'].create(connection)
+        del legacy['collection_versions']
+
+    _add_missing_columns(connection, metadata)
+
+    users = metadata.tables['users']
+    companies = metadata.tables['companies']
+    name = 'company_name' if 'company_name' in legacy.get('users', ()) else 'email'
+    for user_id, email, company_name in connection.execute(text(
+            f'SELECT id, email, {name} FROM users WHERE company_id IS NULL')).all():
+        company_id = connection.execute(
+            companies.insert().values(name=company_name or email)).inserted_primary_key[0]
+        connection.execute(users.update().where(users.c.id == user_id).values(
+            company_id=company_id, role='admin'))
+
+    for table in metadata.sorted_tables:
+        if 'company_id' not in table.c or 'user_id' not in legacy.get(table.name, ()):
+            continue
+        quoted = preparer.format_table(table)
+        connection.execute(text(
+            f'UPDATE {quoted} SET company_id = (SELECT users.company_id FROM users '
+            f'WHERE users.id = {quoted}.user_id) WHERE company_id IS NULL'))
+        if 'created_by' in table.c:
+            connection.execute(text(
+                f'UPDATE {quoted} SET created_by = user_id WHERE created_by IS NULL'))
+        for index in inspect(connection).get_indexes(table.name):
+            if 'user_id' in index['column_names']:
+                connection.execute(text(f'DROP INDEX {preparer.quote(index["name"])}'))
+
+    versions = {}
+    if old_versions:
+        owners = dict(connection.execute(select(users.c.id, users.c.company_id)).all())
+        for user_id, collection, version in old_versions:
+            key = (owners.get(user_id), collection)
+            if key[0] is not None:
+                versions[key] = max(versions.get(key, 0), version)
+    if versions:
+        # One past the old value so no list ETag issued before the move is reused
+        connection.execute(metadata.tables['collection_versions'].insert(), [
+            {'company_id': company_id, 'collection': collection, 'version': version + 1}
+            for (company_id, collection), version in versions.items()])
+
+    _create_missing_indexes(connection, metadata)
+
+
+def _catalog_search(connection, metadata):
+    """FTS5 table and triggers on SQLite, pg_trgm indexes on Postgres; see search.py"""
+    tables = metadata.tables
+    create_search_index(connection, {'material': tables['raw_materials'], 'part': tables['parts'],
+                                     'product': tables['products']})
+
+
+# (version, description, function(connection, metadata)) in apply order
+MIGRATIONS = [
+    (1, 'tenant and lookup indexes', _create_missing_indexes),
+    (2, 'parts.material_id', _add_missing_columns),
+    (3, 'company tenancy', _company_tenancy),
+    (4, 'valuation tables', _create_missing_indexes),
+    (5, 'catalog search index', _catalog_search),
+    (6, 'jobs.heartbeat_at', _add_missing_columns),
+]
+
+# Applying either means stock that predates the ledger still has to be
+# reconciled into it (ledger.checkpoint()) before valuation.rebuild()
+LEDGER_MIGRATIONS = (3, 4)
+VALUATION_MIGRATION = 4
+
+
+def current_version(connection):
+    _version_metadata.create_all(connection)
+    return connection.execute(
+        select(schema_version.c.version).order_by(schema_version.c.version.desc()).limit(1)
+    ).scalar() or 0
+
+
+def upgrade(engine, metadata):
+    """Apply pending migrations; returns the list of versions applied"""
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    applied = []
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            migrate(connection, metadata)
+            connection.execute(schema_version.insert().values(version=number,
+                                                              description=description))
+        applied.append(number)
+    return applied
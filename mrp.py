@@ -0,0 +1,79 @@
+# mrp.py - Material requirements planning from product demand
+#
+# The plan is three sparse matrix-vector products over flattened BOMs:
+#   net products  = max(demand - product stock, 0)
+#   gross parts   = net products x BOM matrix            (products -> parts)
+#   material kg   = max(gross - part stock, 0) x weight  (parts -> materials)
+# Matrices are kept as COO columns (row, column, value), so each product is a
+# single flat pass over the non-zero entries regardless of BOM depth.
+from decimal import Decimal
+
+
+def _dec(value):
+    return Decimal(str(value or 0))
+
+
+def bom_matrix(flat):
+    """COO columns (product_ids, part_ids, quantities) of flattened BOMs"""
+    products, parts, quantities = [], [], []
+    for product_id, bom in flat.items():
+        for part_id, quantity in bom.items():
+            products.append(product_id)
+            parts.append(part_id)
+            quantities.append(quantity)
+    return products, parts, quantities
+
+
+def _net(gross, stock):
+    return {key: max(value - _dec(stock.get(key)), Decimal(0)) for key, value in gross.items()}
+
+
+def _matvec(vector, rows, columns, values):
+    """vector (keyed by row) x sparse matrix -> result keyed by column"""
+    result = {}
+    for row, column, value in zip(rows, columns, values):
+        amount = vector.get(row)
+        if amount:
+            result[column] = result.get(column, 0) + amount * value
+    return result
+
+
+def plan(demand, product_stock, matrix, part_stock, part_weight, part_material, material_stock):
+    """Net demand down to raw-material shortages.
+
+    demand and the *_stock arguments are {id: quantity}; part_weight is
+    {part_id: kg per piece} and part_material {part_id: material_id}.
+    Returns a dict of products, parts and materials rows plus the products
+    without a BOM and the parts that could not be converted to a material.
+    """
+    demand = {product_id: _dec(quantity) for product_id, quantity in demand.items()}
+    net_products = _net(demand, product_stock)
+
+    gross_parts = _matvec(net_products, *matrix)
+    net_parts = _net(gross_parts, part_stock)
+
+    # Parts -> materials is a one-hot matrix scaled by weight per piece
+    mapped = [p for p in net_parts if part_material.get(p) and _dec(part_weight.get(p)) > 0]
+    part_kg = {p: net_parts[p] * _dec(part_weight[p]) for p in mapped}
+    required = _matvec(part_kg, mapped, [part_material[p] for p in mapped], [1] * len(mapped))
+    shortages = _net(required, material_stock)
+
+    with_bom = set(matrix[0])
+    return {
+        'products': [{'product_id': product_id,
+                      'demand': demand[product_id],
+                      'on_hand': _dec(product_stock.get(product_id)),
+                      'net': net_products[product_id]} for product_id in demand],
+        'parts': [{'part_id': part_id,
+                   'gross': gross_parts[part_id],
+                   'on_hand': _dec(part_stock.get(part_id)),
+                   'net': net_parts[part_id],
+                   'material_id': part_material.get(part_id),
+                   'kg': part_kg.get(part_id, Decimal(0))} for part_id in sorted(gross_parts)],
+        'materials': [{'material_id': material_id,
+                       'required': required[material_id],
+                       'on_hand': _dec(material_stock.get(material_id)),
+                       'shortage': shortages[material_id]} for material_id in sorted(required)],
+        'without_bom': [p for p in demand if net_products[p] > 0 and p not in with_bom],
+        'unmapped_parts': [p for p in net_parts if net_parts[p] > 0 and p not in part_kg],
+    }
@@ -0,0 +1,49 @@
+# ratelimit.py - In-process token buckets for throttling by key (IP, account)
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Thread-safe token buckets, one per key, LRU-bounded to `maxsize` keys.
+
+    Each bucket holds up to `capacity` tokens and refills at `rate` tokens
+    per second. Like TTLCache, every gunicorn worker has its own buckets,
+    so the effective limit is per worker.
+    """
+
+    def __init__(self, capacity, rate, maxsize=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refilled(self, key, now):
+        tokens, stamp = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - stamp) * self.rate)
+
+    def acquire(self, key):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        if not self.capacity:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refilled(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0
+        return False, (1 - tokens) / self.rate if self.rate else None
+
+    def refund(self, key):
+        """Give a token back, e.g. after a successful login"""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._buckets:
+                self._buckets[key] = (min(self.capacity, self._refilled(key, now) + 1), now)
@@ -0,0 +1,405 @@
+# search.py - Full-text and faceted search over the item catalog
+#
+# Queries match name, grade, material_type, specific_type and size. Every
+# query word has to match some word of the item: exactly, as a prefix ("vit"
+# finds "Viton") or inside it ("ring" finds "Oring"). Only when nothing
+# matches that way is trigram similarity tried, so typos still hit
+# ("vition"). Results carry facet counts by item type, material type and unit
+# over every match, before the facet filters narrow the page.
+#
+# Candidates come from an index; ranking and facets are computed here on at
+# most SEARCH_MAX_MATCHES of them. Trigram indexes need a word of 3+ letters,
+# so queries made only of shorter words scan up to that many of the company's
+# items instead. The index depends on the database:
+#   sqlite      FTS5 table catalog_search (trigram tokenizer), kept in step
+#               with the catalog tables by triggers, so ORM writes, bulk
+#               imports and raw SQL are all covered
+#   postgresql  pg_trgm GIN indexes on the catalog tables themselves
+#   memory      per-company trigram index, rebuilt when the company's
+#               collection versions move (i.e. after any catalog write); used
+#               when the database has neither of the above
+# create_index() builds the first two; migrations.py runs it.
+#
+#   SEARCH_BACKEND      "memory" forces the in-process index (default "auto")
+#   SEARCH_MAX_MATCHES  candidates ranked per query (default 1000)
+#   SEARCH_SIMILARITY   minimum trigram similarity for a fuzzy match (default 0.3)
+#   SEARCH_CACHE_SIZE   companies held by the memory index (default 64)
+import os
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+from sqlalchemy import func, literal, literal_column, or_, select, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from cache import TTLCache
+
+FIELDS = ('name', 'grade', 'material_type', 'specific_type', 'size')
+FACETS = ('item_type', 'material_type', 'unit')
+# FTS rowid = item id * 4 + code, so the triggers address an item's row directly
+ITEM_CODES = {'material': 1, 'part': 2, 'product': 3}
+FTS_TABLE = 'catalog_search'
+
+Document = namedtuple('Document', ('item_type', 'id') + FIELDS + ('unit',))
+
+_WORD = re.compile(r'\w+')
+
+
+def words(value):
+    return _WORD.findall(value.lower()) if value else []
+
+
+@lru_cache(maxsize=65536)
+def _trigrams(word):
+    """pg_trgm-style trigram set: two spaces of padding in front, one behind"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _substrings(word):
+    """The unpadded trigrams of a word, which is what FTS5's tokenizer indexes"""
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _word_score(word, tokens, similarity):
+    best = 0.0
+    for token in tokens:
+        if token == word:
+            return 1.0
+        if token.startswith(word):
+            best = max(best, 0.9)
+        elif word in token:
+            best = max(best, 0.7)
+    if best:
+        return best
+    grams = _trigrams(word)
+    for token in tokens:
+        other = _trigrams(token)
+        best = max(best, len(grams & other) / len(grams | other))
+    # Fuzzy matches always rank below literal ones
+    return 0.6 * best if best >= similarity else 0.0
+
+
+def _tenant(company_id):
+    # Delimited so tenant 1 never matches inside tenant 12's marker
+    return f'~{company_id}~'
+
+
+def _searchable(columns):
+    return [c for c in FIELDS if c in columns]
+
+
+def _document(columns):
+    """Lower-cased, space-joined searchable columns: the trigram index expression.
+
+    Queries must use the same expression for Postgres to pick the index.
+    """
+    parts = [func.coalesce(c, literal_column("''")) for c in columns]
+    document = parts[0]
+    for part in parts[1:]:
+        document = document.op('||')(literal_column("' '")).op('||')(part)
+    return func.lower(document)
+
+
+def _index_name(table_name):
+    return f'ix_{table_name}_search'
+
+
+# ============== INDEX BACKENDS ==============
+# candidates(session, company_id, query_words, limit, fuzzy) returns up to
+# limit + 1 Documents; the extra one signals that the match set was cut off.
+# The literal pass returns items containing every query word of 3+ letters,
+# which is exact for those words. The fuzzy pass returns items sharing any
+# trigram with the query, best first where the index can rank.
+
+def _long(query_words):
+    return [w for w in query_words if len(w) >= 3]
+
+
+class _Fts5Index:
+    name = 'fts5'
+
+    def __init__(self, search):
+        self.search = search
+
+    def candidates(self, session, company_id, query_words, limit, fuzzy=False):
+        # Words are \w+ only, so quoting them needs no escaping
+        expr = f'tenant : "{_tenant(company_id)}"'
+        order = ''
+        if fuzzy:
+            grams = sorted(set().union(*(_substrings(w) for w in query_words)))
+            expr += ' AND (' + ' OR '.join(f'"{g}"' for g in grams) + ')'
+            order = 'ORDER BY rank'
+        else:
+            # A quoted word is a substring match under the trigram tokenizer
+            expr += ''.join(f' AND "{w}"' for w in _long(query_words))
+        rows = session.execute(text(
+            f'SELECT rowid, {", ".join(FIELDS)}, unit FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH :expr {order} LIMIT :limit'
+        ), {'expr': expr, 'limit': limit + 1}).all()
+        item_types = {code: item_type for item_type, code in ITEM_CODES.items()}
+        return [Document(item_types[r[0] % 4], r[0] // 4, *r[1:]) for r in rows]
+
+
+class _TrigramIndex:
+    name = 'pg_trgm'
+
+    def __init__(self, search):
+        self.search = search
+
+    def candidates(self, session, company_id, query_words, limit, fuzzy=False):
+        long_words = _long(query_words)
+        if fuzzy:
+            # Applies to the <% operator below, for this transaction only
+            session.execute(select(func.set_config('pg_trgm.word_similarity_threshold',
+                                                   str(self.search.similarity), True)))
+        docs = []
+        for item_type, model in self.search.items.items():
+            columns = self.search.columns[item_type]
+            document = _document([getattr(model, c) for c in _searchable(columns)])
+            stmt = (select(model.id, *[getattr(model, c) for c in columns])
+                    .where(model.company_id == company_id).limit(limit + 1))
+            if fuzzy:
+                stmt = stmt.where(or_(*[literal(w).op('<%', is_comparison=True)(document)
+                                        for w in long_words])).order_by(
+                    func.greatest(*[func.word_similarity(w, document) for w in long_words]).desc())
+            else:
+                stmt = stmt.where(*[document.contains(w, autoescape=True) for w in long_words])
+            docs.extend(self.search.document(item_type, r) for r in session.execute(stmt))
+        return docs
+
+
+class _MemoryIndex:
+    name = 'memory'
+
+    def __init__(self, search, version_model, maxsize):
+        self.search = search
+        self.version = version_model
+        self._cache = TTLCache(maxsize=maxsize, ttl=3600)
+
+    def _build(self, session, company_id):
+        docs, postings = [], {}
+        for item_type, model in self.search.items.items():
+            columns = self.search.columns[item_type]
+            rows = session.execute(
+                select(model.id, *[getattr(model, c) for c in columns])
+                .where(model.company_id == company_id).order_by(model.id)
+            )
+            docs.extend(self.search.document(item_type, r) for r in rows)
+        for position, doc in enumerate(docs):
+            grams = set()
+            for field in FIELDS:
+                for word in words(getattr(doc, field)):
+                    grams |= _substrings(word)
+            for gram in grams:
+                postings.setdefault(gram, set()).add(position)
+        return docs, postings
+
+    def _index(self, session, company_id):
+        version = self.version
+        versions = tuple(session.execute(
+            select(version.collection, version.version)
+            .where(version.company_id == company_id,
+                   version.collection.in_([f'{item_type}s' for item_type in self.search.items]))
+            .order_by(version.collection)
+        ).all())
+        entry = self._cache.get(company_id)
+        if entry is None or entry[0] != versions:
+            entry = (versions, self._build(session, company_id))
+            self._cache.set(company_id, entry)
+        return entry[1]
+
+    def candidates(self, session, company_id, query_words, limit, fuzzy=False):
+        docs, postings = self._index(session, company_id)
+        if fuzzy:
+            hits = Counter()
+            for gram in set().union(*(_substrings(w) for w in query_words)):
+                hits.update(postings.get(gram, ()))
+            return [docs[position] for position, _ in hits.most_common(limit + 1)]
+
+        grams = set().union(*(_substrings(w) for w in _long(query_words)))
+        if not grams:
+            return docs[:limit + 1]
+        # Smallest posting set first keeps the intersection cheap
+        sets = sorted((postings.get(g, set()) for g in grams), key=len)
+        positions = set(sets[0]).intersection(*sets[1:])
+        return [docs[position] for position in sorted(positions)[:limit + 1]]
+
+
+# ============== SEARCH ==============
+
+class CatalogSearch:
+    """Ranked, faceted search over `items` (item_type -> model) for one company.
+
+    `version_model` is the collection version table; the memory index reads it
+    to notice catalog writes made by any worker.
+    """
+
+    def __init__(self, items, version_model, env=os.environ):
+        self.items = items
+        self.columns = {item_type: [c for c in FIELDS + ('unit',) if hasattr(model, c)]
+                        for item_type, model in items.items()}
+        self.max_matches = int(env.get('SEARCH_MAX_MATCHES', 1000))
+        self.similarity = float(env.get('SEARCH_SIMILARITY', 0.3))
+        self.backend_name = env.get('SEARCH_BACKEND', 'auto')
+        if self.backend_name not in ('auto', 'memory'):
+            raise ValueError(f'Unknown search backend: {self.backend_name}')
+        self.memory = _MemoryIndex(self, version_model, int(env.get('SEARCH_CACHE_SIZE', 64)))
+        self._backend = None
+
+    def document(self, item_type, row):
+        values = dict(zip(self.columns[item_type], row[1:]))
+        return Document(item_type, row[0], *(values.get(c) for c in FIELDS + ('unit',)))
+
+    def backend(self, session):
+        """The index in use; detected on the first search, not at startup"""
+        if self._backend is None:
+            self._backend = self._detect(session)
+        return self._backend
+
+    def _detect(self, session):
+        if self.backend_name == 'memory':
+            return self.memory
+        dialect = session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            found = session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': FTS_TABLE}).first()
+            if found:
+                return _Fts5Index(self)
+        elif dialect == 'postgresql':
+            names = [_index_name(model.__table__.name) for model in self.items.values()]
+            found = session.execute(text(
+                'SELECT count(*) FROM pg_indexes WHERE indexname = ANY(:names)'
+            ), {'names': names}).scalar()
+            if found == len(names):
+                return _TrigramIndex(self)
+        return self.memory
+
+    def _score(self, query_words, doc):
+        name = words(doc.name)
+        rest = [w for field in FIELDS[1:] for w in words(getattr(doc, field))]
+        total = 0.0
+        for word in query_words:
+            score = max(_word_score(word, name, self.similarity),
+                        0.9 * _word_score(word, rest, self.similarity))
+            if not score:
+                return 0.0
+            total += score
+        return total / len(query_words)
+
+    def search(self, session, company_id, query, item_type=None, material_type=None,
+               unit=None, limit=20, offset=0):
+        """{'total', 'truncated', 'items', 'facets'} for a query; raises ValueError if empty"""
+        query_words = words(query)
+        if not query_words:
+            raise ValueError('Search query is empty')
+        backend = self.backend(session)
+        # Typo tolerance is a fallback: the fuzzy pass runs only when no item
+        # matches every word literally
+        for fuzzy in (False, True):
+            if fuzzy and not _long(query_words):
+                break
+            docs = backend.candidates(session, company_id, query_words, self.max_matches, fuzzy)
+            truncated = len(docs) > self.max_matches
+            matches = []
+            for doc in docs[:self.max_matches]:
+                score = self._score(query_words, doc)
+                if score:
+                    matches.append((score, doc))
+            if matches:
+                break
+        matches.sort(key=lambda m: (-m[0], ITEM_CODES[m[1].item_type], m[1].name or '', m[1].id))
+
+        facets = {facet: Counter() for facet in FACETS}
+        for _, doc in matches:
+            for facet in FACETS:
+                value = getattr(doc, facet)
+                if value is not None:
+                    facets[facet][value] += 1
+
+        filters = {'item_type': item_type, 'material_type': material_type, 'unit': unit}
+        hits = [(score, doc) for score, doc in matches
+                if all(value is None or getattr(doc, facet) == value
+                       for facet, value in filters.items())]
+        return {
+            'total': len(hits),
+            'truncated': truncated,
+            'items': [self._serialize(score, doc) for score, doc in hits[offset:offset + limit]],
+            'facets': {facet: dict(counts.most_common()) for facet, counts in facets.items()},
+        }
+
+    def _serialize(self, score, doc):
+        item = {'item_type': doc.item_type, 'id': doc.id}
+        item.update((c, getattr(doc, c)) for c in self.columns[doc.item_type])
+        item['score'] = round(score, 3)
+        return item
+
+
+# ============== INDEX DDL ==============
+
+def create_index(connection, tables):
+    """Build the database's search index over `tables` (item_type -> Table) and
+    fill it from existing rows. Databases without FTS5 or pg_trgm are left as
+    they are; search then uses the memory index.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        _create_fts5(connection, tables)
+    elif dialect == 'postgresql':
+        _create_trigram(connection, tables)
+
+
+def _create_fts5(connection, tables):
+    connection.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+    try:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"tenant, {', '.join(FIELDS)}, unit UNINDEXED, tokenize = 'trigram')"
+        ))
+    except OperationalError:
+        # SQLite built without FTS5, or older than 3.34 (no trigram tokenizer)
+        return
+
+    for item_type, table in tables.items():
+        code = ITEM_CODES[item_type]
+        columns = [c for c in FIELDS + ('unit',) if c in table.c]
+        target = ', '.join(['rowid', 'tenant'] + columns)
+
+        def values(ref):
+            return ', '.join([f'{ref}.id * 4 + {code}', f"'~' || {ref}.company_id || '~'"]
+                             + [f'{ref}.{c}' for c in columns])
+
+        connection.execute(text(
+            f'INSERT INTO {FTS_TABLE} ({target}) SELECT {values(table.name)} FROM {table.name}'))
+
+        trigger = f'{FTS_TABLE}_{table.name}'
+        assignments = ', '.join([f"tenant = '~' || new.company_id || '~'"]
+                                + [f'{c} = new.{c}' for c in columns])
+        for action in ('insert', 'update', 'delete'):
+            connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}_{action}'))
+        connection.execute(text(
+            f'CREATE TRIGGER {trigger}_insert AFTER INSERT ON {table.name} BEGIN '
+            f'INSERT INTO {FTS_TABLE} ({target}) VALUES ({values("new")}); END'))
+        connection.execute(text(
+            f'CREATE TRIGGER {trigger}_update AFTER UPDATE OF '
+            f'{", ".join(["company_id"] + columns)} ON {table.name} BEGIN '
+            f'UPDATE {FTS_TABLE} SET {assignments} WHERE rowid = old.id * 4 + {code}; END'))
+        connection.execute(text(
+            f'CREATE TRIGGER {trigger}_delete AFTER DELETE ON {table.name} BEGIN '
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 4 + {code}; END'))
+
+
+def _create_trigram(connection, tables):
+    try:
+        with connection.begin_nested():
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    except DBAPIError:
+        # Creating extensions needs a suitably privileged role
+        return
+    for table in tables.values():
+        document = _document([literal_column(c) for c in _searchable(table.c.keys())])
+        document = document.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {_index_name(table.name)} ON {table.name} '
+            f'USING gin (({document}) gin_trgm_ops)'))
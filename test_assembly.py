@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.mark.parametrize('url', ['/api/assembly/check', '/api/assembly/run', '/api/mrp/plan'])
+@pytest.mark.parametrize('items, error', [
+    ([{'product_id': 1, 'quantity': 'abc'}], 'quantity must be a number'),
+    ([{'product_id': 1, 'quantity': 1.5}], 'quantity must be a positive whole number'),
+    ([1], 'items must be a list of objects'),
+])
+def test_bad_items_are_rejected(client, url, items, error):
+    response = client.post(url, json={'items': items})
+    assert response.status_code == 400
+    assert response.json['error'] == error
@@ -0,0 +1,31 @@
+import app as inventory
+from database import User, db
+from ratelimit import TokenBucketLimiter
+
+
+def _login(client, password):
+    return client.post('/login', data={'email': 'admin@example.com', 'password': password})
+
+
+def test_failed_logins_are_throttled_per_account(app, monkeypatch):
+    monkeypatch.setattr(inventory, 'login_account_limiter', TokenBucketLimiter(3, 1 / 60))
+    client = app.test_client()
+    assert [_login(client, 'wrong').status_code for _ in range(3)] == [401] * 3
+    throttled = _login(client, 'admin123')
+    assert throttled.status_code == 429
+    assert int(throttled.headers['Retry-After']) > 0
+
+
+def test_successful_logins_do_not_use_up_the_limit(app, monkeypatch):
+    monkeypatch.setattr(inventory, 'login_account_limiter', TokenBucketLimiter(2, 1 / 60))
+    client = app.test_client()
+    assert [_login(client, 'admin123').status_code for _ in range(4)] == [302] * 4
+
+
+def test_login_upgrades_hashes_made_with_old_settings(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    _login(app.test_client(), 'admin123')
+    user = User.query.filter_by(email='admin@example.com').one()
+    db.session.refresh(user)
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('admin123')
@@ -0,0 +1,35 @@
+import cache
+from cache import TTLCache
+
+
+def test_entries_expire_and_evict_least_recently_used(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    store = TTLCache(maxsize=2, ttl=10)
+    store.set('a', 1)
+    store.set('b', 2)
+    assert store.get('a') == 1  # 'b' is now the least recently used
+    store.set('c', 3)
+    assert store.get('b') is None and len(store) == 2
+
+    now[0] += 11
+    assert store.get('a') is None
+    store.set('d', 4, ttl=30)
+    now[0] += 20
+    assert store.get('d') == 4
+
+
+def test_identity_cache_expires_however_often_it_is_read(app, monkeypatch):
+    from app import load_user, user_cache
+    from database import User
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    user_id = User.query.filter_by(email='admin@example.com').one().id
+    with app.test_request_context():
+        identity = load_user(str(user_id))
+        for _ in range(3):
+            now[0] += user_cache.ttl / 4
+            assert load_user(str(user_id)) is identity
+        # Hits did not extend the entry, so it runs out TTL after the first load
+        now[0] += user_cache.ttl / 2
+        assert load_user(str(user_id)) is not identity
@@ -0,0 +1,41 @@
+import gzip
+import json
+
+from compression import _Gzip, _stream
+
+
+def test_etag_revalidates_until_the_collection_changes(client):
+    with client.get('/api/materials') as first:
+        etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/api/materials', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/materials', json={'name': 'Graphite', 'unit': 'kg'})
+    with client.get('/api/materials', headers={'If-None-Match': etag}) as fresh:
+        assert fresh.status_code == 200 and fresh.headers['ETag'] != etag
+
+
+def test_streamed_lists_are_gzipped(client):
+    with client.get('/api/materials') as plain:
+        expected = plain.json
+    with client.get('/api/materials', headers={'Accept-Encoding': 'gzip'}) as response:
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.get_data())) == expected
+
+
+def test_closing_the_stream_closes_the_body():
+    closed = []
+
+    class Body:
+        def __iter__(self):
+            yield b'['
+            yield b']'
+
+        def close(self):
+            closed.append(True)
+
+    stream = _stream(Body(), _Gzip(6))
+    next(stream)
+    stream.close()  # client went away mid-body
+    assert closed == [True]
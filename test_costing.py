@@ -0,0 +1,54 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from costing import allocate_runs
+
+
+def test_allocations_sum_to_input_cost():
+    rng = random.Random(6)
+    runs = [(Decimal(rng.randint(0, 10**6)) / 100,
+             [(rng.choice([0, Decimal(rng.randint(1, 5000)) / 1000]), rng.randint(1, 50))
+              for _ in range(rng.randint(1, 8))])
+            for _ in range(500)]
+    for (input_cost, outputs), result in zip(runs, allocate_runs(runs)):
+        if all(weight == 0 for weight, _ in outputs):
+            assert result == {'error': 'No valid outputs'}
+            continue
+        assert sum(result['allocated_cost']) == input_cost
+        assert all(cost >= 0 for cost in result['allocated_cost'])
+
+
+def test_allocation_follows_weight():
+    result, = allocate_runs([(100, [(1, 2), (2, 1), (0, 5)])])
+    assert result['allocated_cost'] == [Decimal('50.00'), Decimal('50.00'), Decimal('0.00')]
+    assert result['cost_per_unit'][0] == Decimal('25.0000')
+    assert result['cost_per_kg'] == Decimal('25.0000')
+
+
+def test_invalid_run_fails_alone():
+    results = allocate_runs([('x', [(1, 1)]), (10, [(-1, 2)]), (10, [(1, 'abc')]),
+                             (-5, [(1, 1)]), (10, [(1, 1)])])
+    assert [r.get('error') for r in results] == [
+        'input_cost must be a number', 'Output weight must not be negative',
+        'Output quantity must be a number', 'input_cost must not be negative', None]
+    assert results[-1]['allocated_cost'] == [Decimal('10.00')]
+
+
+@pytest.mark.parametrize('body', [{'runs': [1, 2]}, {'runs': {'id': 1}},
+                                  {'runs': [{'input_cost': 5, 'outputs': [3]}]},
+                                  {'runs': [{'input_cost': 5, 'outputs': 'abc'}]}])
+def test_batch_rejects_malformed_runs(client, body):
+    response = client.post('/api/production/allocate', json=body)
+    assert response.status_code == 400
+
+
+def test_batch_reports_invalid_runs_in_place(client):
+    response = client.post('/api/production/allocate', json={'runs': [
+        {'id': 1, 'input_cost': 'x', 'outputs': [{'weight': 1, 'quantity': 1}]},
+        {'id': 2, 'input_cost': 10, 'outputs': [{'weight': 1, 'quantity': 2}]}]})
+    assert response.status_code == 200
+    first, second = response.json['runs']
+    assert first == {'id': 1, 'error': 'input_cost must be a number'}
+    assert second['outputs'][0]['allocated_cost'] == 10
@@ -0,0 +1,15 @@
+from app import bump_collection_versions, dashboard_cache, dashboard_stats
+from database import RawMaterial, db
+
+
+def test_stats_are_cached_until_a_collection_changes(app, company_id):
+    before = dashboard_stats(company_id)
+    assert dashboard_cache.get(company_id)[1] == before
+
+    db.session.add(RawMaterial(company_id=company_id, name='Graphite', unit='kg'))
+    db.session.commit()
+    assert dashboard_stats(company_id) == before  # nothing announced the write yet
+
+    # Another worker's write: it bumps the shared version but cannot clear this cache
+    bump_collection_versions(company_id, ('materials',))
+    assert dashboard_stats(company_id)['materials'] == before['materials'] + 1
@@ -0,0 +1,37 @@
+from sqlalchemy import create_engine, event, text
+
+import db_config
+from db_config import engine_options, install_statement_timeout
+
+
+def test_postgres_pool_options():
+    options = engine_options('postgresql://db/inventory', env={'DB_POOL_SIZE': '3'})
+    assert options['pool_size'] == 3 and options['pool_pre_ping'] is True
+    # The statement timeout is per request transaction, not per connection
+    assert 'connect_args' not in options
+
+
+def test_sqlite_options():
+    assert engine_options('sqlite://') == {}
+    options = engine_options('sqlite:///inventory.db', env={'SQLITE_BUSY_TIMEOUT_MS': '2000'})
+    assert options['connect_args'] == {'timeout': 2.0} and options['pool_recycle'] == -1
+
+
+def test_statement_timeout_only_inside_requests(monkeypatch):
+    engine = create_engine('sqlite://')
+    monkeypatch.setattr(engine.dialect, 'name', 'postgresql')
+    install_statement_timeout(engine, env={'DB_STATEMENT_TIMEOUT_MS': '500'})
+    monkeypatch.setattr(engine.dialect, 'name', 'sqlite')
+    sent = []
+
+    @event.listens_for(engine, 'before_cursor_execute', retval=True)
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(statement)
+        # SQLite has no statement_timeout
+        return ('SELECT 1', ()) if statement.startswith('SET') else (statement, parameters)
+
+    for in_request in (False, True):
+        monkeypatch.setattr(db_config, 'has_request_context', lambda: in_request)
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 2'))
+    assert sent == ['SELECT 2', 'SET LOCAL statement_timeout = 500', 'SELECT 2']
@@ -0,0 +1,27 @@
+import pytest
+
+from database import Company, Part, RawMaterial, db
+
+
+@pytest.fixture
+def other_material(app):
+    """A raw material that belongs to a second company"""
+    material = RawMaterial(company=Company(name='Other Seals'), name='Foreign NBR', unit='kg')
+    db.session.add(material)
+    db.session.commit()
+    return material.id
+
+
+def test_import_rejects_other_companies_materials(client, company_id, other_material):
+    csv = f'name,material_id\nLinked,1\nForeign,{other_material}\n'
+    response = client.post('/api/import/parts', data=csv, content_type='text/csv')
+    assert response.json['inserted'] == 1
+    assert response.json['errors'] == [{'line': 3, 'error': f'material_id: unknown id {other_material}'}]
+    assert Part.query.filter_by(name='Linked').one().material_id == 1
+    assert Part.query.filter_by(name='Foreign').count() == 0
+
+
+def test_part_create_rejects_other_companies_materials(client, other_material):
+    response = client.post('/api/parts', json={'name': 'Foreign', 'material_id': other_material})
+    assert response.status_code == 400
+    assert client.post('/api/parts', json={'name': 'Linked', 'material_id': 1}).status_code == 200
@@ -0,0 +1,22 @@
+from app import create_app
+from database import RawMaterial, User, db
+
+
+def test_init_db_is_idempotent(app):
+    runner = app.test_cli_runner()
+    materials = RawMaterial.query.count()
+    result = runner.invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'Schema is up to date' in result.output
+    assert RawMaterial.query.count() == materials
+    assert User.query.count() == 1
+
+
+def test_deploy_hook_does_not_seed(tmp_path):
+    app = create_app({'TESTING': True,
+                      'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'empty.db'}"})
+    result = app.test_cli_runner().invoke(args=['init-db', '--no-seed'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert User.query.count() == 0
+        db.engine.dispose()
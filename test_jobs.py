@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from app import ledger
+from database import ItemCost, Part, ProductionOutput, db
+
+
+def _run_jobs(app):
+    result = app.test_cli_runner().invoke(args=['jobs', '--once'])
+    assert result.exception is None, result.output
+
+
+def _part(name):
+    return Part.query.filter_by(name=name).one()
+
+
+def test_recost_posts_corrections_through_the_ledger(app, client, company_id):
+    run_id = client.post('/api/production/run', json={
+        'post': True, 'input_material_id': 1, 'input_quantity': 3, 'input_cost': 100,
+        'outputs': [{'part_name': 'Oring', 'quantity': 7}, {'part_name': 'Cap', 'quantity': 3}],
+    }).json['run_id']
+    oring = _part('Oring')
+    value_before = ledger.balances_at(db.session, company_id)[('part', oring.id)][1]
+
+    # Unchanged inputs re-allocate to the same costs
+    client.post('/api/jobs', json={'kind': 'recost', 'params': {'apply': True}})
+    _run_jobs(app)
+    assert client.get('/api/jobs/1').json['result']['changed'] == 0
+
+    client.post('/api/jobs', json={'kind': 'recost',
+                                   'params': {'apply': True, 'input_costs': {run_id: 200}}})
+    _run_jobs(app)
+    result = client.get('/api/jobs/2').json['result']
+    assert result['changed'] == 2 and result['cost_delta'] == 100
+
+    db.session.expire_all()
+    output = ProductionOutput.query.filter_by(run_id=run_id, part_id=oring.id).one()
+    delta = Decimal(str(output.allocated_cost)) / 2
+    value_after = ledger.balances_at(db.session, company_id)[('part', oring.id)][1]
+    assert value_after - value_before == delta
+    cost = ItemCost.query.filter_by(company_id=company_id, reference_type='part',
+                                    reference_id=oring.id).one()
+    # Layer unit costs are stored to 4 places
+    assert abs(Decimal(str(cost.fifo_value)) - value_after) < Decimal('0.01')
+    assert Decimal(str(_part('Oring').avg_cost)) == Decimal(str(cost.avg_cost))
+
+
+def test_recost_rejects_bad_input_costs(app, client):
+    client.post('/api/jobs', json={'kind': 'recost', 'params': {'input_costs': {'1': 'x'}}})
+    _run_jobs(app)
+    job = client.get('/api/jobs/1').json
+    assert job['status'] == 'failed' and 'must be a number' in job['error']
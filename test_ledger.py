@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import ITEM_MODELS, ledger
+from database import RawMaterial, db
+
+
+def _on_hand(company_id):
+    return {(kind, row.id): Decimal(str(row.current_stock or 0))
+            for kind, model in ITEM_MODELS.items()
+            for row in model.query.filter_by(company_id=company_id)}
+
+
+def _balances(company_id, as_of=None):
+    balances = ledger.balances_at(db.session, company_id, as_of=as_of)
+    return {key: quantity for key, (quantity, _) in balances.items()}
+
+
+def _assert_matches(balances, on_hand):
+    for key, quantity in on_hand.items():
+        assert balances.get(key, Decimal(0)) == quantity, key
+
+
+def _move(kind, reference_type, reference_id, quantity, **extra):
+    return dict(transaction_type=kind, reference_type=reference_type,
+                reference_id=reference_id, quantity=quantity, **extra)
+
+
+def test_balances_and_checkpoints_match_current_stock(app, company_id):
+    start = datetime.utcnow() + timedelta(minutes=1)
+    ledger.post(db.session, company_id, [
+        _move('PURCHASE', 'material', 1, 100, unit_price=5),
+        _move('PRODUCTION', 'material', 2, -10, total_value=-2200),
+        _move('PRODUCTION', 'part', 1, 20, total_value=2200),
+        _move('SALE', 'product', 1, -3, unit_price=60),
+    ], now=start)
+    db.session.commit()
+    before_checkpoint = _on_hand(company_id)
+
+    ledger.checkpoint(db.session, company_id, now=start + timedelta(minutes=1))
+    ledger.post(db.session, company_id, [
+        _move('PURCHASE', 'material', 1, 7, unit_price=6),
+        _move('ADJUSTMENT', 'part', 2, -4),
+        _move('SALE', 'product', 2, -1),
+    ], now=start + timedelta(minutes=2))
+    db.session.commit()
+
+    _assert_matches(_balances(company_id), _on_hand(company_id))
+    # Before the checkpoint: replayed from the ledger alone
+    _assert_matches(_balances(company_id, start + timedelta(seconds=30)), before_checkpoint)
+    # Between the checkpoint and the later rows: the checkpoint alone
+    _assert_matches(_balances(company_id, start + timedelta(seconds=90)), before_checkpoint)
+
+
+def test_sales_are_valued_at_cost(app, company_id):
+    material = db.session.get(RawMaterial, 1)
+    avg_cost = Decimal(str(material.avg_cost))
+    ledger.post(db.session, company_id, [_move('SALE', 'material', 1, -4, unit_price=10000)])
+    db.session.commit()
+    quantity, value = ledger.balances_at(db.session, company_id)[('material', 1)]
+    assert value == quantity * avg_cost
+
+
+@pytest.mark.parametrize('movement, error', [
+    (_move('PURCHASE', 'material', 1, 'abc'), 'quantity must be a number'),
+    (_move('PURCHASE', 'material', 1, -10), 'PURCHASE quantity must be positive'),
+    (_move('SALE', 'material', 1, 5), 'SALE quantity must be negative'),
+    (_move('PURCHASE', 'material', 1, 5, unit_price='x'), 'unit_price must be a number'),
+    (_move('PURCHASE', 'part', 1, 0.5), 'part quantity must be a whole number'),
+    (_move('SALE', 'product', 1, -1.5), 'product quantity must be a whole number'),
+])
+def test_invalid_movements_are_rejected(app, company_id, movement, error):
+    with pytest.raises(ValueError, match=error):
+        ledger.post(db.session, company_id, [movement])
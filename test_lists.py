@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize('query, error', [('limit=abc', 'Invalid limit'),
+                                          ('after=abc', 'Invalid cursor')])
+def test_bad_paging_params_are_rejected(client, query, error):
+    response = client.get(f'/api/parts?{query}')
+    assert response.status_code == 400
+    assert response.json['error'] == error
+
+
+def test_keyset_pages_cover_the_collection(client):
+    everything = client.get('/api/parts').json
+    items, after = [], 0
+    while after is not None:
+        page = client.get(f'/api/parts?limit=4&after={after}').json
+        items += page['items']
+        after = page['next_cursor']
+    assert items == everything
@@ -0,0 +1,39 @@
+import re
+
+from app import create_app
+from metrics import normalize
+
+
+def _sample(body, name, endpoint):
+    match = re.search(rf'^{name}{{endpoint="{endpoint}",method="GET",status="200"}} (\S+)$',
+                      body, re.M)
+    return float(match.group(1)) if match else 0
+
+
+def test_streamed_list_queries_are_counted(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    response = client.get('/api/materials')
+    response.get_data()
+    response.close()
+    after = client.get('/metrics').get_data(as_text=True)
+    name = 'db_queries_per_request'
+    assert _sample(after, f'{name}_count', 'inventory.materials_api') == \
+        _sample(before, f'{name}_count', 'inventory.materials_api') + 1
+    assert _sample(after, f'{name}_sum', 'inventory.materials_api') - \
+        _sample(before, f'{name}_sum', 'inventory.materials_api') >= 1
+
+
+def test_metrics_endpoint_access(tmp_path, monkeypatch):
+    uri = f"sqlite:///{tmp_path / 'metrics.db'}"
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    assert create_app({'SQLALCHEMY_DATABASE_URI': uri}).test_client().get('/metrics').status_code == 404
+
+    monkeypatch.setenv('METRICS_TOKEN', 'scrape-me')
+    client = create_app({'SQLALCHEMY_DATABASE_URI': uri}).test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
+
+
+def test_normalize_collapses_in_lists():
+    assert normalize('SELECT *\n  FROM parts WHERE id IN (?, ?, ?)') == \
+        normalize('SELECT * FROM parts WHERE id IN (?, ?)') == 'SELECT * FROM parts WHERE id IN (?)'
@@ -0,0 +1,21 @@
+from sqlalchemy import inspect, text
+
+from app import create_app
+from database import db
+from migrations import MIGRATIONS, upgrade
+
+
+def test_upgrade_adds_missing_indexes_once(tmp_path):
+    app = create_app({'TESTING': True,
+                      'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'old.db'}"})
+    with app.app_context():
+        # Tables as an older release created them: no tenant index, no version table
+        db.create_all()
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_raw_materials_company_id'))
+
+        assert upgrade(db.engine, db.metadata) == [number for number, _, _ in MIGRATIONS]
+        indexes = {ix['name'] for ix in inspect(db.engine).get_indexes('raw_materials')}
+        assert 'ix_raw_materials_company_id' in indexes
+        assert upgrade(db.engine, db.metadata) == []
+        db.engine.dispose()
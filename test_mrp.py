@@ -0,0 +1,28 @@
+import pytest
+
+from app import _resolve_products
+from database import Product
+
+
+def _product_id(company_id, name, size):
+    return Product.query.filter_by(company_id=company_id, name=name, size=size).one().id
+
+
+@pytest.mark.parametrize('item, name, size', [
+    ({'name': 'MG', 'quantity': 500}, 'MG', 'Standard'),
+    ({'name': 'Open 50mm', 'quantity': 500}, 'Open', '50mm'),
+    ({'name': 'Single Robin', 'quantity': 500}, 'Single Robin', 'Standard'),
+    ({'name': 'Open', 'size': '75mm', 'quantity': 500}, 'Open', '75mm'),
+])
+def test_products_resolve_by_name(app, company_id, item, name, size):
+    assert _resolve_products(company_id, [item]) == {_product_id(company_id, name, size): 500}
+
+
+def test_ambiguous_name_lists_sizes(app, company_id):
+    with pytest.raises(ValueError, match='Open comes in several sizes: 100mm, 50mm, 75mm'):
+        _resolve_products(company_id, [{'name': 'Open', 'quantity': 1}])
+
+
+def test_plan_accepts_name_only_lines(client):
+    response = client.post('/api/mrp/plan', json={'items': [{'name': 'MG', 'quantity': 500}]})
+    assert response.status_code == 200
@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+import pytest
+
+from database import Part, ProductionOutput, ProductionRun, RawMaterial, db
+
+
+def _run(client, material, parts, **overrides):
+    data = dict(post=True, input_material_id=material.id, input_quantity=10, input_cost=1000,
+                outputs=[{'part_id': parts[0].id, 'quantity': 30, 'weight': 0.2},
+                         {'part_id': parts[1].id, 'quantity': 20, 'weight': 0.2}])
+    data.update(overrides)
+    return client.post('/api/production/run', json=data)
+
+
+@pytest.fixture
+def material(company_id):
+    return RawMaterial.query.filter_by(company_id=company_id).order_by(RawMaterial.id).first()
+
+
+@pytest.fixture
+def parts(company_id):
+    return Part.query.filter_by(company_id=company_id).order_by(Part.id).limit(2).all()
+
+
+def test_posted_run_moves_stock_and_records_outputs(client, material, parts):
+    stock_before = {p.id: p.current_stock for p in parts}
+    material_before = material.current_stock
+    response = _run(client, material, parts)
+    assert response.status_code == 200, response.json
+
+    run = db.session.get(ProductionRun, response.json['run_id'])
+    assert run.input_cost == Decimal(1000)
+    outputs = ProductionOutput.query.filter_by(run_id=run.id).order_by(ProductionOutput.id).all()
+    assert [o.allocated_cost for o in outputs] == [Decimal(600), Decimal(400)]
+    assert db.session.get(RawMaterial, material.id).current_stock == material_before - 10
+    assert [db.session.get(Part, p.id).current_stock - stock_before[p.id] for p in parts] == [30, 20]
+
+
+@pytest.mark.parametrize('overrides', [
+    {'input_quantity': -1},
+    {'input_cost': 'lots'},
+    {'input_quantity': 10 ** 9},
+    {'outputs': [{'part_name': 'No such part', 'quantity': 1}]},
+])
+def test_invalid_runs_are_rejected_without_writing(client, material, parts, overrides):
+    runs = ProductionRun.query.count()
+    response = _run(client, material, parts, **overrides)
+    assert response.status_code == 400
+    assert ProductionRun.query.count() == runs
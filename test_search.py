@@ -0,0 +1,40 @@
+import pytest
+
+from app import ITEM_MODELS, catalog_search
+from database import CollectionVersion, db
+from search import CatalogSearch
+
+
+@pytest.fixture(params=['auto', 'memory'])
+def search(request, app):
+    if request.param == 'auto':
+        return catalog_search
+    return CatalogSearch(ITEM_MODELS, CollectionVersion, env={'SEARCH_BACKEND': 'memory'})
+
+
+def _names(results):
+    return [item['name'] for item in results['items']]
+
+
+@pytest.mark.parametrize('query', ['viton', 'vit', 'vition'])
+def test_exact_prefix_and_misspelt_words_match(search, company_id, query):
+    assert _names(search.search(db.session, company_id, query))[0] == 'Rubber Sheet - Viton'
+
+
+def test_facets_count_every_match_before_filters(search, company_id):
+    everything = search.search(db.session, company_id, 'ring')
+    parts = search.search(db.session, company_id, 'ring', item_type='part')
+    assert parts['facets'] == everything['facets']
+    assert parts['total'] == everything['facets']['item_type']['part'] < everything['total']
+    assert {item['item_type'] for item in parts['items']} == {'part'}
+
+
+def test_new_items_are_searchable(search, client, company_id):
+    search.search(db.session, company_id, 'graphite')  # warm the memory index
+    client.post('/api/materials', json={'name': 'Graphite Foil', 'unit': 'kg'})
+    assert _names(search.search(db.session, company_id, 'graphite')) == ['Graphite Foil']
+
+
+def test_search_api_rejects_bad_input(client):
+    assert client.get('/api/search?q=').status_code == 400
+    assert client.get('/api/search?q=viton&item_type=widget').status_code == 400
@@ -0,0 +1,35 @@
+from database import Product
+
+
+def _register(app, email, company):
+    client = app.test_client()
+    client.post('/register', data={'email': email, 'password': 'secret', 'company_name': company})
+    return client
+
+
+def _names(client, path):
+    with client.get(path) as response:
+        return [item['name'] for item in response.json]
+
+
+def test_companies_only_see_their_own_inventory(app, client):
+    other = _register(app, 'owner@acme.test', 'Acme')
+    assert _names(other, '/api/materials') == []
+    assert other.post('/api/materials', json={'name': 'Acme steel', 'unit': 'kg'}).status_code == 200
+    assert _names(other, '/api/materials') == ['Acme steel']
+    assert 'Acme steel' not in _names(client, '/api/materials')
+
+    product = Product.query.order_by(Product.id).first()
+    assert client.get(f'/api/products/{product.id}/bom').status_code == 200
+    assert other.get(f'/api/products/{product.id}/bom').status_code == 404
+
+
+def test_colleagues_share_the_company_inventory(app, client):
+    added = client.post('/api/company/users', json={'email': 'clerk@example.com', 'password': 'clerk'})
+    assert added.status_code == 200
+    colleague = app.test_client()
+    colleague.post('/login', data={'email': 'clerk@example.com', 'password': 'clerk'})
+    assert _names(colleague, '/api/materials') == _names(client, '/api/materials')
+    # Only admins add accounts
+    denied = colleague.post('/api/company/users', json={'email': 'x@example.com', 'password': 'x'})
+    assert denied.status_code == 403
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from app import ledger
+from database import CostLayer, ItemCost, RawMaterial, ValuationPeriod, db
+
+
+def _move(kind, reference_type, reference_id, quantity, **extra):
+    return dict(transaction_type=kind, reference_type=reference_type,
+                reference_id=reference_id, quantity=quantity, **extra)
+
+
+def test_fifo_consumes_oldest_layers_first(app, company_id):
+    material = RawMaterial(company_id=company_id, name='FIFO test', unit='kg', current_stock=0,
+                           avg_cost=0)
+    db.session.add(material)
+    db.session.commit()
+    start = datetime(2024, 1, 1)  # all in one valuation period
+    for minute, unit_price in enumerate((1, 2, 4)):
+        ledger.post(db.session, company_id,
+                    [_move('PURCHASE', 'material', material.id, 10, unit_price=unit_price)],
+                    now=start + timedelta(minutes=minute))
+    ledger.post(db.session, company_id, [_move('SALE', 'material', material.id, -15)],
+                now=start + timedelta(minutes=3))
+    ledger.post(db.session, company_id, [_move('ADJUSTMENT', 'material', material.id, -10)],
+                now=start + timedelta(minutes=4))
+    db.session.commit()
+
+    layers = (CostLayer.query
+              .filter_by(company_id=company_id, reference_type='material',
+                         reference_id=material.id)
+              .order_by(CostLayer.received_at).all())
+    assert [Decimal(str(layer.remaining)) for layer in layers] == [0, 0, 5]
+
+    cost = ItemCost.query.filter_by(company_id=company_id, reference_type='material',
+                                    reference_id=material.id).one()
+    assert Decimal(str(cost.fifo_value)) == 20
+    period = ValuationPeriod.query.filter_by(company_id=company_id, reference_type='material',
+                                             reference_id=material.id).one()
+    # The sale takes all of the first layer and half of the second
+    assert Decimal(str(period.cogs_fifo)) == 10 * 1 + 5 * 2
+    assert Decimal(str(period.cost_out_fifo)) == 10 * 1 + 10 * 2 + 5 * 4
+
+
+def test_item_average_follows_valuation(app, company_id):
+    """One moving average: the item column is the one valuation keeps"""
+    ledger.post(db.session, company_id, [_move('ADJUSTMENT', 'material', 1, 500, unit_price=1)])
+    db.session.commit()
+    cost = ItemCost.query.filter_by(company_id=company_id, reference_type='material',
+                                    reference_id=1).one()
+    assert Decimal(str(cost.avg_cost)) == Decimal('90.5')
+    assert Decimal(str(db.session.get(RawMaterial, 1).avg_cost)) == Decimal('90.5')
@@ -0,0 +1,406 @@
+# valuation.py - Moving-average and FIFO inventory valuation, kept incrementally
+#
+# Valuation is a Ledger listener: every posted movement updates, in the same
+# transaction,
+#   item_costs         per item: on-hand quantity, moving-average cost and
+#                      FIFO value (the sum of its open cost layers)
+#   cost_layers        FIFO receipt layers with the quantity still on hand
+#   valuation_periods  per item and month: receipts, issues at FIFO and at
+#                      average cost, and for sales revenue and COGS
+# and the moving average is written back to the item's own avg_cost column,
+# so the valuation, COGS and margin reports read a few pre-aggregated rows
+# instead of replaying the ledger. rebuild() replays it once for history
+# written before these tables existed.
+#
+# Receipts enter at their unit_price, or at the current average when they
+# carry none (e.g. unpriced adjustments and customer returns). Issues with no
+# open layer left (negative stock) are costed at the average. A REVALUATION
+# (quantity 0) spreads its value change over the open layers.
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+PERIOD_FORMAT = '%Y-%m'
+PERIOD_FIELDS = ('qty_in', 'value_in', 'qty_out', 'cost_out_fifo', 'cost_out_avg',
+                 'qty_sold', 'revenue', 'cogs_fifo', 'cogs_avg')
+
+
+def _dec(value):
+    return Decimal(str(value or 0))
+
+
+def _round(value):
+    return round(value, 4)
+
+
+class Valuation:
+    """Maintains and reports cost state for the items of a Ledger.
+
+    `items` is the same reference_type -> model mapping the Ledger uses;
+    models with selling_price price sales posted without a unit_price,
+    models with last_purchase_rate get it set from purchases, and models with
+    avg_cost get the moving average kept here, so there is only one.
+    """
+
+    def __init__(self, cost_model, layer_model, period_model, items):
+        self.cost = cost_model
+        self.layer = layer_model
+        self.period = period_model
+        self.items = items
+
+    def average_costs(self, session, company_id, keys):
+        """{(reference_type, reference_id): moving-average unit cost}"""
+        return {key: item['avg_cost']
+                for key, item in self._load_state(session, company_id, keys).items()}
+
+    # ---------- maintenance ----------
+
+    def on_post(self, session, company_id, changed, rows):
+        """Ledger hook: value `rows`, the ledger rows just written"""
+        if not rows:
+            return
+        keys = {(r['reference_type'], r['reference_id']) for r in rows}
+        # Issues and revaluations (quantity 0) work on the open layers
+        issued = {(r['reference_type'], r['reference_id']) for r in rows if _dec(r['quantity']) <= 0}
+        state = self._load_state(session, company_id, keys)
+        layers = self._load_layers(session, company_id, issued)
+        prices = self._selling_prices(session, company_id, rows)
+
+        new_layers, consumed, repriced, purchase_rates, received = [], {}, {}, {}, set()
+        periods = defaultdict(lambda: dict.fromkeys(PERIOD_FIELDS, Decimal(0)))
+        for row in rows:
+            key = (row['reference_type'], row['reference_id'])
+            item = state[key]
+            quantity = _dec(row['quantity'])
+            kind = row['transaction_type']
+            totals = periods[(row['transaction_date'].strftime(PERIOD_FORMAT),) + key]
+
+            if quantity > 0:
+                priced = row.get('unit_price') is not None and kind != 'SALE'
+                unit_cost = _dec(row['unit_price']) if priced else item['avg_cost']
+                value = quantity * unit_cost
+                on_hand = max(item['quantity'], Decimal(0))
+                item['avg_cost'] = (on_hand * item['avg_cost'] + value) / (on_hand + quantity)
+                received.add(key)
+                item['quantity'] += quantity
+                item['fifo_value'] += value
+                layer = {'company_id': company_id, 'reference_type': key[0], 'reference_id': key[1],
+                         'quantity': quantity, 'remaining': quantity, 'unit_cost': unit_cost,
+                         'received_at': row['transaction_date']}
+                new_layers.append(layer)
+                layers[key].append(layer)
+                totals['qty_in'] += quantity
+                totals['value_in'] += value
+                if kind == 'PURCHASE' and priced:
+                    purchase_rates[key] = unit_cost
+
+            elif quantity < 0:
+                issue = -quantity
+                fifo_cost = self._consume(layers[key], issue, item['avg_cost'], consumed)
+                avg_cost = issue * item['avg_cost']
+                item['quantity'] -= issue
+                item['fifo_value'] -= fifo_cost
+                totals['qty_out'] += issue
+                totals['cost_out_fifo'] += fifo_cost
+                totals['cost_out_avg'] += avg_cost
+                if kind == 'SALE':
+                    # A sale's total_value is its cost; unit_price is the selling price
+                    if row.get('unit_price') is not None:
+                        revenue = issue * _dec(row['unit_price'])
+                    else:
+                        revenue = issue * prices.get(key, Decimal(0))
+                    totals['qty_sold'] += issue
+                    totals['revenue'] += revenue
+                    totals['cogs_fifo'] += fifo_cost
+                    totals['cogs_avg'] += avg_cost
+
+            elif row.get('total_value') is not None:
+                # Revaluation: spread over the stock on hand; with none left the
+                # change belongs to what was already issued
+                delta = _dec(row['total_value'])
+                on_hand = max(item['quantity'], Decimal(0))
+                totals['value_in'] += delta
+                if on_hand > 0:
+                    item['avg_cost'] += delta / on_hand
+                    item['fifo_value'] += delta
+                    self._reprice(layers[key], delta, repriced)
+                    received.add(key)
+                else:
+                    totals['cost_out_fifo'] += delta
+                    totals['cost_out_avg'] += delta
+
+        self._save_state(session, company_id, state)
+        self._save_layers(session, new_layers, consumed, repriced)
+        self._save_periods(session, company_id, periods)
+        self._save_purchase_rates(session, purchase_rates)
+        self._save_item_averages(session, {key: state[key]['avg_cost'] for key in received})
+
+    @staticmethod
+    def _consume(open_layers, quantity, avg_cost, consumed):
+        """Take `quantity` from the oldest layers; returns its FIFO cost"""
+        cost = Decimal(0)
+        while quantity > 0 and open_layers:
+            layer = open_layers[0]
+            take = min(layer['remaining'], quantity)
+            layer['remaining'] -= take
+            quantity -= take
+            cost += take * layer['unit_cost']
+            if 'id' in layer:
+                consumed[layer['id']] = layer['remaining']
+            if layer['remaining'] <= 0:
+                open_layers.pop(0)
+        # Issued beyond the open layers: nothing recorded to take it from
+        return cost + quantity * avg_cost
+
+    @staticmethod
+    def _reprice(open_layers, delta, repriced):
+        """Add `delta` to the value of the open layers, pro rata to what remains"""
+        remaining = sum(layer['remaining'] for layer in open_layers)
+        if remaining <= 0:
+            return
+        for layer in open_layers:
+            layer['unit_cost'] += delta / remaining
+            if 'id' in layer:
+                repriced[layer['id']] = layer['unit_cost']
+
+    def _load_state(self, session, company_id, keys):
+        cost = self.cost
+        by_type = defaultdict(set)
+        for reference_type, reference_id in keys:
+            by_type[reference_type].add(reference_id)
+        state = {}
+        for reference_type, ids in by_type.items():
+            for row in session.execute(
+                    select(cost.id, cost.reference_id, cost.quantity, cost.avg_cost, cost.fifo_value)
+                    .where(cost.company_id == company_id, cost.reference_type == reference_type,
+                           cost.reference_id.in_(ids))):
+                state[(reference_type, row.reference_id)] = {
+                    'id': row.id, 'quantity': _dec(row.quantity), 'avg_cost': _dec(row.avg_cost),
+                    'fifo_value': _dec(row.fifo_value)}
+        for key in keys:
+            state.setdefault(key, {'id': None, 'quantity': Decimal(0), 'avg_cost': Decimal(0),
+                                   'fifo_value': Decimal(0)})
+        return state
+
+    def _load_layers(self, session, company_id, keys):
+        layer = self.layer
+        layers = defaultdict(list)
+        by_type = defaultdict(set)
+        for reference_type, reference_id in keys:
+            by_type[reference_type].add(reference_id)
+        for reference_type, ids in by_type.items():
+            for row in session.execute(
+                    select(layer.id, layer.reference_id, layer.remaining, layer.unit_cost)
+                    .where(layer.company_id == company_id, layer.reference_type == reference_type,
+                           layer.reference_id.in_(ids), layer.remaining > 0)
+                    .order_by(layer.id)):
+                layers[(reference_type, row.reference_id)].append({
+                    'id': row.id, 'remaining': _dec(row.remaining), 'unit_cost': _dec(row.unit_cost)})
+        return layers
+
+    def _selling_prices(self, session, company_id, rows):
+        """List prices for sales posted without a price"""
+        wanted = defaultdict(set)
+        for row in rows:
+            if row['transaction_type'] == 'SALE' and row.get('unit_price') is None:
+                wanted[row['reference_type']].add(row['reference_id'])
+        prices = {}
+        for reference_type, ids in wanted.items():
+            model = self.items[reference_type]
+            if not hasattr(model, 'selling_price'):
+                continue
+            for item_id, price in session.execute(
+                    select(model.id, model.selling_price)
+                    .where(model.company_id == company_id, model.id.in_(ids))):
+                prices[(reference_type, item_id)] = _dec(price)
+        return prices
+
+    def _save_state(self, session, company_id, state):
+        now = datetime.utcnow()
+        table = self.cost.__table__
+        values = [{'quantity': _round(s['quantity']), 'avg_cost': _round(s['avg_cost']),
+                   'fifo_value': _round(s['fifo_value']), 'updated_at': now, 'id': s['id'],
+                   'reference_type': key[0], 'reference_id': key[1]}
+                  for key, s in state.items()]
+        known = [v for v in values if v['id'] is not None]
+        if known:
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(quantity=bindparam('b_quantity', type_=table.c.quantity.type),
+                        avg_cost=bindparam('b_avg', type_=table.c.avg_cost.type),
+                        fifo_value=bindparam('b_fifo', type_=table.c.fifo_value.type),
+                        updated_at=bindparam('b_now')),
+                [{'b_id': v['id'], 'b_quantity': v['quantity'], 'b_avg': v['avg_cost'],
+                  'b_fifo': v['fifo_value'], 'b_now': now} for v in known])
+        new = [v for v in values if v['id'] is None]
+        if new:
+            session.execute(insert(table), [
+                dict({k: v[k] for k in ('reference_type', 'reference_id', 'quantity', 'avg_cost',
+                                        'fifo_value', 'updated_at')}, company_id=company_id)
+                for v in new])
+
+    def _save_layers(self, session, new_layers, consumed, repriced=None):
+        table = self.layer.__table__
+        if new_layers:
+            session.execute(insert(table), [
+                dict(layer, quantity=_round(layer['quantity']), remaining=_round(layer['remaining']),
+                     unit_cost=_round(layer['unit_cost']))
+                for layer in new_layers])
+        if consumed:
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(remaining=bindparam('b_remaining', type_=table.c.remaining.type)),
+                [{'b_id': i, 'b_remaining': _round(r)} for i, r in consumed.items()])
+        if repriced:
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(unit_cost=bindparam('b_unit_cost', type_=table.c.unit_cost.type)),
+                [{'b_id': i, 'b_unit_cost': _round(c)} for i, c in repriced.items()])
+
+    def _save_periods(self, session, company_id, periods):
+        """Add the batch totals to existing period rows; insert the rest"""
+        table = self.period.__table__
+        existing = {}
+        by_period = defaultdict(set)
+        for period, reference_type, reference_id in periods:
+            by_period[(period, reference_type)].add(reference_id)
+        for (period, reference_type), ids in by_period.items():
+            for row_id, reference_id in session.execute(
+                    select(table.c.id, table.c.reference_id)
+                    .where(table.c.company_id == company_id, table.c.period == period,
+                           table.c.reference_type == reference_type,
+                           table.c.reference_id.in_(ids))):
+                existing[(period, reference_type, reference_id)] = row_id
+
+        updates = [dict({'b_id': existing[key]},
+                        **{f'b_{f}': _round(totals[f]) for f in PERIOD_FIELDS})
+                   for key, totals in periods.items() if key in existing]
+        if updates:
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(**{f: table.c[f] + bindparam(f'b_{f}', type_=table.c[f].type)
+                           for f in PERIOD_FIELDS}),
+                updates)
+        inserts = [dict({'company_id': company_id, 'period': key[0], 'reference_type': key[1],
+                         'reference_id': key[2]}, **{f: _round(totals[f]) for f in PERIOD_FIELDS})
+                   for key, totals in periods.items() if key not in existing]
+        if inserts:
+            session.execute(insert(table), inserts)
+
+    def _save_purchase_rates(self, session, purchase_rates):
+        by_type = defaultdict(list)
+        for (reference_type, reference_id), rate in purchase_rates.items():
+            by_type[reference_type].append({'b_id': reference_id, 'b_rate': _round(rate)})
+        for reference_type, values in by_type.items():
+            table = self.items[reference_type].__table__
+            if 'last_purchase_rate' not in table.c:
+                continue
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(last_purchase_rate=bindparam('b_rate', type_=table.c.last_purchase_rate.type)),
+                values)
+
+    def _save_item_averages(self, session, averages):
+        by_type = defaultdict(list)
+        for (reference_type, reference_id), avg_cost in averages.items():
+            by_type[reference_type].append({'b_id': reference_id, 'b_avg': _round(avg_cost)})
+        for reference_type, values in by_type.items():
+            table = self.items[reference_type].__table__
+            if 'avg_cost' not in table.c:
+                continue
+            session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(avg_cost=bindparam('b_avg', type_=table.c.avg_cost.type)),
+                values)
+
+    def rebuild(self, session, company_id, transaction_model, batch_size=1000):
+        """Drop a company's cost state and replay its whole ledger; caller commits"""
+        for model in (self.cost, self.layer, self.period):
+            session.execute(delete(model).where(model.company_id == company_id))
+        tx = transaction_model
+        columns = (tx.id, tx.transaction_type, tx.reference_type, tx.reference_id, tx.quantity,
+                   tx.unit_price, tx.total_value, tx.transaction_date)
+        after, replayed = 0, 0
+        while True:
+            batch = session.execute(
+                select(*columns).where(tx.company_id == company_id, tx.id > after)
+                .order_by(tx.id).limit(batch_size)
+            ).all()
+            if not batch:
+                return replayed
+            after = batch[-1].id
+            rows = [dict(r._mapping) for r in batch if r.reference_type in self.items]
+            for row in rows:
+                row['transaction_date'] = row['transaction_date'] or datetime.utcnow()
+            self.on_post(session, company_id, None, rows)
+            replayed += len(batch)
+
+    # ---------- reports ----------
+
+    def stock(self, session, company_id, reference_type=None):
+        """Current quantity and value per item, at moving average and FIFO"""
+        cost = self.cost
+        stmt = (select(cost.reference_type, cost.reference_id, cost.quantity, cost.avg_cost,
+                       cost.fifo_value)
+                .where(cost.company_id == company_id, cost.quantity != 0)
+                .order_by(cost.reference_type, cost.reference_id))
+        if reference_type is not None:
+            stmt = stmt.where(cost.reference_type == reference_type)
+        return [{
+            'reference_type': r.reference_type,
+            'reference_id': r.reference_id,
+            'quantity': _dec(r.quantity),
+            'avg_cost': _dec(r.avg_cost),
+            'value_avg': _dec(r.quantity) * _dec(r.avg_cost),
+            'value_fifo': _dec(r.fifo_value),
+        } for r in session.execute(stmt)]
+
+    def periods(self, session, company_id, start=None, end=None, reference_type=None):
+        """Per-month totals with the closing stock value at FIFO and at average.
+
+        Closing values are running sums of each month's receipts less issues,
+        so the cost grows with the number of months, not of movements.
+        """
+        table = self.period
+        stmt = (select(table.period, *(func.sum(table.__table__.c[f]) for f in PERIOD_FIELDS))
+                .where(table.company_id == company_id)
+                .group_by(table.period).order_by(table.period))
+        if end is not None:
+            stmt = stmt.where(table.period <= end)
+        if reference_type is not None:
+            stmt = stmt.where(table.reference_type == reference_type)
+        closing_fifo = closing_avg = Decimal(0)
+        result = []
+        for row in session.execute(stmt):
+            totals = {f: _dec(v) for f, v in zip(PERIOD_FIELDS, row[1:])}
+            closing_fifo += totals['value_in'] - totals['cost_out_fifo']
+            closing_avg += totals['value_in'] - totals['cost_out_avg']
+            if start is not None and row.period < start:
+                continue
+            result.append(dict(totals, period=row.period, closing_value_fifo=closing_fifo,
+                               closing_value_avg=closing_avg,
+                               margin_fifo=totals['revenue'] - totals['cogs_fifo'],
+                               margin_avg=totals['revenue'] - totals['cogs_avg']))
+        return result
+
+    def margins(self, session, company_id, start=None, end=None, reference_type='product'):
+        """Sales, COGS and margin per item over a range of months"""
+        table = self.period
+        stmt = (select(table.reference_id, func.sum(table.qty_sold), func.sum(table.revenue),
+                       func.sum(table.cogs_fifo), func.sum(table.cogs_avg))
+                .where(table.company_id == company_id, table.reference_type == reference_type,
+                       table.qty_sold > 0)
+                .group_by(table.reference_id).order_by(table.reference_id))
+        if start is not None:
+            stmt = stmt.where(table.period >= start)
+        if end is not None:
+            stmt = stmt.where(table.period <= end)
+        return [{
+            'reference_id': reference_id,
+            'qty_sold': _dec(qty),
+            'revenue': _dec(revenue),
+            'cogs_fifo': _dec(fifo),
+            'cogs_avg': _dec(avg),
+        } for reference_id, qty, revenue, fifo, avg in session.execute(stmt)]